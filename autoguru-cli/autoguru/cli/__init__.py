@@ -1,12 +1,12 @@
 import importlib
+from pathlib import Path
 from types import ModuleType
 from typing import Any, Callable, Dict, List, Optional
 
 import click
-import pkg_resources
 
 __version__ = (
-    pkg_resources.resource_string("autoguru.cli", "VERSION.txt").decode("UTF-8").strip()
+    Path(__file__).with_name("VERSION.txt").read_text(encoding="UTF-8").strip()
 )
 
 
@@ -111,9 +111,9 @@ def delegate(
         return group.group(
             cls=DynamicGroup,
             module_name=module_name,
-            group_name=subgroup_name
-            if subgroup_name is not None
-            else function.__name__,
+            group_name=(
+                subgroup_name if subgroup_name is not None else function.__name__
+            ),
             preload_hook=preload_hook,
             help=help,
         )(function)
@@ -1,3 +1,8 @@
+import json
+import shlex
+from functools import partial
+from typing import Optional, Tuple
+
 import click
 
 from autoguru.cli import __version__, delegate
@@ -5,8 +10,54 @@ from autoguru.cli import __version__, delegate
 
 @click.group(help="AutoGuru CLI Application")
 @click.version_option(version=__version__)
-def autoguru() -> None:
-    pass
+@click.option(
+    "--profile",
+    type=click.Path(dir_okay=False, writable=True),
+    default=None,
+    help="profile the command and write its collapsed stacks to this file for flamegraph.pl or speedscope. A summary of the hottest functions is printed to standard error. Worker processes aren't profiled.",
+)
+@click.option(
+    "--profiler",
+    type=click.Choice(["sampling", "deterministic"]),
+    default="sampling",
+    help="whether to sample stacks, which is cheap, or time every call, which is exact but slows the command down",
+    show_default=True,
+)
+@click.option(
+    "--profile-interval",
+    default=5.0,
+    help="how many milliseconds between samples (sampling only)",
+    show_default=True,
+)
+@click.option(
+    "--spans",
+    is_flag=True,
+    help="print how long the embed, classify, nearest neighbor and database stages took, nested, to standard error",
+)
+@click.pass_context
+def autoguru(
+    ctx: click.Context,
+    profile: Optional[str] = None,
+    profiler: str = "sampling",
+    profile_interval: float = 5.0,
+    spans: bool = False,
+) -> None:
+    if profile is None and not spans:
+        return
+
+    # Profiling starts before the subcommand's module is imported by its DynamicGroup, so imports are profiled too, and
+    # it stops once the subcommand has finished
+    from autoguru.cli import profiling
+
+    ctx.call_on_close(
+        profiling.start(
+            path=profile,
+            profiler=profiler,
+            interval=profile_interval / 1000.0,
+            spans=spans,
+            report=partial(click.echo, err=True),
+        )
+    )
 
 
 @delegate(
@@ -38,5 +89,56 @@ def discord() -> None:
     pass
 
 
+@autoguru.command(
+    name="startup",
+    help="Times cold starts of CLI commands and exits with an error if any is over budget",
+)
+@click.option(
+    "-C",
+    "--command",
+    "commands",
+    multiple=True,
+    help="the arguments of a command to time, like 'qa --help'. Can be given more than once.  [default --version, --help and each subcommand's --help]",
+)
+@click.option(
+    "-r",
+    "--runs",
+    default=5,
+    help="how many times to start each command",
+    show_default=True,
+)
+@click.option(
+    "-b",
+    "--budget",
+    default=500.0,
+    help="the most milliseconds a command's median start can take",
+    show_default=True,
+)
+@click.option(
+    "-f",
+    "--forbid",
+    multiple=True,
+    help="a top level package the commands shouldn't import. Can be given more than once.  [default FastAPI, TensorFlow, Tortoise and other heavy packages]",
+)
+def startup(
+    commands: Tuple[str, ...] = (),
+    runs: int = 5,
+    budget: float = 500.0,
+    forbid: Tuple[str, ...] = (),
+) -> None:
+    from autoguru.cli import startup as startups
+
+    options = {}
+    if commands:
+        options["commands"] = [shlex.split(command) for command in commands]
+    if forbid:
+        options["forbidden"] = list(forbid)
+    report = startups.benchmark(runs=runs, budget=budget, **options)
+
+    click.echo(json.dumps(report, indent=2))
+    if not report["ok"]:
+        raise click.exceptions.Exit(1)
+
+
 if __name__ == "__main__":
     autoguru(prog_name="autoguru")
@@ -0,0 +1,297 @@
+import os
+import sys
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import defaultdict
+from pathlib import Path
+from types import CodeType, FrameType
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+# The frames of one stack from the outermost call in, and the seconds spent with exactly that stack
+Stack = Tuple[str, ...]
+Stacks = Dict[Stack, float]
+
+
+class _FrameNames:
+    """
+    Names code objects like "function (package/module.py:line)" with paths relative to sys.path, so the names stay short
+    and don't contain the separator used in collapsed stacks.
+    """
+
+    def __init__(self) -> None:
+        self._names: Dict[CodeType, str] = {}
+        self._roots: List[str] = sorted(
+            (os.path.join(os.path.abspath(path), "") for path in sys.path if path),
+            key=len,
+            reverse=True,
+        )
+
+    def __call__(self, code: CodeType) -> str:
+        try:
+            return self._names[code]
+        except KeyError:
+            path = code.co_filename
+            for root in self._roots:
+                if path.startswith(root):
+                    path = path[len(root) :]
+                    break
+            name = f"{code.co_name} ({path}:{code.co_firstlineno})".replace(";", ",")
+            self._names[code] = name
+            return name
+
+
+class Profiler(ABC):
+    @abstractmethod
+    def start(self) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def stop(self) -> Stacks:
+        """
+        Stops profiling.
+
+        Returns:
+            The seconds spent in each distinct stack, rooted at the thread it ran in
+        """
+        raise NotImplementedError
+
+
+class SamplingProfiler(Profiler):
+    """
+    Samples the stack of every thread from a background thread. The overhead is low and doesn't depend on how many calls
+    are made, so it's the right choice for long index builds and batch runs.
+
+    Args:
+        interval (float): how many seconds to wait between samples
+    """
+
+    DEFAULT_INTERVAL: float = 0.005
+
+    def __init__(self, interval: float = DEFAULT_INTERVAL) -> None:
+        self._interval: float = interval
+        self._names: _FrameNames = _FrameNames()
+        self._samples: Dict[Stack, int] = defaultdict(int)
+        self._stopping: threading.Event = threading.Event()
+        self._sampler: Optional[threading.Thread] = None
+        self._started: float = 0.0
+        self._rounds: int = 0
+
+    def start(self) -> None:
+        self._samples.clear()
+        self._rounds = 0
+        self._stopping.clear()
+        self._sampler = threading.Thread(
+            target=self._sample, name="profiler-sampler", daemon=True
+        )
+        self._started = time.perf_counter()
+        self._sampler.start()
+
+    def stop(self) -> Stacks:
+        self._stopping.set()
+        if self._sampler is not None:
+            self._sampler.join()
+        elapsed = time.perf_counter() - self._started
+
+        # Sampling rounds are spread over the whole run, so each one stands for an equal share of it
+        per_round = elapsed / self._rounds if self._rounds else 0.0
+        return {stack: count * per_round for stack, count in self._samples.items()}
+
+    def _sample(self) -> None:
+        sampler = threading.get_ident()
+        while not self._stopping.wait(self._interval):
+            self._rounds += 1
+            threads = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == sampler:
+                    continue
+                self._samples[
+                    (threads.get(ident, str(ident)),) + self._stack(frame)
+                ] += 1
+
+    def _stack(self, frame: Optional[FrameType]) -> Stack:
+        names: List[str] = []
+        while frame is not None:
+            names.append(self._names(frame.f_code))
+            frame = frame.f_back
+        return tuple(reversed(names))
+
+
+class DeterministicProfiler(Profiler):
+    """
+    Times every Python and builtin function call in every thread. The timings are exact, but the overhead grows with the
+    number of calls and can slow call heavy code down several times over.
+    """
+
+    def __init__(self) -> None:
+        self._names: _FrameNames = _FrameNames()
+        self._stacks: Stacks = defaultdict(float)
+        self._lock: threading.Lock = threading.Lock()
+        self._local: threading.local = threading.local()
+
+    def start(self) -> None:
+        self._stacks.clear()
+        # The calls already in progress on this thread are the root of everything it runs next
+        frame = sys._getframe(1)
+        names: List[str] = []
+        while frame is not None:
+            names.append(self._names(frame.f_code))
+            frame = frame.f_back
+        self._local.stack = (threading.current_thread().name,) + tuple(reversed(names))
+        self._local.last = time.perf_counter()
+        threading.setprofile(self._profile)
+        sys.setprofile(self._profile)
+
+    def stop(self) -> Stacks:
+        sys.setprofile(None)
+        threading.setprofile(None)  # type: ignore
+        with self._lock:
+            return dict(self._stacks)
+
+    def _profile(self, frame: FrameType, event: str, arg: Any) -> None:
+        now = time.perf_counter()
+        local = self._local
+        stack: Optional[Stack] = getattr(local, "stack", None)
+        if stack is None:
+            stack = (threading.current_thread().name,)
+            local.last = now
+
+        elapsed = now - local.last
+        if elapsed > 0:
+            with self._lock:
+                self._stacks[stack] += elapsed
+
+        if event == "call":
+            stack = stack + (self._names(frame.f_code),)
+        elif event == "c_call":
+            stack = stack + (f"{getattr(arg, '__qualname__', arg)} (builtin)",)
+        elif len(stack) > 1:
+            stack = stack[:-1]
+        local.stack = stack
+        local.last = time.perf_counter()
+
+
+PROFILERS: Dict[str, Any] = {
+    "sampling": SamplingProfiler,
+    "deterministic": DeterministicProfiler,
+}
+
+
+def write_collapsed(stacks: Stacks, path: Union[str, Path]) -> None:
+    """
+    Writes stacks in the collapsed format flamegraph.pl, speedscope and inferno read: one "frame;frame;frame weight" line
+    per stack, weighted in microseconds.
+    """
+    if isinstance(path, str):
+        path = Path(path)
+
+    with path.open("w", encoding="UTF-8") as out_file:
+        for stack, seconds in sorted(stacks.items()):
+            weight = round(seconds * 1_000_000)
+            if weight > 0:
+                out_file.write(f"{';'.join(stack)} {weight}\n")
+
+
+def hottest(stacks: Stacks, limit: int = 20) -> List[Tuple[str, float, float]]:
+    """
+    Finds the functions the most time was spent in.
+
+    Args:
+        stacks (Stacks): the profiled stacks
+        limit (int): how many functions to return
+
+    Returns:
+        The name, self seconds and total seconds of each of the hottest functions by self time
+    """
+    own: Dict[str, float] = defaultdict(float)
+    total: Dict[str, float] = defaultdict(float)
+    for stack, seconds in stacks.items():
+        # The first frame is the thread, not a function
+        frames = stack[1:]
+        if not frames:
+            continue
+        own[frames[-1]] += seconds
+        for frame in set(frames):
+            total[frame] += seconds
+    names = sorted(own, key=own.__getitem__, reverse=True)[:limit]
+    return [(name, own[name], total[name]) for name in names]
+
+
+def format_hottest(functions: Sequence[Tuple[str, float, float]]) -> str:
+    lines = [f"{'self ms':>10} {'total ms':>10}  function"]
+    for name, own, total in functions:
+        lines.append(f"{own * 1000.0:>10.1f} {total * 1000.0:>10.1f}  {name}")
+    return "\n".join(lines)
+
+
+def format_spans(spans: Sequence[Any]) -> str:
+    """
+    Summarizes recorded spans as a tree, combining every span with the same nesting.
+
+    Args:
+        spans (Sequence[Span]): the spans recorded by autoguru.questionanswering.utilities.instrumentation.SPANS
+    """
+    totals: Dict[Tuple[str, ...], List[float]] = {}
+    for span in sorted(spans, key=lambda span: span.start):
+        entry = totals.setdefault(span.path, [0, 0.0, 0.0])
+        entry[0] += 1
+        entry[1] += span.seconds
+        entry[2] = max(entry[2], span.seconds)
+
+    lines = [f"{'count':>7} {'total ms':>10} {'mean ms':>9} {'max ms':>9}  span"]
+    # Children sort right after their parent since paths compare element by element
+    for path in sorted(totals):
+        count, seconds, longest = totals[path]
+        lines.append(
+            f"{int(count):>7} {seconds * 1000.0:>10.1f} {seconds / count * 1000.0:>9.2f}"
+            f" {longest * 1000.0:>9.2f}  {'  ' * (len(path) - 1)}{path[-1]}"
+        )
+    return "\n".join(lines)
+
+
+def start(
+    path: Optional[Union[str, Path]] = None,
+    profiler: str = "sampling",
+    interval: float = SamplingProfiler.DEFAULT_INTERVAL,
+    spans: bool = False,
+    report: Callable[[str], None] = print,
+    limit: int = 20,
+) -> Callable[[], None]:
+    """
+    Starts profiling this process and/or recording spans.
+
+    Args:
+        path (Optional[Union[str, Path]]): where to write the collapsed stacks. If None, nothing is profiled.
+        profiler (str): which of PROFILERS to use
+        interval (float): how many seconds between samples for the sampling profiler
+        spans (bool): whether to record spans
+        report (Callable[[str], None]): where to send the summaries once profiling stops
+        limit (int): how many of the hottest functions to summarize
+
+    Returns:
+        Stops profiling, writes the stacks and reports the summaries
+    """
+    running: Optional[Profiler] = None
+    if path is not None:
+        running = (
+            SamplingProfiler(interval=interval)
+            if profiler == "sampling"
+            else PROFILERS[profiler]()
+        )
+    if spans:
+        from autoguru.questionanswering.utilities.instrumentation import SPANS
+
+        SPANS.start()
+    if running is not None:
+        running.start()
+
+    def stop() -> None:
+        if running is not None:
+            stacks = running.stop()
+            write_collapsed(stacks, path)  # type: ignore
+            report(f"Wrote {profiler} profile to {path}")
+            report(format_hottest(hottest(stacks, limit=limit)))
+        if spans:
+            report(format_spans(SPANS.stop()))
+
+    return stop
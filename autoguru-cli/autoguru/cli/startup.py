@@ -0,0 +1,129 @@
+import statistics
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List, Sequence, Set, Tuple
+
+DEFAULT_COMMANDS: List[List[str]] = [
+    ["--version"],
+    ["--help"],
+    ["qa", "--help"],
+    ["ws", "--help"],
+    ["discord", "--help"],
+]
+# Heavy or slow to import packages that none of the default commands should need
+DEFAULT_FORBIDDEN: List[str] = [
+    "discord",
+    "fastapi",
+    "fastapi_admin",
+    "gunicorn",
+    "pkg_resources",
+    "starlette",
+    "tensorflow",
+    "tensorflow_hub",
+    "tortoise",
+    "uvicorn",
+]
+
+
+def parse_importtime(output: str) -> Tuple[Set[str], float]:
+    """
+    Parses the report python -X importtime writes to standard error.
+
+    Args:
+        output (str): the report
+
+    Returns:
+        The names of every module that was imported and the total time spent importing in milliseconds
+    """
+    modules: Set[str] = set()
+    total = 0.0
+    for line in output.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        if not cumulative.strip().isdigit():
+            continue
+        # The report indents nested imports, so only top level ones count towards the total
+        name = name[1:]
+        if not name.startswith(" "):
+            total += int(cumulative) / 1000.0
+        modules.add(name.strip())
+    return modules, total
+
+
+def time_command(
+    arguments: Sequence[str], runs: int, forbidden: Sequence[str]
+) -> Dict[str, Any]:
+    """
+    Times cold starts of one CLI command, each in a new interpreter.
+
+    Args:
+        arguments (Sequence[str]): the arguments to the autoguru command
+        runs (int): how many times to start it
+        forbidden (Sequence[str]): the top level packages the command shouldn't import
+
+    Returns:
+        The wall clock times in milliseconds, the import time of the first start and which forbidden packages were imported
+    """
+    command = [sys.executable, "-m", "autoguru.cli", *arguments]
+
+    # Import tracing slows startup down a little, so it's a separate run from the timed ones
+    probe = subprocess.run(
+        [sys.executable, "-X", "importtime", *command[1:]],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        encoding="UTF-8",
+    )
+    modules, import_time = parse_importtime(probe.stderr)
+    imported = {module.split(".")[0] for module in modules}
+
+    times: List[float] = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(
+            command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True
+        )
+        times.append((time.perf_counter() - start) * 1000.0)
+
+    return {
+        "command": " ".join(["autoguru", *arguments]),
+        "median_ms": statistics.median(times),
+        "max_ms": max(times),
+        "import_ms": import_time,
+        "modules": len(modules),
+        "forbidden": sorted(imported.intersection(forbidden)),
+    }
+
+
+def benchmark(
+    commands: Sequence[Sequence[str]] = tuple(DEFAULT_COMMANDS),
+    runs: int = 5,
+    budget: float = 500.0,
+    forbidden: Sequence[str] = tuple(DEFAULT_FORBIDDEN),
+) -> Dict[str, Any]:
+    """
+    Times cold starts of CLI commands and checks them against a budget. A command is over budget if its median start
+    takes longer than the budget or it imports any of the forbidden packages.
+
+    Args:
+        commands (Sequence[Sequence[str]]): the arguments for each command to time
+        runs (int): how many times to start each command
+        budget (float): the most milliseconds a command's median start can take
+        forbidden (Sequence[str]): the top level packages the commands shouldn't import
+
+    Returns:
+        A report with the timings of each command and whether they were all within budget
+    """
+    results = []
+    for arguments in commands:
+        result = time_command(arguments, runs=runs, forbidden=forbidden)
+        result["ok"] = result["median_ms"] <= budget and not result["forbidden"]
+        results.append(result)
+
+    return {
+        "budget_ms": budget,
+        "runs": runs,
+        "ok": all(result["ok"] for result in results),
+        "commands": results,
+    }
@@ -1,6 +1,12 @@
+import json
+import sys
+from functools import partial
+from typing import Any, Callable, Dict, TextIO
+
 import click
 
 from autoguru.discord import __version__
+from autoguru.questionanswering.nearestneighbors import INDEX_TYPES
 
 
 @click.group(help="AutoGuru Discord CLI Application")
@@ -32,5 +38,246 @@ def echo(message: str, shout: bool = False, repeat: int = 1) -> None:
         print(message)
 
 
+def _answering_options(function: Callable[..., Any]) -> Callable[..., Any]:
+    options = [
+        click.option(
+            "--index",
+            "index_path",
+            type=click.Path(exists=True, dir_okay=False),
+            required=True,
+            help="the nearest neighbors index of known questions, or a bundle of it with everything it needs",
+        ),
+        click.option(
+            "--index-type",
+            type=click.Choice(list(INDEX_TYPES)),
+            default="descent",
+            help="the kind of nearest neighbors index",
+            show_default=True,
+        ),
+        click.option(
+            "--answers",
+            "answers_path",
+            type=click.Path(exists=True, file_okay=False),
+            default=None,
+            help="the answer lookup for the index  [default <index>.answers]",
+        ),
+        click.option(
+            "--classifier",
+            "classifier_path",
+            type=click.Path(exists=True, file_okay=False),
+            default=None,
+            help="the question classifier. If not given, every message is treated as a question.",
+        ),
+        click.option(
+            "--embedder-url",
+            default="https://tfhub.dev/google/universal-sentence-encoder/4",
+            help="the TensorFlow Hub embedder",
+            show_default=True,
+        ),
+        click.option(
+            "--min-similarity",
+            default=0.8,
+            help="how similar a known question has to be for its answer to be used",
+            show_default=True,
+        ),
+        click.option(
+            "--cache-size",
+            default=4096,
+            help="how many answers to repeated questions to cache, 0 to turn off caching",
+            show_default=True,
+        ),
+        click.option(
+            "--cache-ttl",
+            default=300.0,
+            help="how many seconds cached answers are kept for",
+            show_default=True,
+        ),
+        click.option(
+            "--cache-similarity",
+            default=0.95,
+            help="how similar a recently answered question has to be for its answer to be reused, 0 to only reuse answers to the same question",
+            show_default=True,
+        ),
+        click.option(
+            "--debounce",
+            default=1.5,
+            help="how many seconds a channel has to be quiet before its messages are answered",
+            show_default=True,
+        ),
+        click.option(
+            "--batch-size",
+            default=64,
+            help="the most messages to answer at once",
+            show_default=True,
+        ),
+        click.option(
+            "--replies-per-minute",
+            default=6.0,
+            help="how many replies each guild can get per minute on average",
+            show_default=True,
+        ),
+    ]
+    for option in reversed(options):
+        function = option(function)
+    return function
+
+
+def _loader(**kwargs: Any) -> Callable[[], Any]:
+    from autoguru.discord.answering import QuestionAnswerer
+
+    return partial(
+        QuestionAnswerer.load,
+        index_path=kwargs["index_path"],
+        index_type=kwargs["index_type"],
+        embedder_url=kwargs["embedder_url"],
+        classifier_path=kwargs["classifier_path"],
+        answers_path=kwargs["answers_path"],
+        min_similarity=kwargs["min_similarity"],
+        cache_size=kwargs["cache_size"],
+        cache_ttl=kwargs["cache_ttl"],
+        cache_similarity=kwargs["cache_similarity"] or None,
+    )
+
+
+def _runner_options(**kwargs: Any) -> Dict[str, Any]:
+    return {
+        "debounce": kwargs["debounce"],
+        "batch_size": kwargs["batch_size"],
+        "replies_per_minute": kwargs["replies_per_minute"],
+    }
+
+
+def _create_runner(gateway: Any, **kwargs: Any) -> Any:
+    from autoguru.discord.runner import BotRunner
+
+    return BotRunner(
+        gateway=gateway, answerer=_loader(**kwargs)(), **_runner_options(**kwargs)
+    )
+
+
+@discord.command(name="run", help="Runs the question answering bot")
+@click.option(
+    "--token",
+    envvar="AUTOGURU_DISCORD_TOKEN",
+    required=True,
+    help="the bot token  [env AUTOGURU_DISCORD_TOKEN]",
+)
+@_answering_options
+def run(token: str, **kwargs: Any) -> None:
+    import asyncio
+
+    from autoguru.discord.gateway import DiscordGateway
+
+    runner = _create_runner(DiscordGateway(token), **kwargs)
+    asyncio.run(runner.run())
+
+
+@discord.command(
+    name="launch",
+    help="Runs the question answering bot as several gateway shard processes sharing one model server process",
+)
+@click.option(
+    "--token",
+    envvar="AUTOGURU_DISCORD_TOKEN",
+    required=True,
+    help="the bot token  [env AUTOGURU_DISCORD_TOKEN]",
+)
+@click.option(
+    "-s",
+    "--shards",
+    default=2,
+    help="how many shard processes to run",
+    show_default=True,
+)
+@click.option(
+    "--server-batch-size",
+    default=256,
+    help="the most messages the model server answers at once across all shards",
+    show_default=True,
+)
+@click.option(
+    "--server-max-wait",
+    default=10.0,
+    help="how many milliseconds the model server waits for more requests to batch together",
+    show_default=True,
+)
+@_answering_options
+def launch(
+    token: str,
+    shards: int = 2,
+    server_batch_size: int = 256,
+    server_max_wait: float = 10.0,
+    **kwargs: Any,
+) -> None:
+    from autoguru.discord.sharding import launch as launch_shards
+
+    sys.exit(
+        launch_shards(
+            token=token,
+            shard_count=shards,
+            loader=_loader(**kwargs),
+            runner_options=_runner_options(**kwargs),
+            batch_size=server_batch_size,
+            max_wait=server_max_wait / 1000.0,
+        )
+    )
+
+
+@discord.command(
+    name="simulate",
+    help="Runs the question answering bot against a local script of messages instead of Discord and prints its replies as JSON lines",
+)
+@click.argument("script", type=click.File("r", encoding="UTF-8"))
+@click.option(
+    "--realtime/--no-realtime",
+    default=True,
+    help='whether to wait for each message\'s "at" time instead of sending them all at once  [default realtime]',
+    show_default=False,
+)
+@_answering_options
+def simulate(script: TextIO, realtime: bool = True, **kwargs: Any) -> None:
+    """
+    Each line of the script is a JSON object like
+    {"at": 0.5, "guild": 1, "channel": 2, "author": 3, "content": "How do I reset my password?"}
+    where "at" is how many seconds after starting to send the message.
+    """
+    import asyncio
+
+    from autoguru.discord.gateway import FakeGateway, IncomingMessage
+
+    messages = []
+    for line, raw in enumerate(script, start=1):
+        if not raw.strip():
+            continue
+        record = json.loads(raw)
+        messages.append(
+            (
+                float(record.get("at", 0.0)) if realtime else 0.0,
+                IncomingMessage(
+                    id=int(record.get("id", line)),
+                    guild_id=record.get("guild"),
+                    channel_id=int(record["channel"]),
+                    author_id=int(record["author"]),
+                    content=record["content"],
+                    bot=bool(record.get("bot", False)),
+                ),
+            )
+        )
+
+    gateway = FakeGateway(messages)
+    asyncio.run(_create_runner(gateway, **kwargs).run())
+    for message, reply in gateway.replies:
+        print(
+            json.dumps(
+                {
+                    "id": message.id,
+                    "guild": message.guild_id,
+                    "channel": message.channel_id,
+                    "reply": reply,
+                }
+            )
+        )
+
+
 if __name__ == "__main__":
     discord(prog_name="autoguru-discord")
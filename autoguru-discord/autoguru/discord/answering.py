@@ -0,0 +1,122 @@
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import List, Optional, Union
+
+import numpy as np
+
+from autoguru.questionanswering.answering import DEFAULT_EMBEDDER_URL, BatchAnswerer
+from autoguru.questionanswering.answers import AnswerCache, AnswerMatch
+from autoguru.questionanswering.questionclassification import DEFAULT_MIN_CONFIDENCE
+
+
+class Answerer(ABC):
+    @abstractmethod
+    def answer(self, messages: List[str]) -> List[Optional[AnswerMatch]]:
+        """
+        Finds the best answer for each message.
+
+        Args:
+            messages (List[str]): the messages to answer
+
+        Returns:
+            The best answer for each message, or None if it isn't a question or nothing close enough has an answer
+        """
+        raise NotImplementedError
+
+
+class QuestionAnswerer(Answerer):
+    """
+    Answers batches of chat messages. The classifier runs over the whole batch first, and only the messages it thinks are
+    questions are embedded and looked up in the index.
+
+    Args:
+        answerer (BatchAnswerer): classifies, embeds and looks up the messages
+        min_similarity (float): how similar the closest known question has to be for its answer to be used
+        cache (Optional[AnswerCache[List[AnswerMatch]]]): caches the answers to repeated and near duplicate messages. An empty list is cached for messages without an answer.
+    """
+
+    DEFAULT_MIN_CONFIDENCE: float = DEFAULT_MIN_CONFIDENCE
+    DEFAULT_MIN_SIMILARITY: float = 0.8
+
+    def __init__(
+        self,
+        answerer: BatchAnswerer,
+        min_similarity: float = DEFAULT_MIN_SIMILARITY,
+        cache: Optional[AnswerCache[List[AnswerMatch]]] = None,
+    ) -> None:
+        self._answerer: BatchAnswerer = answerer
+        self._min_similarity: float = min_similarity
+        self._cache: Optional[AnswerCache[List[AnswerMatch]]] = cache
+
+    def answer(self, messages: List[str]) -> List[Optional[AnswerMatch]]:
+        results: List[Optional[AnswerMatch]] = [None] * len(messages)
+        if not messages:
+            return results
+
+        pending = list(range(len(messages)))
+        # Embeddings of the pending messages, if the cache already had to embed them
+        vectors: Optional[np.ndarray] = None
+        if self._cache is not None:
+            lookup = self._cache.lookup(messages, embed=self._answerer.embedder.embed)
+            for i, cached in enumerate(lookup.values):
+                if cached:
+                    results[i] = cached[0]
+            pending = lookup.misses
+            vectors = lookup.vectors
+        if not pending:
+            return results
+
+        answered = self._answerer.answer_questions(
+            [messages[i] for i in pending], k=1, vectors=vectors
+        )
+        for i, result in zip(pending, answered):
+            if (
+                result.answers
+                and result.answers[0].text is not None
+                and result.answers[0].similarity >= self._min_similarity
+            ):
+                results[i] = result.answers[0]
+
+        if self._cache is not None:
+            for row, i in enumerate(pending):
+                answer = results[i]
+                # The cache only keeps vectors for its similarity tier, which is when the lookup embedded the messages
+                self._cache.set(
+                    messages[i],
+                    [answer] if answer is not None else [],
+                    vector=vectors[row] if vectors is not None else None,
+                )
+        return results
+
+    @classmethod
+    def load(
+        cls,
+        index_path: Union[str, Path],
+        index_type: str = "descent",
+        embedder_url: str = DEFAULT_EMBEDDER_URL,
+        classifier_path: Optional[Union[str, Path]] = None,
+        answers_path: Optional[Union[str, Path]] = None,
+        min_confidence: float = DEFAULT_MIN_CONFIDENCE,
+        min_similarity: float = DEFAULT_MIN_SIMILARITY,
+        cache_size: int = 0,
+        cache_ttl: float = AnswerCache.DEFAULT_TTL,
+        cache_similarity: Optional[float] = AnswerCache.DEFAULT_SIMILARITY,
+    ) -> "QuestionAnswerer":
+        return cls(
+            answerer=BatchAnswerer.load(
+                index_path,
+                index_type=index_type,
+                embedder_url=embedder_url,
+                classifier_path=classifier_path,
+                answers_path=answers_path,
+                min_confidence=min_confidence,
+            ),
+            min_similarity=min_similarity,
+            cache=(
+                AnswerCache(
+                    max_size=cache_size, ttl=cache_ttl, similarity=cache_similarity
+                )
+                if cache_size > 0
+                else None
+            ),
+        )
@@ -0,0 +1,117 @@
+import asyncio
+import time
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Iterable, List, Optional, Tuple
+
+
+@dataclass
+class IncomingMessage:
+    id: int
+    guild_id: Optional[int]
+    channel_id: int
+    author_id: int
+    content: str
+    bot: bool = False
+
+
+MessageHandler = Callable[[IncomingMessage], Awaitable[None]]
+
+
+class Gateway(ABC):
+    """
+    Where the bot gets messages from and sends its replies to.
+    """
+
+    @abstractmethod
+    async def run(self, handler: MessageHandler) -> None:
+        """
+        Passes every incoming message to the handler until the gateway closes.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    async def reply(self, message: IncomingMessage, content: str) -> None:
+        raise NotImplementedError
+
+
+class DiscordGateway(Gateway):
+    """
+    Connects to Discord as a bot.
+
+    Args:
+        token (str): the bot token
+        shard_id (Optional[int]): which shard this connection is. If None, Discord's recommended sharding is used.
+        shard_count (Optional[int]): how many shards there are in total
+    """
+
+    def __init__(
+        self,
+        token: str,
+        shard_id: Optional[int] = None,
+        shard_count: Optional[int] = None,
+    ) -> None:
+        import discord
+
+        intents = discord.Intents.default()
+        intents.message_content = True
+        self._token: str = token
+        self._client: discord.Client = discord.Client(
+            intents=intents, shard_id=shard_id, shard_count=shard_count
+        )
+
+    async def run(self, handler: MessageHandler) -> None:
+        @self._client.event
+        async def on_message(message) -> None:
+            await handler(
+                IncomingMessage(
+                    id=message.id,
+                    guild_id=message.guild.id if message.guild is not None else None,
+                    channel_id=message.channel.id,
+                    author_id=message.author.id,
+                    content=message.content,
+                    bot=message.author.bot,
+                )
+            )
+
+        async with self._client:
+            await self._client.start(self._token)
+
+    async def reply(self, message: IncomingMessage, content: str) -> None:
+        channel = self._client.get_channel(message.channel_id)
+        if channel is None:
+            channel = await self._client.fetch_channel(message.channel_id)
+        await channel.get_partial_message(message.id).reply(
+            content, mention_author=False
+        )
+
+
+class FakeGateway(Gateway):
+    """
+    Replays a script of messages locally instead of connecting to Discord, and records the replies.
+
+    Args:
+        script (Iterable[Tuple[float, IncomingMessage]]): the messages to send and how many seconds after starting to send each one, in order
+        linger (float): how many seconds to keep running after the last message
+    """
+
+    def __init__(
+        self, script: Iterable[Tuple[float, IncomingMessage]], linger: float = 0.0
+    ) -> None:
+        self._script: List[Tuple[float, IncomingMessage]] = list(script)
+        self._linger: float = linger
+        self.replies: List[Tuple[IncomingMessage, str]] = []
+
+    async def run(self, handler: MessageHandler) -> None:
+        start = time.monotonic()
+        for at, message in self._script:
+            delay = start + at - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            await handler(message)
+
+        if self._linger > 0:
+            await asyncio.sleep(self._linger)
+
+    async def reply(self, message: IncomingMessage, content: str) -> None:
+        self.replies.append((message, content))
@@ -0,0 +1,318 @@
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Dict, Hashable, List, Optional, Tuple
+
+from autoguru.discord.answering import Answerer
+from autoguru.discord.gateway import Gateway, IncomingMessage
+from autoguru.questionanswering.answers import AnswerMatch
+from autoguru.questionanswering.utilities.instrumentation import (
+    QUEUE_DEPTH,
+    STAGE_BATCH_SIZE,
+    Counter,
+)
+
+LOGGER: logging.Logger = logging.getLogger(__name__)
+
+MESSAGES: Counter = Counter(
+    "autoguru_discord_messages_total",
+    "Discord messages by what happened to them",
+    labels=["outcome"],
+)
+
+_QUEUE_DEPTH = QUEUE_DEPTH.labels("discord_candidates")
+_BATCH_SIZE = STAGE_BATCH_SIZE.labels("discord_batch")
+
+
+class RateLimiter:
+    """
+    A token bucket per key. A full bucket is the same as no bucket, so buckets that have refilled are dropped, and only
+    keys that were limited recently take up memory.
+
+    Args:
+        rate (float): how many tokens each bucket gains per second
+        burst (int): the most tokens a bucket can hold
+    """
+
+    def __init__(self, rate: float, burst: int) -> None:
+        self._rate: float = rate
+        self._burst: int = burst
+        self._buckets: Dict[Hashable, Tuple[float, float]] = {}
+        # Every bucket is full again this many seconds after it was last used, so that's how often they're pruned
+        self._refill: float = burst / rate if rate > 0 else float("inf")
+        self._pruned: float = time.monotonic()
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def _prune(self, now: float) -> None:
+        self._buckets = {
+            key: (tokens, updated)
+            for key, (tokens, updated) in self._buckets.items()
+            if tokens + (now - updated) * self._rate < self._burst
+        }
+        self._pruned = now
+
+    def allow(self, key: Hashable) -> bool:
+        now = time.monotonic()
+        if now - self._pruned >= self._refill:
+            self._prune(now)
+
+        tokens, updated = self._buckets.get(key, (float(self._burst), now))
+        tokens = min(float(self._burst), tokens + (now - updated) * self._rate)
+        if tokens < 1.0:
+            self._buckets[key] = (tokens, now)
+            return False
+
+        self._buckets[key] = (tokens - 1.0, now)
+        return True
+
+
+@dataclass
+class Candidate:
+    """
+    One or more consecutive messages from the same author in a channel, joined into a single possible question. Replies
+    go to the last of the messages.
+    """
+
+    message: IncomingMessage
+    text: str
+
+
+@dataclass
+class _Burst:
+    # In event loop time, like the timer
+    started: float
+    messages: List[IncomingMessage] = field(default_factory=list)
+    timer: Optional[asyncio.TimerHandle] = None
+
+    def coalesce(self) -> List[Candidate]:
+        candidates: List[Candidate] = []
+        for message in self.messages:
+            if candidates and candidates[-1].message.author_id == message.author_id:
+                candidates[-1] = Candidate(
+                    message=message, text=f"{candidates[-1].text}\n{message.content}"
+                )
+            else:
+                candidates.append(Candidate(message=message, text=message.content))
+        return candidates
+
+
+class BotRunner:
+    """
+    Answers questions asked in chat.
+
+    Messages are buffered per channel until the channel has been quiet for the debounce window (or max_delay has passed
+    since the burst started), and consecutive messages from the same author are joined. The resulting candidates from all
+    channels are answered together in batches of up to batch_size, so a busy server costs one classifier and embedder
+    call per batch instead of one per message. Replies are rate limited per guild.
+
+    Args:
+        gateway (Gateway): where messages come from and replies go
+        answerer (Answerer): answers batches of candidates
+        debounce (float): how many seconds a channel has to be quiet before its burst is answered
+        max_delay (float): the most seconds a burst is held for however busy its channel is
+        max_burst (int): how many messages a burst can hold before it's answered early
+        batch_size (int): the most candidates to answer at once
+        max_batch_wait (float): how many seconds to wait for a batch to fill once it has a candidate
+        max_pending (int): how many candidates can wait to be answered. Past that, new ones are dropped.
+        min_length (int): messages shorter than this many characters are ignored without running the classifier
+        replies_per_minute (float): how many replies each guild can get per minute on average
+        reply_burst (int): how many replies a guild can get at once
+        workers (int): how many batches can be answered at once
+    """
+
+    DEFAULT_DEBOUNCE: float = 1.5
+    DEFAULT_MAX_DELAY: float = 5.0
+    DEFAULT_MAX_BURST: int = 20
+    DEFAULT_BATCH_SIZE: int = 64
+    DEFAULT_MAX_BATCH_WAIT: float = 0.05
+    DEFAULT_MAX_PENDING: int = 1024
+    DEFAULT_MIN_LENGTH: int = 8
+    DEFAULT_REPLIES_PER_MINUTE: float = 6.0
+    DEFAULT_REPLY_BURST: int = 3
+    DEFAULT_WORKERS: int = 1
+
+    def __init__(
+        self,
+        gateway: Gateway,
+        answerer: Answerer,
+        debounce: float = DEFAULT_DEBOUNCE,
+        max_delay: float = DEFAULT_MAX_DELAY,
+        max_burst: int = DEFAULT_MAX_BURST,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        max_batch_wait: float = DEFAULT_MAX_BATCH_WAIT,
+        max_pending: int = DEFAULT_MAX_PENDING,
+        min_length: int = DEFAULT_MIN_LENGTH,
+        replies_per_minute: float = DEFAULT_REPLIES_PER_MINUTE,
+        reply_burst: int = DEFAULT_REPLY_BURST,
+        workers: int = DEFAULT_WORKERS,
+    ) -> None:
+        self._gateway: Gateway = gateway
+        self._answerer: Answerer = answerer
+        self._debounce: float = debounce
+        self._max_delay: float = max_delay
+        self._max_burst: int = max_burst
+        self._batch_size: int = batch_size
+        self._max_batch_wait: float = max_batch_wait
+        self._min_length: int = min_length
+        self._rate_limiter: RateLimiter = RateLimiter(
+            rate=replies_per_minute / 60.0, burst=reply_burst
+        )
+        self._workers: int = workers
+        self._executor: ThreadPoolExecutor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="discord-answering"
+        )
+        self._max_pending: int = max_pending
+        self._bursts: Dict[int, _Burst] = {}
+        # Created in run so it belongs to the running event loop
+        self._candidates: "asyncio.Queue[Candidate]" = None  # type: ignore
+
+    async def handle(self, message: IncomingMessage) -> None:
+        if message.bot or len(message.content.strip()) < self._min_length:
+            MESSAGES.labels("ignored").inc()
+            return
+
+        MESSAGES.labels("received").inc()
+        loop = asyncio.get_running_loop()
+        burst = self._bursts.get(message.channel_id)
+        if burst is None:
+            burst = _Burst(started=loop.time())
+            self._bursts[message.channel_id] = burst
+        burst.messages.append(message)
+
+        if len(burst.messages) >= self._max_burst:
+            self._flush(message.channel_id)
+            return
+
+        if burst.timer is not None:
+            burst.timer.cancel()
+        delay = min(self._debounce, burst.started + self._max_delay - loop.time())
+        burst.timer = loop.call_later(max(delay, 0.0), self._flush, message.channel_id)
+
+    def _flush(self, channel_id: int) -> None:
+        burst = self._bursts.pop(channel_id, None)
+        if burst is None:
+            return
+        if burst.timer is not None:
+            burst.timer.cancel()
+
+        for candidate in burst.coalesce():
+            try:
+                self._candidates.put_nowait(candidate)
+            except asyncio.QueueFull:
+                MESSAGES.labels("dropped").inc()
+        _QUEUE_DEPTH.set(self._candidates.qsize())
+
+    async def _next_batch(
+        self, getter: Optional["asyncio.Task[Candidate]"] = None
+    ) -> Tuple[List[Candidate], Optional["asyncio.Task[Candidate]"]]:
+        """
+        Waits for a candidate and then up to max_batch_wait for more to fill the batch.
+
+        Cancelling a get() that has just been handed a candidate loses it, as asyncio.wait_for does on a timeout before
+        Python 3.12, so a get() still waiting when the batch is due is returned to start the next batch with instead.
+
+        Args:
+            getter (Optional[asyncio.Task[Candidate]]): the get() the previous batch left waiting
+        """
+        loop = asyncio.get_running_loop()
+        batch = [await (getter if getter is not None else self._candidates.get())]
+        getter = None
+        deadline = loop.time() + self._max_batch_wait
+        while len(batch) < self._batch_size:
+            try:
+                batch.append(self._candidates.get_nowait())
+                continue
+            except asyncio.QueueEmpty:
+                pass
+
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            getter = loop.create_task(self._candidates.get())
+            try:
+                done, _ = await asyncio.wait({getter}, timeout=remaining)
+            except asyncio.CancelledError:
+                getter.cancel()
+                raise
+            if not done:
+                break
+            batch.append(getter.result())
+            getter = None
+        _QUEUE_DEPTH.set(self._candidates.qsize())
+        return batch, getter
+
+    async def _answer_batches(self) -> None:
+        loop = asyncio.get_running_loop()
+        getter: Optional["asyncio.Task[Candidate]"] = None
+        try:
+            while True:
+                batch, getter = await self._next_batch(getter)
+                try:
+                    _BATCH_SIZE.observe(len(batch))
+                    answers = await loop.run_in_executor(
+                        self._executor,
+                        self._answerer.answer,
+                        [candidate.text for candidate in batch],
+                    )
+                    for candidate, answer in zip(batch, answers):
+                        await self._reply(candidate, answer)
+                except asyncio.CancelledError:
+                    raise
+                except Exception:
+                    LOGGER.exception(
+                        "Failed to answer a batch of %d messages", len(batch)
+                    )
+                finally:
+                    for _ in batch:
+                        self._candidates.task_done()
+        finally:
+            # The workers are only cancelled once the bot stops, after the queue has been drained
+            if getter is not None:
+                getter.cancel()
+
+    async def _reply(self, candidate: Candidate, answer: Optional[AnswerMatch]) -> None:
+        if answer is None:
+            MESSAGES.labels("unanswered").inc()
+            return
+
+        # Direct messages don't have a guild, so they're limited per channel instead
+        message = candidate.message
+        key = (
+            message.guild_id
+            if message.guild_id is not None
+            else ("dm", message.channel_id)
+        )
+        if not self._rate_limiter.allow(key):
+            MESSAGES.labels("rate_limited").inc()
+            return
+
+        try:
+            await self._gateway.reply(candidate.message, answer.text)
+            MESSAGES.labels("answered").inc()
+        except Exception:
+            LOGGER.exception("Failed to reply to message %d", candidate.message.id)
+
+    async def run(self) -> None:
+        """
+        Answers messages until the gateway closes, then answers whatever is still buffered before returning.
+        """
+        self._candidates = asyncio.Queue(maxsize=self._max_pending)
+        answering = [
+            asyncio.get_running_loop().create_task(self._answer_batches())
+            for _ in range(self._workers)
+        ]
+        try:
+            await self._gateway.run(self.handle)
+
+            for channel_id in list(self._bursts):
+                self._flush(channel_id)
+            await self._candidates.join()
+        finally:
+            for task in answering:
+                task.cancel()
+            await asyncio.gather(*answering, return_exceptions=True)
+            self._executor.shutdown(wait=True)
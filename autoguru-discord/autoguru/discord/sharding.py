@@ -0,0 +1,256 @@
+import asyncio
+import itertools
+import logging
+import multiprocessing
+import queue
+import signal
+import threading
+from concurrent.futures import Future
+from multiprocessing.connection import wait
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from autoguru.discord.answering import Answerer
+from autoguru.questionanswering.answers import AnswerMatch
+
+LOGGER: logging.Logger = logging.getLogger(__name__)
+
+# (shard, request id, messages) from the shards and (request id, answers or an error message) back to them
+_Request = Tuple[int, int, List[str]]
+_Response = Tuple[int, Optional[List[Optional[AnswerMatch]]], Optional[str]]
+
+
+def serve(
+    loader: Callable[[], Answerer],
+    requests: multiprocessing.Queue,
+    responses: List[multiprocessing.Queue],
+    batch_size: int = 256,
+    max_wait: float = 0.01,
+) -> None:
+    """
+    Runs a model server: loads the models once, then answers requests from every shard, combining requests that arrive
+    close together into one batch of up to batch_size messages. A None request stops the server.
+
+    Args:
+        loader (Callable[[], Answerer]): loads the models. It has to be picklable so it can be sent to the server process.
+        requests (multiprocessing.Queue): where the shards send their requests
+        responses (List[multiprocessing.Queue]): the queue for each shard's responses
+        batch_size (int): the most messages to answer at once
+        max_wait (float): how many seconds to wait for more requests once there's one to answer
+    """
+    # The launcher handles interrupts and stops the server through the queue
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    answerer = loader()
+    LOGGER.info("Model server ready")
+
+    stopping = False
+    while not stopping:
+        request = requests.get()
+        if request is None:
+            break
+
+        batch: List[_Request] = [request]
+        size = len(request[2])
+        while size < batch_size:
+            try:
+                request = requests.get(timeout=max_wait)
+            except queue.Empty:
+                break
+            if request is None:
+                stopping = True
+                break
+            batch.append(request)
+            size += len(request[2])
+
+        messages = [
+            message for _, _, request_messages in batch for message in request_messages
+        ]
+        try:
+            answers = answerer.answer(messages)
+        except Exception as error:
+            LOGGER.exception("Failed to answer a batch of %d messages", len(messages))
+            for shard, request_id, _ in batch:
+                responses[shard].put((request_id, None, str(error)))
+            continue
+
+        offset = 0
+        for shard, request_id, request_messages in batch:
+            responses[shard].put(
+                (request_id, answers[offset : offset + len(request_messages)], None)
+            )
+            offset += len(request_messages)
+
+
+class RemoteAnswerer(Answerer):
+    """
+    Answers messages by sending them to a model server. It's safe to call from several threads at once.
+
+    Args:
+        shard (int): which shard this is, to route responses back
+        requests (multiprocessing.Queue): the model server's request queue
+        responses (multiprocessing.Queue): this shard's response queue
+        timeout (float): how many seconds to wait for the model server to answer
+    """
+
+    DEFAULT_TIMEOUT: float = 60.0
+
+    def __init__(
+        self,
+        shard: int,
+        requests: multiprocessing.Queue,
+        responses: multiprocessing.Queue,
+        timeout: float = DEFAULT_TIMEOUT,
+    ) -> None:
+        self._shard: int = shard
+        self._requests: multiprocessing.Queue = requests
+        self._responses: multiprocessing.Queue = responses
+        self._timeout: float = timeout
+        self._ids: Any = itertools.count()
+        self._pending: Dict[int, Future] = {}
+        self._lock: threading.Lock = threading.Lock()
+        self._receiver: threading.Thread = threading.Thread(
+            target=self._receive, name="model-server-responses", daemon=True
+        )
+        self._receiver.start()
+
+    def answer(self, messages: List[str]) -> List[Optional[AnswerMatch]]:
+        if not messages:
+            return []
+
+        future: Future = Future()
+        with self._lock:
+            request_id = next(self._ids)
+            self._pending[request_id] = future
+        self._requests.put((self._shard, request_id, messages))
+        try:
+            return future.result(timeout=self._timeout)
+        finally:
+            with self._lock:
+                self._pending.pop(request_id, None)
+
+    def _receive(self) -> None:
+        while True:
+            response: _Response = self._responses.get()
+            request_id, answers, error = response
+            with self._lock:
+                future = self._pending.get(request_id)
+            # The request may have timed out already
+            if future is None:
+                continue
+            if error is not None:
+                future.set_exception(RuntimeError(f"Model server failed: {error}"))
+            else:
+                future.set_result(answers)
+
+
+def run_shard(
+    token: str,
+    shard: int,
+    shard_count: int,
+    requests: multiprocessing.Queue,
+    responses: multiprocessing.Queue,
+    runner_options: Dict[str, Any],
+) -> None:
+    from autoguru.discord.gateway import DiscordGateway
+    from autoguru.discord.runner import BotRunner
+
+    # The launcher handles interrupts and terminates the shards
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    runner = BotRunner(
+        gateway=DiscordGateway(token, shard_id=shard, shard_count=shard_count),
+        answerer=RemoteAnswerer(shard=shard, requests=requests, responses=responses),
+        **runner_options,
+    )
+    asyncio.run(runner.run())
+
+
+def launch(
+    token: str,
+    shard_count: int,
+    loader: Callable[[], Answerer],
+    runner_options: Optional[Dict[str, Any]] = None,
+    batch_size: int = 256,
+    max_wait: float = 0.01,
+) -> int:
+    """
+    Runs the bot as shard_count shard processes that share one model server process. Discord assigns each shard a subset
+    of the guilds. Only the model server loads the models, so memory doesn't grow with the number of shards.
+
+    Processes are spawned rather than forked since TensorFlow isn't fork safe. If any process exits, the rest are stopped.
+
+    Args:
+        token (str): the bot token
+        shard_count (int): how many shard processes to run
+        loader (Callable[[], Answerer]): loads the models in the model server. It has to be picklable.
+        runner_options (Optional[Dict[str, Any]]): keyword arguments for each shard's BotRunner
+        batch_size (int): the most messages the model server answers at once
+        max_wait (float): how many seconds the model server waits for more requests to batch
+
+    Returns:
+        The exit code of the process that exited first
+    """
+    context = multiprocessing.get_context("spawn")
+    requests = context.Queue()
+    responses = [context.Queue() for _ in range(shard_count)]
+
+    server = context.Process(
+        target=serve,
+        name="autoguru-model-server",
+        args=(loader, requests, responses),
+        kwargs={"batch_size": batch_size, "max_wait": max_wait},
+    )
+    shards = [
+        context.Process(
+            target=run_shard,
+            name=f"autoguru-shard-{shard}",
+            args=(
+                token,
+                shard,
+                shard_count,
+                requests,
+                responses[shard],
+                runner_options or {},
+            ),
+        )
+        for shard in range(shard_count)
+    ]
+    processes = [server] + shards
+
+    stopping = threading.Event()
+
+    def stop(signum: int, frame: Any) -> None:
+        stopping.set()
+
+    previous = {
+        signum: signal.signal(signum, stop)
+        for signum in (signal.SIGINT, signal.SIGTERM)
+    }
+    try:
+        for process in processes:
+            process.start()
+
+        exited: List[Any] = []
+        while not exited and not stopping.is_set():
+            exited = wait([process.sentinel for process in processes], timeout=1.0)
+
+        exit_code = 0
+        for process in processes:
+            if process.sentinel in exited:
+                process.join()
+                LOGGER.error("%s exited with %s", process.name, process.exitcode)
+                exit_code = process.exitcode or 1
+                break
+        return exit_code
+    finally:
+        for shard_process in shards:
+            if shard_process.is_alive():
+                shard_process.terminate()
+        if server.is_alive():
+            requests.put(None)
+        for process in processes:
+            process.join(timeout=10.0)
+            if process.is_alive():
+                process.kill()
+        for signum, handler in previous.items():
+            signal.signal(signum, handler)
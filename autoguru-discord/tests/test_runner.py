@@ -0,0 +1,204 @@
+import asyncio
+import selectors
+from typing import List, Optional, Tuple
+from uuid import UUID
+
+import pytest
+
+from autoguru.discord import gateway, runner
+from autoguru.discord.answering import Answerer
+from autoguru.discord.gateway import FakeGateway, IncomingMessage
+from autoguru.discord.runner import BotRunner, RateLimiter
+from autoguru.questionanswering.answers import AnswerMatch
+
+
+class FakeClock:
+    """
+    A clock that only moves when it's advanced, or when an event loop running on it has nothing to do until a timer.
+    """
+
+    def __init__(self) -> None:
+        self.now: float = 0.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def advance(self, seconds: float) -> None:
+        self.now += seconds
+
+
+class SkippingSelector(selectors.DefaultSelector):  # type: ignore
+    def __init__(self, clock: FakeClock) -> None:
+        super().__init__()
+        self._clock: FakeClock = clock
+
+    def select(self, timeout: Optional[float] = None):
+        if timeout is None or timeout <= 0:
+            return super().select(timeout)
+        # Batches are answered on a thread in real time, so they get a moment to finish before the clock skips ahead
+        ready = super().select(min(timeout, 0.01))
+        if not ready:
+            self._clock.advance(timeout)
+        return ready
+
+
+class FakeClockLoop(asyncio.SelectorEventLoop):
+    def __init__(self, clock: FakeClock) -> None:
+        super().__init__(selector=SkippingSelector(clock))
+        self._clock: FakeClock = clock
+
+    def time(self) -> float:
+        return self._clock.now
+
+
+class RecordingAnswerer(Answerer):
+    """
+    Answers every message, and records when each batch was answered.
+    """
+
+    def __init__(self, clock: FakeClock) -> None:
+        self.batches: List[Tuple[float, List[str]]] = []
+        self._clock: FakeClock = clock
+
+    def answer(self, messages: List[str]) -> List[Optional[AnswerMatch]]:
+        self.batches.append((self._clock.now, list(messages)))
+        return [
+            AnswerMatch(
+                question_id=UUID(int=0),
+                answer_id=UUID(int=1),
+                text=f"answer to {message}",
+                similarity=1.0,
+            )
+            for message in messages
+        ]
+
+
+@pytest.fixture
+def clock(monkeypatch: pytest.MonkeyPatch) -> FakeClock:
+    clock = FakeClock()
+    monkeypatch.setattr(runner, "time", clock)
+    monkeypatch.setattr(gateway, "time", clock)
+    return clock
+
+
+def message(
+    id: int, channel_id: int = 1, author_id: int = 1, guild_id: Optional[int] = 1
+) -> IncomingMessage:
+    return IncomingMessage(
+        id=id,
+        guild_id=guild_id,
+        channel_id=channel_id,
+        author_id=author_id,
+        content=f"message number {id}",
+    )
+
+
+def run(
+    clock: FakeClock, script: List[Tuple[float, IncomingMessage]], **options
+) -> Tuple[RecordingAnswerer, FakeGateway]:
+    answerer = RecordingAnswerer(clock)
+    # Lingers so the last bursts are answered by their timers rather than when the gateway closes
+    fake = FakeGateway(script, linger=60.0)
+    options = {"debounce": 1.5, "max_delay": 5.0, "max_batch_wait": 0.0, **options}
+    loop = FakeClockLoop(clock)
+    try:
+        loop.run_until_complete(BotRunner(fake, answerer, **options).run())
+    finally:
+        loop.close()
+    return answerer, fake
+
+
+def test_rate_limiter_refills(clock: FakeClock) -> None:
+    limiter = RateLimiter(rate=0.5, burst=2)
+
+    assert [limiter.allow("a") for _ in range(3)] == [True, True, False]
+    assert limiter.allow("b")
+    clock.advance(1.9)
+    assert not limiter.allow("a")
+    clock.advance(0.1)
+    assert limiter.allow("a")
+    assert not limiter.allow("a")
+
+
+def test_rate_limiter_prunes_refilled_buckets(clock: FakeClock) -> None:
+    limiter = RateLimiter(rate=1.0, burst=3)
+    for key in range(100):
+        limiter.allow(key)
+    for _ in range(3):
+        limiter.allow("busy")
+    assert len(limiter) == 101
+
+    # Buckets are only pruned once every one of them could have refilled since the last time
+    clock.advance(2.5)
+    assert limiter.allow("busy")
+    assert len(limiter) == 101
+
+    # The keys used once are full again, but busy isn't yet
+    clock.advance(0.5)
+    limiter.allow("other")
+    assert len(limiter) == 2
+    assert [limiter.allow("busy") for _ in range(3)] == [True, True, False]
+
+
+def test_channel_is_answered_once_it_goes_quiet(clock: FakeClock) -> None:
+    script = [
+        (0.0, message(1)),
+        (0.5, message(2, channel_id=2)),
+        (1.0, message(3)),
+        (2.2, message(4)),
+    ]
+
+    answerer, fake = run(clock, script)
+
+    assert [at for at, _ in answerer.batches] == [
+        pytest.approx(2.0),
+        pytest.approx(3.7),
+    ]
+    assert [batch for _, batch in answerer.batches] == [
+        ["message number 2"],
+        ["message number 1\nmessage number 3\nmessage number 4"],
+    ]
+    # The reply goes to the last message of the burst
+    assert [replied.id for replied, _ in fake.replies] == [2, 4]
+
+
+def test_busy_channel_is_answered_after_max_delay(clock: FakeClock) -> None:
+    script = [(0.9 * second, message(second)) for second in range(12)]
+
+    answerer, _ = run(clock, script)
+
+    # However busy the channel is, a burst is held for at most max_delay after its first message
+    assert [at for at, _ in answerer.batches] == [
+        pytest.approx(5.0),
+        pytest.approx(5.4 + 5.0),
+    ]
+    assert [batch[0].count("\n") + 1 for _, batch in answerer.batches] == [6, 6]
+
+
+def test_consecutive_messages_from_an_author_are_joined(clock: FakeClock) -> None:
+    authors = [1, 1, 2, 1]
+    script = [
+        (0.1 * id, message(id, author_id=author))
+        for id, author in enumerate(authors, start=1)
+    ]
+
+    answerer, fake = run(clock, script)
+
+    assert [batch for _, batch in answerer.batches] == [
+        [
+            "message number 1\nmessage number 2",
+            "message number 3",
+            "message number 4",
+        ]
+    ]
+    assert [replied.id for replied, _ in fake.replies] == [2, 3, 4]
+
+
+def test_replies_are_rate_limited_per_guild(clock: FakeClock) -> None:
+    script = [(0.0, message(id, channel_id=id)) for id in range(1, 5)]
+    script.append((0.0, message(5, channel_id=5, guild_id=2)))
+
+    _, fake = run(clock, script, replies_per_minute=1.0, reply_burst=2)
+
+    guilds = [replied.guild_id for replied, _ in fake.replies]
+    assert sorted(guilds) == [1, 1, 2]
@@ -1,11 +1,9 @@
-import pkg_resources
+from pathlib import Path
 
 from autoguru.persistence.model import Answer, Question
 
 __version__ = (
-    pkg_resources.resource_string("autoguru.persistence", "VERSION.txt")
-    .decode("UTF-8")
-    .strip()
+    Path(__file__).with_name("VERSION.txt").read_text(encoding="UTF-8").strip()
 )
 
 
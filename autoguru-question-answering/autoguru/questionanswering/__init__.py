@@ -1,9 +1,7 @@
-import pkg_resources
+from pathlib import Path
 
 __version__ = (
-    pkg_resources.resource_string("autoguru.questionanswering", "VERSION.txt")
-    .decode("UTF-8")
-    .strip()
+    Path(__file__).with_name("VERSION.txt").read_text(encoding="UTF-8").strip()
 )
 
 
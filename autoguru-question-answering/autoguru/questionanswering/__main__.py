@@ -1,3 +1,8 @@
+import json
+from functools import partial
+from pathlib import Path
+from typing import Any, Dict, Optional, TextIO, Tuple
+
 import click
 
 from autoguru.questionanswering import __version__
@@ -32,5 +37,699 @@ def echo(message: str, shout: bool = False, repeat: int = 1) -> None:
         print(message)
 
 
+def _parse_options(
+    options: Tuple[str, ...], param_hint: str = "--index-option"
+) -> Dict[str, Any]:
+    parsed = {}
+    for option in options:
+        name, separator, value = option.partition("=")
+        if not separator:
+            raise click.BadParameter(
+                f"{option!r} isn't NAME=VALUE", param_hint=param_hint
+            )
+        try:
+            parsed[name] = json.loads(value)
+        except json.JSONDecodeError:
+            parsed[name] = value
+    return parsed
+
+
+def _progress(quiet: bool, unit: str = "questions") -> Any:
+    from autoguru.questionanswering.batch import Progress
+
+    return Progress(report=None if quiet else partial(click.echo, err=True), unit=unit)
+
+
+def _skip_line(error: Any) -> None:
+    click.echo(f"Skipping line {error.line}: {error.error}", err=True)
+
+
+def _index_types() -> click.Choice:
+    # Kept in sync with autoguru.questionanswering.nearestneighbors.INDEX_TYPES, which isn't imported just to show the help
+    return click.Choice(["descent", "balltree"])
+
+
+@question_answering.command(
+    name="build-index",
+    help="Embeds questions from the database or a file and saves a nearest neighbor index of them, with the answer lookup next to it",
+)
+@click.argument("index", type=click.Path(dir_okay=False, writable=True))
+@click.option(
+    "-i",
+    "--input",
+    "input_file",
+    type=click.File("r", encoding="UTF-8"),
+    default=None,
+    help="a file of questions to index, one per line as text or JSON objects with text and optionally id, answer_id, answer and an attributes object to filter by. - reads standard in. If not given, the questions are read from the database.",
+)
+@click.option(
+    "--database",
+    default="sqlite://db.sqlite3",
+    help="the database to read questions from",
+    show_default=True,
+)
+@click.option(
+    "-t",
+    "--index-type",
+    type=_index_types(),
+    default="descent",
+    help="the index backend to build",
+    show_default=True,
+)
+@click.option(
+    "-O",
+    "--index-option",
+    "index_options",
+    multiple=True,
+    help="a NAME=VALUE keyword argument for the backend, like leaf_size=20. Values are parsed as JSON if they can be.",
+)
+@click.option(
+    "--embedder",
+    default="https://tfhub.dev/google/universal-sentence-encoder/4",
+    help="the TensorFlow Hub embedder to use",
+    show_default=True,
+)
+@click.option(
+    "--chunk-size",
+    default=256,
+    help="how many questions to read and embed at once",
+    show_default=True,
+)
+@click.option(
+    "--embed-workers",
+    default=1,
+    help="how many processes to embed with. Over 1, each chunk is split between them, which is faster than one process on machines with more than a few cores.",
+    show_default=True,
+)
+@click.option(
+    "--embed-threads",
+    type=int,
+    default=None,
+    help="with --embed-workers, how many threads each process runs TensorFlow with  [default an even share of the CPUs]",
+)
+@click.option(
+    "--rerank",
+    is_flag=True,
+    help="also save the vectors next to the index, so ask can rerank its candidates exactly with --rerank-factor",
+)
+@click.option(
+    "--lexical",
+    is_flag=True,
+    help="also build a BM25 index of the questions' words next to the index, so ask can fuse it in with --fusion",
+)
+@click.option(
+    "--collapse-duplicates",
+    is_flag=True,
+    help="skip questions that are near duplicates of earlier ones with the same answer, and save a near duplicate detector of what's indexed next to the index",
+)
+@click.option(
+    "--duplicate-threshold",
+    default=0.8,
+    help="with --collapse-duplicates, how similar two questions' character shingles have to be to be near duplicates",
+    show_default=True,
+)
+@click.option(
+    "--project",
+    "projection_dimensions",
+    default=0,
+    help="reduce the embeddings to this many dimensions before indexing them. 0 keeps every dimension.",
+    show_default=True,
+)
+@click.option(
+    "--projection",
+    "projection_method",
+    type=click.Choice(["pca", "gaussian", "sparse"]),
+    default="pca",
+    help="with --project, how to reduce the embeddings: PCA, or a Gaussian or sparse random projection",
+    show_default=True,
+)
+@click.option(
+    "--whiten",
+    is_flag=True,
+    help="with --project pca, scale every kept component to unit variance",
+)
+@click.option(
+    "--tune",
+    is_flag=True,
+    help="first tune the index options -O doesn't set on a sample of the questions, and save the results next to the index",
+)
+@click.option(
+    "--target-recall",
+    type=float,
+    default=None,
+    help="with --tune, the recall to reach as quickly as possible  [default 0.95 without a --latency-budget]",
+)
+@click.option(
+    "--latency-budget",
+    type=float,
+    default=None,
+    help="with --tune, the p95 milliseconds a search can take. The most accurate options within it are chosen.",
+)
+@click.option(
+    "--tune-sample",
+    default=10000,
+    help="with --tune, how many questions to build the trial indexes from",
+    show_default=True,
+)
+@click.option(
+    "--tune-queries",
+    default=200,
+    help="with --tune, how many questions to hold out and time searches with",
+    show_default=True,
+)
+@click.option("-q", "--quiet", is_flag=True, help="don't report progress")
+def build_index(
+    index: str,
+    input_file: Optional[TextIO] = None,
+    database: str = "sqlite://db.sqlite3",
+    index_type: str = "descent",
+    index_options: Tuple[str, ...] = (),
+    embedder: str = "https://tfhub.dev/google/universal-sentence-encoder/4",
+    chunk_size: int = 256,
+    embed_workers: int = 1,
+    embed_threads: Optional[int] = None,
+    rerank: bool = False,
+    lexical: bool = False,
+    collapse_duplicates: bool = False,
+    duplicate_threshold: float = 0.8,
+    projection_dimensions: int = 0,
+    projection_method: str = "pca",
+    whiten: bool = False,
+    tune: bool = False,
+    target_recall: Optional[float] = None,
+    latency_budget: Optional[float] = None,
+    tune_sample: int = 10000,
+    tune_queries: int = 200,
+    quiet: bool = False,
+) -> None:
+    from autoguru.questionanswering import batch
+    from autoguru.questionanswering.deduplication import NearDuplicateDetector
+    from autoguru.questionanswering.embeddings.instrumented import InstrumentedEmbedder
+    from autoguru.questionanswering.embeddings.parallel import ParallelEmbedder
+    from autoguru.questionanswering.embeddings.projection import (
+        Projection,
+        ProjectionMethod,
+    )
+    from autoguru.questionanswering.embeddings.tfhub import TfHubEmbedder
+    from autoguru.questionanswering.nearestneighbors.tuning import Tuner
+
+    options = _parse_options(index_options)
+    records = (
+        batch.read_records(input_file, report=_skip_line)
+        if input_file is not None
+        else batch.fetch_records(database, chunk_size=chunk_size)
+    )
+    loaded = (
+        ParallelEmbedder.create(embedder, workers=embed_workers, threads=embed_threads)
+        if embed_workers > 1
+        else TfHubEmbedder.create(embedder)
+    )
+    try:
+        summary = batch.build_index(
+            records,
+            embedder=InstrumentedEmbedder(loaded),
+            index_path=index,
+            index_type=index_type,
+            index_options=options,
+            chunk_size=chunk_size,
+            progress=_progress(quiet),
+            rerank=rerank,
+            lexical=lexical,
+            tuner=(
+                Tuner(
+                    sample_size=tune_sample,
+                    query_count=tune_queries,
+                    min_recall=target_recall,
+                    max_latency_ms=latency_budget,
+                    report=None if quiet else partial(click.echo, err=True),
+                )
+                if tune
+                else None
+            ),
+            fit_projection=(
+                partial(
+                    Projection.create,
+                    dimensions=projection_dimensions,
+                    method=ProjectionMethod(projection_method),
+                    whiten=whiten,
+                )
+                if projection_dimensions > 0
+                else None
+            ),
+            detector=(
+                NearDuplicateDetector(threshold=duplicate_threshold)
+                if collapse_duplicates
+                else None
+            ),
+        )
+    except ValueError as error:
+        raise click.ClickException(str(error))
+    finally:
+        if isinstance(loaded, ParallelEmbedder):
+            loaded.close()
+    click.echo(json.dumps(summary, indent=2))
+
+
+@question_answering.command(
+    name="ask",
+    help="Answers questions, one per line, and writes the answers as JSON lines. INDEX can also be a bundle, which brings its own embedder, classifier and settings.",
+)
+@click.argument("index", type=click.Path(exists=True, dir_okay=False))
+@click.option(
+    "-i",
+    "--input",
+    "input_file",
+    type=click.File("r", encoding="UTF-8"),
+    default="-",
+    help="the questions to answer, one per line as text or JSON objects with text and optionally id",
+    show_default=True,
+)
+@click.option(
+    "-o",
+    "--output",
+    type=click.File("w", encoding="UTF-8"),
+    default="-",
+    help="where to write the answers",
+    show_default=True,
+)
+@click.option(
+    "-t",
+    "--index-type",
+    type=_index_types(),
+    default="descent",
+    help="the type of the index",
+    show_default=True,
+)
+@click.option(
+    "--embedder",
+    default="https://tfhub.dev/google/universal-sentence-encoder/4",
+    help="the TensorFlow Hub embedder the index was built with",
+    show_default=True,
+)
+@click.option(
+    "--classifier",
+    type=click.Path(exists=True),
+    default=None,
+    help="a question classifier to skip text that isn't a question with",
+)
+@click.option(
+    "--answers",
+    type=click.Path(exists=True, file_okay=False),
+    default=None,
+    help="the answer lookup  [default next to the index]",
+)
+@click.option(
+    "--min-confidence",
+    default=0.5,
+    help="how confident the classifier has to be that text is a question",
+    show_default=True,
+)
+@click.option(
+    "-k", default=1, help="how many answers to find per question", show_default=True
+)
+@click.option(
+    "-b",
+    "--batch-size",
+    default=64,
+    help="how many questions to answer at once",
+    show_default=True,
+)
+@click.option(
+    "-j",
+    "--jobs",
+    default=1,
+    help="how many worker processes to answer with. Each loads its own copy of the models.",
+    show_default=True,
+)
+@click.option(
+    "--rerank-factor",
+    default=0,
+    help="fetch this many candidates per answer from the index and rerank them exactly. Needs an index built with --rerank. 0 doesn't rerank.",
+    show_default=True,
+)
+@click.option(
+    "--fusion",
+    type=click.Choice(["rrf", "weighted"]),
+    default=None,
+    help="also search the BM25 index built with --lexical and fuse the results by reciprocal rank or weighted score. Similarities are then fused scores.",
+)
+@click.option(
+    "--lexical-weight",
+    default=0.5,
+    help="with --fusion, the BM25 results' share of the fused score",
+    show_default=True,
+)
+@click.option(
+    "--lexical-confidence",
+    default=0.9,
+    help="with --fusion, answer questions whose best BM25 match shares at least this much of their idf weighted words without embedding them. Above 1 embeds every question.",
+    show_default=True,
+)
+@click.option(
+    "-w",
+    "--where",
+    multiple=True,
+    help="only match questions whose attribute NAME is VALUE, like language=en or answered=true. Values are parsed as JSON if they can be.",
+)
+@click.option("-q", "--quiet", is_flag=True, help="don't report progress")
+def ask(
+    index: str,
+    input_file: TextIO,
+    output: TextIO,
+    index_type: str = "descent",
+    embedder: str = "https://tfhub.dev/google/universal-sentence-encoder/4",
+    classifier: Optional[str] = None,
+    answers: Optional[str] = None,
+    min_confidence: float = 0.5,
+    k: int = 1,
+    batch_size: int = 64,
+    jobs: int = 1,
+    rerank_factor: int = 0,
+    fusion: Optional[str] = None,
+    lexical_weight: float = 0.5,
+    lexical_confidence: float = 0.9,
+    where: Tuple[str, ...] = (),
+    quiet: bool = False,
+) -> None:
+    from autoguru.questionanswering import batch
+    from autoguru.questionanswering.answering import BatchAnswerer
+    from autoguru.questionanswering.lexical import Fusion
+
+    loader = partial(
+        BatchAnswerer.load,
+        index_path=Path(index),
+        index_type=index_type,
+        embedder_url=embedder,
+        classifier_path=Path(classifier) if classifier is not None else None,
+        answers_path=Path(answers) if answers is not None else None,
+        min_confidence=min_confidence,
+        rerank_factor=rerank_factor,
+        fusion=Fusion(fusion) if fusion is not None else None,
+        lexical_weight=lexical_weight,
+        min_lexical_confidence=lexical_confidence,
+        where=_parse_options(where, param_hint="--where"),
+    )
+    summary = batch.ask(
+        batch.read_questions(input_file),
+        loader=loader,
+        output=output,
+        k=k,
+        batch_size=batch_size,
+        jobs=jobs,
+        progress=_progress(quiet),
+    )
+    if not quiet:
+        click.echo(json.dumps(summary), err=True)
+
+
+@question_answering.command(
+    name="find-duplicates",
+    help="Finds questions that are near duplicates of earlier ones with the same answer, or of the questions in an index built with --collapse-duplicates, and writes them as JSON lines",
+)
+@click.option(
+    "-i",
+    "--input",
+    "input_file",
+    type=click.File("r", encoding="UTF-8"),
+    default=None,
+    help="a file of questions to check, in the same format build-index reads. - reads standard in. If not given, the questions are read from the database.",
+)
+@click.option(
+    "--database",
+    default="sqlite://db.sqlite3",
+    help="the database to read questions from",
+    show_default=True,
+)
+@click.option(
+    "-o",
+    "--output",
+    type=click.File("w", encoding="UTF-8"),
+    default="-",
+    help="where to write the near duplicates",
+    show_default=True,
+)
+@click.option(
+    "--against",
+    type=click.Path(exists=True, dir_okay=False),
+    default=None,
+    help="an index built with --collapse-duplicates to also match the questions against",
+)
+@click.option(
+    "--threshold",
+    default=0.8,
+    help="how similar two questions' character shingles have to be to be near duplicates. Ignored with --against, which uses the index's.",
+    show_default=True,
+)
+@click.option("-q", "--quiet", is_flag=True, help="don't report progress")
+def find_duplicates(
+    output: TextIO,
+    input_file: Optional[TextIO] = None,
+    database: str = "sqlite://db.sqlite3",
+    against: Optional[str] = None,
+    threshold: float = 0.8,
+    quiet: bool = False,
+) -> None:
+    from autoguru.questionanswering import batch
+    from autoguru.questionanswering.deduplication import (
+        NearDuplicateDetector,
+        duplicates_path,
+    )
+
+    detector = (
+        NearDuplicateDetector.load(duplicates_path(against))
+        if against is not None
+        else NearDuplicateDetector(threshold=threshold)
+    )
+    records = (
+        batch.read_records(input_file, report=_skip_line)
+        if input_file is not None
+        else batch.fetch_records(database)
+    )
+    progress = _progress(quiet)
+    duplicates = 0
+    for record, duplicate in batch.deduplicate(records, detector):
+        progress.update(1)
+        if duplicate is None:
+            continue
+        duplicates += 1
+        output.write(
+            json.dumps(
+                {
+                    "id": str(record.id),
+                    "text": record.text,
+                    "answer_id": (
+                        str(record.answer_id) if record.answer_id is not None else None
+                    ),
+                    "duplicate_of": str(duplicate.key),
+                    "similarity": duplicate.similarity,
+                }
+            )
+            + "\n"
+        )
+    progress.log()
+    if not quiet:
+        click.echo(
+            json.dumps({**progress.summary(), "duplicates": duplicates}), err=True
+        )
+
+
+@question_answering.command(
+    name="memory",
+    help="Loads the models an index or bundle is answered with and reports how much memory each one takes",
+)
+@click.argument("index", type=click.Path(exists=True, dir_okay=False))
+@click.option(
+    "-t",
+    "--index-type",
+    type=_index_types(),
+    default="descent",
+    help="the type of the index",
+    show_default=True,
+)
+@click.option(
+    "--embedder",
+    default="https://tfhub.dev/google/universal-sentence-encoder/4",
+    help="the TensorFlow Hub embedder the index was built with",
+    show_default=True,
+)
+@click.option(
+    "--classifier",
+    type=click.Path(exists=True),
+    default=None,
+    help="a question classifier to also load",
+)
+@click.option(
+    "--answers",
+    type=click.Path(exists=True, file_okay=False),
+    default=None,
+    help="the answer lookup  [default next to the index]",
+)
+@click.option(
+    "--rerank-factor",
+    default=0,
+    help="load the index's saved vectors for reranking, as ask does with the same option",
+    show_default=True,
+)
+@click.option("--json", "as_json", is_flag=True, help="write the report as JSON")
+def memory(
+    index: str,
+    index_type: str = "descent",
+    embedder: str = "https://tfhub.dev/google/universal-sentence-encoder/4",
+    classifier: Optional[str] = None,
+    answers: Optional[str] = None,
+    rerank_factor: int = 0,
+    as_json: bool = False,
+) -> None:
+    from autoguru.questionanswering.answers import AnswerLookup, lookup_path
+    from autoguru.questionanswering.bundle import Bundle, is_bundle
+    from autoguru.questionanswering.embeddings.projection import for_index
+    from autoguru.questionanswering.embeddings.tfhub import TfHubEmbedder
+    from autoguru.questionanswering.nearestneighbors import index_class
+    from autoguru.questionanswering.nearestneighbors.reranking import (
+        RerankedNearestNeighbors,
+    )
+    from autoguru.questionanswering.utilities.memory import MemoryTracker
+
+    # Each component is loaded on its own, so the process's growth while loading it can be put down to it
+    tracker = MemoryTracker()
+    components: Dict[str, Any] = {}
+    # Bundles bring their own embedder, classifier and settings
+    bundle = Bundle.load(index) if is_bundle(index) else None
+    if bundle is not None:
+        embedder = bundle.manifest.embedder_url
+        if bundle.has_classifier:
+            classifier = str(bundle.classifier_path())
+    with tracker.loading("embedder"):
+        loaded = TfHubEmbedder.create(embedder)
+        components["embedder"] = (
+            bundle.project(loaded) if bundle is not None else for_index(loaded, index)
+        )
+    if classifier is not None:
+        from autoguru.questionanswering.questionclassification.ngramcnn import (
+            ConvolutionalNGrams,
+        )
+
+        with tracker.loading("classifier"):
+            components["classifier"] = ConvolutionalNGrams.load(classifier)
+    with tracker.loading("index"):
+        if bundle is not None:
+            components["index"] = bundle.index()
+        elif rerank_factor > 0:
+            components["index"] = RerankedNearestNeighbors.load(
+                index, factor=rerank_factor
+            )
+        else:
+            components["index"] = index_class(index_type).load(index)
+    with tracker.loading("answers"):
+        components["answers"] = (
+            bundle.answers()
+            if bundle is not None
+            else AnswerLookup.load(
+                answers if answers is not None else lookup_path(index)
+            )
+        )
+
+    report = tracker.measure(components)
+    click.echo(json.dumps(report.to_json()) if as_json else report.format())
+
+
+@question_answering.command(
+    name="bundle",
+    help="Packages an index, everything build-index saved next to it and a classifier into one file to serve from",
+)
+@click.argument("index", type=click.Path(exists=True, dir_okay=False))
+@click.option(
+    "-o",
+    "--output",
+    type=click.Path(dir_okay=False, writable=True),
+    required=True,
+    help="where to write the bundle",
+)
+@click.option(
+    "-t",
+    "--index-type",
+    type=_index_types(),
+    default="descent",
+    help="the type of the index",
+    show_default=True,
+)
+@click.option(
+    "--embedder",
+    default="https://tfhub.dev/google/universal-sentence-encoder/4",
+    help="the TensorFlow Hub embedder the index was built with",
+    show_default=True,
+)
+@click.option(
+    "--classifier",
+    type=click.Path(exists=True, file_okay=False),
+    default=None,
+    help="a question classifier to include",
+)
+@click.option(
+    "--answers",
+    type=click.Path(exists=True, file_okay=False),
+    default=None,
+    help="the answer lookup  [default next to the index]",
+)
+@click.option(
+    "--version",
+    "bundle_version",
+    default=None,
+    help="the version of the bundle  [default a digest of its contents]",
+)
+@click.option(
+    "--rerank-factor",
+    default=0,
+    help="rerank this many candidates per answer when serving the bundle. Needs an index built with --rerank. 0 doesn't rerank.",
+    show_default=True,
+)
+def bundle(
+    index: str,
+    output: str,
+    index_type: str = "descent",
+    embedder: str = "https://tfhub.dev/google/universal-sentence-encoder/4",
+    classifier: Optional[str] = None,
+    answers: Optional[str] = None,
+    bundle_version: Optional[str] = None,
+    rerank_factor: int = 0,
+) -> None:
+    from autoguru.questionanswering.bundle import Bundle
+
+    try:
+        created = Bundle.create(
+            output,
+            index_path=index,
+            index_type=index_type,
+            embedder_url=embedder,
+            classifier_path=classifier,
+            answers_path=answers,
+            version=bundle_version,
+            rerank_factor=rerank_factor,
+        )
+    except ValueError as error:
+        raise click.ClickException(str(error))
+    click.echo(json.dumps(created.manifest.to_json(), indent=2))
+
+
+@question_answering.command(
+    name="inspect-bundle", help="Shows a bundle's manifest and checks its contents"
+)
+@click.argument("bundle_file", type=click.Path(exists=True, dir_okay=False))
+@click.option(
+    "--verify/--no-verify",
+    default=True,
+    help="check every section against its digest",
+    show_default=True,
+)
+def inspect_bundle(bundle_file: str, verify: bool = True) -> None:
+    from autoguru.questionanswering.bundle import Bundle
+
+    try:
+        loaded = Bundle.load(bundle_file, verify=verify)
+    except ValueError as error:
+        raise click.ClickException(str(error))
+    click.echo(json.dumps(loaded.manifest.to_json(), indent=2))
+
+
 if __name__ == "__main__":
     question_answering(prog_name="autoguru-qa")
@@ -0,0 +1,316 @@
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Union
+
+import numpy as np
+
+from autoguru.questionanswering.answers import AnswerLookup, AnswerMatch, lookup_path
+from autoguru.questionanswering.bundle import Bundle, is_bundle
+from autoguru.questionanswering.embeddings import Embedder
+from autoguru.questionanswering.embeddings.instrumented import InstrumentedEmbedder
+from autoguru.questionanswering.embeddings.projection import for_index
+from autoguru.questionanswering.lexical import Fusion, HybridSearch
+from autoguru.questionanswering.nearestneighbors import (
+    NearestNeighbors,
+    Neighbor,
+    RowFilter,
+    index_class,
+)
+from autoguru.questionanswering.nearestneighbors.filtering import (
+    RowAttributes,
+    attributes_path,
+)
+from autoguru.questionanswering.nearestneighbors.instrumented import (
+    InstrumentedNearestNeighbors,
+)
+from autoguru.questionanswering.nearestneighbors.reranking import (
+    RerankedNearestNeighbors,
+)
+from autoguru.questionanswering.pipeline import (
+    AnsweredQuestion,
+    QuestionAnsweringPipeline,
+    StageOptions,
+)
+from autoguru.questionanswering.questionclassification import (
+    DEFAULT_MIN_CONFIDENCE,
+    QuestionClassification,
+    QuestionClassifier,
+    is_answerable,
+)
+from autoguru.questionanswering.questionclassification.instrumented import (
+    InstrumentedQuestionClassifier,
+)
+from autoguru.questionanswering.utilities.instrumentation import (
+    STAGE_BATCH_SIZE,
+    STAGE_LATENCY,
+)
+
+DEFAULT_EMBEDDER_URL: str = "https://tfhub.dev/google/universal-sentence-encoder/4"
+
+_ANSWERS_LATENCY = STAGE_LATENCY.labels("answers")
+_ANSWERS_BATCH_SIZE = STAGE_BATCH_SIZE.labels("answers")
+
+
+class BatchAnswerer:
+    """
+    Answers batches of questions through classify -> embed -> nearest neighbors -> answer lookup, running each stage
+    once for the whole batch. It's the one answering path the batch CLI, the pipeline, the web services and the Discord
+    bot share, so they all gate questions the same way.
+
+    Args:
+        embedder (Embedder): embeds the questions for the index
+        index (NearestNeighbors): the index of known questions
+        answers (AnswerLookup): maps index rows to answers
+        classifier (Optional[QuestionClassifier]): the question gate. If None, every line is treated as a question.
+        min_confidence (float): how confident the classifier has to be that a line is a question
+        hybrid (Optional[HybridSearch]): if given, also searches the questions' words and fuses the results, and
+            answers questions it matches about exactly without embedding them
+        allowed (Optional[RowFilter]): if given, only these rows of the index are matched
+    """
+
+    DEFAULT_MIN_CONFIDENCE: float = DEFAULT_MIN_CONFIDENCE
+
+    def __init__(
+        self,
+        embedder: Embedder,
+        index: NearestNeighbors,
+        answers: AnswerLookup,
+        classifier: Optional[QuestionClassifier] = None,
+        min_confidence: float = DEFAULT_MIN_CONFIDENCE,
+        hybrid: Optional[HybridSearch] = None,
+        allowed: Optional[RowFilter] = None,
+    ) -> None:
+        self._embedder: Embedder = embedder
+        self._index: NearestNeighbors = index
+        self._answers: AnswerLookup = answers
+        self._classifier: Optional[QuestionClassifier] = classifier
+        self._min_confidence: float = min_confidence
+        self._hybrid: Optional[HybridSearch] = hybrid
+        self._allowed: Optional[RowFilter] = allowed
+
+    @property
+    def embedder(self) -> Embedder:
+        return self._embedder
+
+    def answer_questions(
+        self,
+        questions: List[str],
+        k: int = 1,
+        answer_all: bool = False,
+        vectors: Optional[np.ndarray] = None,
+        timings: Optional[Dict[str, float]] = None,
+    ) -> List[AnsweredQuestion]:
+        """
+        Finds the k closest known questions and their answers for each question. Only the questions the classifier
+        lets through are embedded and searched for, and the rest get no matches.
+
+        Args:
+            questions (List[str]): the questions to answer
+            k (int): how many answers to find for each question
+            answer_all (bool): whether to answer text the classifier doesn't think is a question
+            vectors (Optional[np.ndarray]): the questions' embeddings if the caller already has them, like from an
+                answer cache's similarity tier, so they aren't embedded again. Hybrid searches embed by themselves.
+            timings (Optional[Dict[str, float]]): if given, the milliseconds spent in each stage are set in it
+        """
+        if timings is None:
+            timings = {}
+
+        start = time.perf_counter()
+        classifications: List[Optional[QuestionClassification]] = [None] * len(
+            questions
+        )
+        if self._classifier is not None and questions:
+            classifications = [
+                classification[0]
+                for classification in self._classifier.classify(questions, k=1)
+            ]
+        timings["classify"] = (time.perf_counter() - start) * 1000.0
+
+        rows = [
+            row
+            for row, classification in enumerate(classifications)
+            if is_answerable(classification, self._min_confidence, answer_all)
+        ]
+        matches: List[List[AnswerMatch]] = [[] for _ in questions]
+        if rows:
+            neighbors = self._search(questions, rows, k, vectors, timings)
+
+            start = time.perf_counter()
+            for row, row_matches in zip(rows, self._answers.answers(neighbors)):
+                matches[row] = row_matches
+            elapsed = time.perf_counter() - start
+            _ANSWERS_LATENCY.observe(elapsed)
+            _ANSWERS_BATCH_SIZE.observe(len(rows))
+            timings["answers"] = elapsed * 1000.0
+
+        return [
+            AnsweredQuestion(
+                question=question, classification=classification, answers=answers
+            )
+            for question, classification, answers in zip(
+                questions, classifications, matches
+            )
+        ]
+
+    def _search(
+        self,
+        questions: List[str],
+        rows: List[int],
+        k: int,
+        vectors: Optional[np.ndarray],
+        timings: Dict[str, float],
+    ) -> Sequence[Sequence[Neighbor]]:
+        texts = [questions[row] for row in rows]
+        if self._hybrid is not None:
+            start = time.perf_counter()
+            neighbors = self._hybrid.search(
+                texts, self._embedder, self._index, k=k, allowed=self._allowed
+            )
+            timings["nearest_neighbors"] = (time.perf_counter() - start) * 1000.0
+            return neighbors
+
+        start = time.perf_counter()
+        row_vectors = (
+            vectors[rows] if vectors is not None else self._embedder.embed(texts)
+        )
+        timings["embed"] = (time.perf_counter() - start) * 1000.0
+
+        start = time.perf_counter()
+        neighbors = self._index.nearest_neighbors(
+            row_vectors, k=k, allowed=self._allowed
+        )
+        timings["nearest_neighbors"] = (time.perf_counter() - start) * 1000.0
+        return neighbors
+
+    def answer(self, questions: List[str], k: int = 1) -> List[List[AnswerMatch]]:
+        """
+        Finds the k closest known questions and their answers for each question. Text the classifier doesn't think is a
+        question gets no matches.
+        """
+        return [answered.answers for answered in self.answer_questions(questions, k=k)]
+
+    def pipeline(self, k: int = 1, batch_size: int = 64) -> QuestionAnsweringPipeline:
+        options = StageOptions(batch_size=batch_size)
+        return QuestionAnsweringPipeline(
+            embedder=self._embedder,
+            index=self._index,
+            answers=self._answers,
+            classifier=self._classifier,
+            k=k,
+            min_confidence=self._min_confidence,
+            classify=options,
+            embed=options,
+            nearest_neighbors=options,
+            answer=options,
+            hybrid=self._hybrid,
+            allowed=self._allowed,
+        )
+
+    @classmethod
+    def load(
+        cls,
+        index_path: Union[str, Path],
+        index_type: str = "descent",
+        embedder_url: str = DEFAULT_EMBEDDER_URL,
+        classifier_path: Optional[Union[str, Path]] = None,
+        answers_path: Optional[Union[str, Path]] = None,
+        min_confidence: float = DEFAULT_MIN_CONFIDENCE,
+        rerank_factor: int = 0,
+        fusion: Optional[Fusion] = None,
+        lexical_weight: float = HybridSearch.DEFAULT_LEXICAL_WEIGHT,
+        min_lexical_confidence: Optional[
+            float
+        ] = HybridSearch.DEFAULT_MIN_LEXICAL_CONFIDENCE,
+        where: Optional[Dict[str, Any]] = None,
+    ) -> "BatchAnswerer":
+        """
+        Args:
+            fusion (Optional[Fusion]): if given, fuses the index's results with those of the BM25 index saved next to
+                it by build_index(lexical=True). The other arguments are as for HybridSearch.
+            where (Optional[Dict[str, Any]]): if given, only matches rows whose attributes meet these conditions, as
+                for RowAttributes.filter
+        """
+        from autoguru.questionanswering.embeddings.tfhub import TfHubEmbedder
+
+        # Bundles bring their own embedder, classifier and index settings
+        if is_bundle(index_path):
+            if fusion is not None:
+                raise ValueError("Bundles don't include a lexical index to fuse with")
+            if where:
+                raise ValueError("Bundles don't include row attributes to filter by")
+            return cls.from_bundle(index_path, min_confidence=min_confidence)
+
+        embedder = TfHubEmbedder.create(embedder_url)
+        classifier = (
+            load_classifier(embedder, classifier_path)
+            if classifier_path is not None
+            else None
+        )
+        # Reranking needs the vectors saved by build_index(rerank=True), and fetches rerank_factor candidates per answer
+        index: NearestNeighbors = (
+            RerankedNearestNeighbors.load(index_path, factor=rerank_factor)
+            if rerank_factor > 0
+            else index_class(index_type).load(index_path)
+        )
+        return cls(
+            embedder=InstrumentedEmbedder(for_index(embedder, index_path)),
+            index=InstrumentedNearestNeighbors(index),
+            answers=AnswerLookup.load(
+                answers_path if answers_path is not None else lookup_path(index_path)
+            ),
+            classifier=classifier,
+            min_confidence=min_confidence,
+            hybrid=(
+                HybridSearch.load(
+                    index_path,
+                    fusion=fusion,
+                    lexical_weight=lexical_weight,
+                    min_lexical_confidence=min_lexical_confidence,
+                )
+                if fusion is not None
+                else None
+            ),
+            allowed=(
+                RowAttributes.load(attributes_path(index_path)).filter(**where)
+                if where
+                else None
+            ),
+        )
+
+    @classmethod
+    def from_bundle(
+        cls,
+        bundle_path: Union[str, Path],
+        min_confidence: float = DEFAULT_MIN_CONFIDENCE,
+    ) -> "BatchAnswerer":
+        from autoguru.questionanswering.embeddings.tfhub import TfHubEmbedder
+
+        bundle = Bundle.load(bundle_path)
+        embedder = TfHubEmbedder.create(bundle.manifest.embedder_url)
+        return cls(
+            embedder=InstrumentedEmbedder(bundle.project(embedder)),
+            index=InstrumentedNearestNeighbors(bundle.index()),
+            answers=bundle.answers(),
+            classifier=(
+                load_classifier(embedder, bundle.classifier_path())
+                if bundle.has_classifier
+                else None
+            ),
+            min_confidence=min_confidence,
+        )
+
+
+def load_classifier(
+    embedder: Embedder, classifier_path: Union[str, Path]
+) -> QuestionClassifier:
+    from autoguru.questionanswering.questionclassification.ngramcnn import (
+        ConvolutionalNGramClassifier,
+        ConvolutionalNGrams,
+    )
+
+    return InstrumentedQuestionClassifier(
+        ConvolutionalNGramClassifier.create(
+            embedder=embedder,
+            classifier=ConvolutionalNGrams.load(classifier_path),
+        )
+    )
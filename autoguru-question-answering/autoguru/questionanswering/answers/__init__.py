@@ -0,0 +1,19 @@
+from autoguru.questionanswering.answers.cache import (
+    AnswerCache,
+    CacheLookup,
+    normalize_question,
+)
+from autoguru.questionanswering.answers.lookup import (
+    AnswerLookup,
+    AnswerMatch,
+    lookup_path,
+)
+
+__all__ = [
+    "AnswerCache",
+    "AnswerLookup",
+    "AnswerMatch",
+    "CacheLookup",
+    "lookup_path",
+    "normalize_question",
+]
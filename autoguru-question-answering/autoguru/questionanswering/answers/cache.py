@@ -0,0 +1,222 @@
+import re
+import threading
+import time
+import unicodedata
+from dataclasses import dataclass
+from typing import Callable, Generic, Hashable, List, Optional, Sequence, TypeVar
+
+import numpy as np
+
+from autoguru.questionanswering.utilities.caching import TTLCache
+from autoguru.questionanswering.utilities.instrumentation import CACHE_REQUESTS
+
+V = TypeVar("V")
+
+_PUNCTUATION = re.compile(r"[^\w\s]+")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_question(text: str) -> str:
+    """
+    Normalizes a question for exact matching: Unicode compatibility forms are folded, case and punctuation are dropped
+    and whitespace is collapsed, so "How do I reset my password??" and "how do i reset my  password" match.
+    """
+    text = unicodedata.normalize("NFKC", text).casefold()
+    text = _PUNCTUATION.sub(" ", text)
+    return _WHITESPACE.sub(" ", text).strip()
+
+
+@dataclass
+class CacheLookup(Generic[V]):
+    """
+    The result of looking a batch of questions up in an AnswerCache.
+
+    Args:
+        values (List[Optional[V]]): the cached value for each question, or None if it missed both tiers
+        misses (List[int]): the indexes of the questions that missed
+        vectors (Optional[np.ndarray]): the embeddings of the missed questions in the same order, if they were embedded for the similarity tier
+    """
+
+    values: List[Optional[V]]
+    misses: List[int]
+    vectors: Optional[np.ndarray]
+
+
+class AnswerCache(Generic[V]):
+    """
+    Caches answers to recently asked questions in two tiers.
+
+    The exact tier is keyed by the normalized question text and skips every stage, including embedding. Questions that
+    miss it can be checked against the embeddings of the last recent_size questions that were answered, and a close
+    enough match (a near duplicate phrased a little differently) reuses that answer and skips classification, the index
+    search and the answer lookup.
+
+    Values are cached per scope, so answers found with different settings (like k) are never mixed up.
+
+    Args:
+        max_size (int): the most answers to keep in the exact tier
+        ttl (float): how many seconds answers are kept for in both tiers
+        similarity (Optional[float]): the cosine similarity a recent question has to reach to count as a near duplicate. If None, there's no similarity tier.
+        recent_size (int): how many recently answered questions the similarity tier compares against
+    """
+
+    DEFAULT_MAX_SIZE: int = 4096
+    DEFAULT_TTL: float = 300.0
+    DEFAULT_SIMILARITY: float = 0.95
+    DEFAULT_RECENT_SIZE: int = 1024
+
+    def __init__(
+        self,
+        max_size: int = DEFAULT_MAX_SIZE,
+        ttl: float = DEFAULT_TTL,
+        similarity: Optional[float] = DEFAULT_SIMILARITY,
+        recent_size: int = DEFAULT_RECENT_SIZE,
+    ) -> None:
+        self._ttl: float = ttl
+        self._exact: TTLCache[Hashable, V] = TTLCache(
+            max_size=max_size, ttl=ttl, name="answers"
+        )
+        self._similarity: Optional[float] = similarity if recent_size > 0 else None
+        self._recent_size: int = recent_size
+        self._lock: threading.Lock = threading.Lock()
+        # The similarity tier is a ring buffer of unit vectors and what they were answered with
+        self._vectors: Optional[np.ndarray] = None
+        self._expires: np.ndarray = np.zeros(recent_size, dtype=np.float64)
+        self._scopes: List[Hashable] = [None] * recent_size
+        self._values: List[Optional[V]] = [None] * recent_size
+        self._next: int = 0
+        self._similar_hits = CACHE_REQUESTS.labels("answers_similar", "hit")
+        self._similar_misses = CACHE_REQUESTS.labels("answers_similar", "miss")
+
+    @property
+    def checks_similarity(self) -> bool:
+        return self._similarity is not None
+
+    def get(self, question: str, scope: Hashable = None) -> Optional[V]:
+        return self._exact.get((normalize_question(question), scope))
+
+    def get_similar(
+        self, vectors: np.ndarray, scope: Hashable = None
+    ) -> List[Optional[V]]:
+        """
+        Finds the answer to a recent near duplicate of each embedded question.
+
+        Args:
+            vectors (np.ndarray): the embedded questions
+            scope (Hashable): the scope the answers have to be from
+
+        Returns:
+            The answer to the most similar recent question for each vector, or None if there isn't one that's close enough
+        """
+        if self._similarity is None or self._vectors is None or len(vectors) == 0:
+            return [None] * len(vectors)
+
+        queries = _unit(vectors)
+        with self._lock:
+            similarities = queries @ self._vectors.T
+            # Expired slots and slots from other scopes can never match
+            unusable = self._expires <= time.monotonic()
+            unusable |= np.fromiter(
+                (slot_scope != scope for slot_scope in self._scopes),
+                dtype=bool,
+                count=self._recent_size,
+            )
+            similarities[:, unusable] = -np.inf
+            best = similarities.argmax(axis=1)
+            values = [
+                (
+                    self._values[slot]
+                    if similarities[row, slot] >= self._similarity
+                    else None
+                )
+                for row, slot in enumerate(best.tolist())
+            ]
+
+        for value in values:
+            (self._similar_hits if value is not None else self._similar_misses).inc()
+        return values
+
+    def lookup(
+        self,
+        questions: Sequence[str],
+        embed: Callable[[List[str]], np.ndarray],
+        scope: Hashable = None,
+    ) -> CacheLookup[V]:
+        """
+        Looks a batch of questions up in the exact tier and then, if there is one, the similarity tier. Only the
+        questions that miss the exact tier are embedded.
+
+        Args:
+            questions (Sequence[str]): the questions to look up
+            embed (Callable[[List[str]], np.ndarray]): embeds questions for the similarity tier
+            scope (Hashable): the scope the answers have to be from
+
+        Returns:
+            The cached values, which questions missed and, if they were embedded, the embeddings of the misses
+        """
+        values = [self.get(question, scope) for question in questions]
+        misses = [i for i, value in enumerate(values) if value is None]
+        if not misses or not self.checks_similarity:
+            return CacheLookup(values=values, misses=misses, vectors=None)
+
+        vectors = embed([questions[i] for i in misses])
+        remaining = []
+        for row, value in enumerate(self.get_similar(vectors, scope)):
+            if value is not None:
+                values[misses[row]] = value
+            else:
+                remaining.append(row)
+        return CacheLookup(
+            values=values,
+            misses=[misses[row] for row in remaining],
+            vectors=vectors[remaining],
+        )
+
+    def set(
+        self,
+        question: str,
+        value: V,
+        scope: Hashable = None,
+        vector: Optional[np.ndarray] = None,
+    ) -> None:
+        """
+        Caches the answer to a question.
+
+        Args:
+            question (str): the question
+            value (V): its answer
+            scope (Hashable): the scope the answer was found in
+            vector (Optional[np.ndarray]): the question's embedding. If given, near duplicates of the question can also use the answer.
+        """
+        self._exact.set((normalize_question(question), scope), value)
+        if self._similarity is None or vector is None:
+            return
+
+        vector = _unit(vector.reshape((1, -1)))[0]
+        with self._lock:
+            if self._vectors is None:
+                self._vectors = np.zeros(
+                    (self._recent_size, vector.shape[0]), dtype=np.float32
+                )
+            slot = self._next
+            self._next = (slot + 1) % self._recent_size
+            self._vectors[slot] = vector
+            self._expires[slot] = time.monotonic() + self._ttl
+            self._scopes[slot] = scope
+            self._values[slot] = value
+
+    def clear(self) -> None:
+        self._exact.clear()
+        with self._lock:
+            self._vectors = None
+            self._expires[:] = 0.0
+            self._scopes = [None] * self._recent_size
+            self._values = [None] * self._recent_size
+            self._next = 0
+
+
+def _unit(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0.0] = 1.0
+    return vectors / norms
@@ -0,0 +1,216 @@
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple, Union
+from uuid import UUID
+
+import numpy as np
+
+from autoguru.questionanswering.nearestneighbors import Neighbor
+
+_UUID_BYTES: int = 16
+_NO_ANSWER: int = -1
+
+_QUESTION_IDS_FILE: str = "question_ids.npy"
+_ANSWER_ROWS_FILE: str = "answer_rows.npy"
+_ANSWER_IDS_FILE: str = "answer_ids.npy"
+_TEXT_SPANS_FILE: str = "text_spans.npy"
+_TEXT_FILE: str = "text.npy"
+
+LOOKUP_SUFFIX: str = ".answers"
+
+
+def lookup_path(index_file: Union[str, Path]) -> Path:
+    if isinstance(index_file, str):
+        index_file = Path(index_file)
+
+    return index_file.with_name(index_file.name + LOOKUP_SUFFIX)
+
+
+@dataclass
+class AnswerMatch:
+    __slots__ = ["question_id", "answer_id", "text", "similarity"]
+
+    question_id: UUID
+    answer_id: Optional[UUID]
+    text: Optional[str]
+    similarity: float
+
+
+class AnswerLookup:
+    """
+    Maps nearest neighbor index rows to the question they were built from and the answer to that question without touching the database.
+
+    Args:
+        question_ids (np.ndarray): row -> question id as an (N x 16) uint8 array of UUID bytes
+        answer_rows (np.ndarray): row -> answer slot as an (N,) int32 array, -1 for unanswered questions
+        answer_ids (np.ndarray): answer slot -> answer id as an (M x 16) uint8 array of UUID bytes
+        text_spans (np.ndarray): answer slot -> [start, end) byte span in text as an (M x 2) int64 array
+        text (np.ndarray): deduplicated UTF-8 answer text as a flat uint8 array
+    """
+
+    def __init__(
+        self,
+        question_ids: np.ndarray,
+        answer_rows: np.ndarray,
+        answer_ids: np.ndarray,
+        text_spans: np.ndarray,
+        text: np.ndarray,
+    ) -> None:
+        self._question_ids: np.ndarray = question_ids
+        self._answer_rows: np.ndarray = answer_rows
+        self._answer_ids: np.ndarray = answer_ids
+        self._text_spans: np.ndarray = text_spans
+        self._text: np.ndarray = text
+
+    def __len__(self) -> int:
+        return self._answer_rows.shape[0]
+
+    @property
+    def arrays(self) -> Dict[str, np.ndarray]:
+        """
+        The lookup's arrays by the name of the argument each is passed to the constructor as.
+        """
+        return {
+            "question_ids": self._question_ids,
+            "answer_rows": self._answer_rows,
+            "answer_ids": self._answer_ids,
+            "text_spans": self._text_spans,
+            "text": self._text,
+        }
+
+    def answer_indexes(self, indexes: np.ndarray) -> np.ndarray:
+        return self._answer_rows[indexes]
+
+    def question_id(self, index: int) -> UUID:
+        return UUID(bytes=self._question_ids[index].tobytes())
+
+    def answer_id(self, answer_index: int) -> Optional[UUID]:
+        if answer_index == _NO_ANSWER:
+            return None
+        return UUID(bytes=self._answer_ids[answer_index].tobytes())
+
+    def text(self, answer_index: int) -> Optional[str]:
+        if answer_index == _NO_ANSWER:
+            return None
+        start, end = self._text_spans[answer_index]
+        return self._text[start:end].tobytes().decode("UTF-8")
+
+    def answers(
+        self, neighbors: Sequence[Sequence[Neighbor]]
+    ) -> List[List[AnswerMatch]]:
+        # Gather every answer slot for the whole batch at once, then split the flat result
+        # back up by query
+        indexes = np.fromiter(
+            (neighbor.index for query in neighbors for neighbor in query),
+            dtype=np.int64,
+        )
+        answer_indexes = self.answer_indexes(indexes).tolist()
+
+        matches: List[List[AnswerMatch]] = []
+        offset = 0
+        for query in neighbors:
+            query_matches: List[AnswerMatch] = []
+            for neighbor in query:
+                answer_index = answer_indexes[offset]
+                query_matches.append(
+                    AnswerMatch(
+                        question_id=self.question_id(neighbor.index),
+                        answer_id=self.answer_id(answer_index),
+                        text=self.text(answer_index),
+                        similarity=neighbor.similarity,
+                    )
+                )
+                offset += 1
+            matches.append(query_matches)
+        return matches
+
+    def save(self, lookup_directory: Union[str, Path]) -> None:
+        if isinstance(lookup_directory, str):
+            lookup_directory = Path(lookup_directory)
+
+        lookup_directory.mkdir(parents=True, exist_ok=True)
+        np.save(lookup_directory.joinpath(_QUESTION_IDS_FILE), self._question_ids)
+        np.save(lookup_directory.joinpath(_ANSWER_ROWS_FILE), self._answer_rows)
+        np.save(lookup_directory.joinpath(_ANSWER_IDS_FILE), self._answer_ids)
+        np.save(lookup_directory.joinpath(_TEXT_SPANS_FILE), self._text_spans)
+        np.save(lookup_directory.joinpath(_TEXT_FILE), self._text)
+
+    @classmethod
+    def load(
+        cls, lookup_directory: Union[str, Path], memory_map: bool = True
+    ) -> "AnswerLookup":
+        if isinstance(lookup_directory, str):
+            lookup_directory = Path(lookup_directory)
+
+        mmap_mode = "r" if memory_map else None
+        return cls(
+            question_ids=np.load(
+                lookup_directory.joinpath(_QUESTION_IDS_FILE), mmap_mode=mmap_mode
+            ),
+            answer_rows=np.load(
+                lookup_directory.joinpath(_ANSWER_ROWS_FILE), mmap_mode=mmap_mode
+            ),
+            answer_ids=np.load(
+                lookup_directory.joinpath(_ANSWER_IDS_FILE), mmap_mode=mmap_mode
+            ),
+            text_spans=np.load(
+                lookup_directory.joinpath(_TEXT_SPANS_FILE), mmap_mode=mmap_mode
+            ),
+            text=np.load(lookup_directory.joinpath(_TEXT_FILE), mmap_mode=mmap_mode),
+        )
+
+    @classmethod
+    def create(
+        cls, rows: Iterable[Tuple[UUID, Optional[UUID], Optional[str]]]
+    ) -> "AnswerLookup":
+        """
+        Builds a lookup from (question id, answer id, answer text) tuples given in index row order.
+
+        Args:
+            rows (Iterable[Tuple[UUID, Optional[UUID], Optional[str]]]): one tuple per index row. The answer id and text are None for unanswered questions.
+
+        Returns:
+            The lookup for the rows
+        """
+        question_ids = bytearray()
+        answer_rows: List[int] = []
+        answer_ids = bytearray()
+        text_spans: List[Tuple[int, int]] = []
+        text = bytearray()
+
+        answer_slots: Dict[UUID, int] = {}
+        text_slots: Dict[str, Tuple[int, int]] = {}
+        for question_id, answer_id, answer_text in rows:
+            question_ids.extend(question_id.bytes)
+            if answer_id is None:
+                answer_rows.append(_NO_ANSWER)
+                continue
+
+            answer_slot = answer_slots.get(answer_id)
+            if answer_slot is None:
+                answer_slot = len(answer_slots)
+                answer_slots[answer_id] = answer_slot
+                answer_ids.extend(answer_id.bytes)
+
+                if answer_text is None:
+                    answer_text = ""
+                span = text_slots.get(answer_text)
+                if span is None:
+                    encoded = answer_text.encode("UTF-8")
+                    span = (len(text), len(text) + len(encoded))
+                    text_slots[answer_text] = span
+                    text.extend(encoded)
+                text_spans.append(span)
+            answer_rows.append(answer_slot)
+
+        return cls(
+            question_ids=np.frombuffer(question_ids, dtype=np.uint8)
+            .reshape((-1, _UUID_BYTES))
+            .copy(),
+            answer_rows=np.asarray(answer_rows, dtype=np.int32),
+            answer_ids=np.frombuffer(answer_ids, dtype=np.uint8)
+            .reshape((-1, _UUID_BYTES))
+            .copy(),
+            text_spans=np.asarray(text_spans, dtype=np.int64).reshape((-1, 2)),
+            text=np.frombuffer(text, dtype=np.uint8).copy(),
+        )
@@ -0,0 +1,672 @@
+import asyncio
+import json
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from dataclasses import dataclass
+from multiprocessing import get_context
+from pathlib import Path
+from typing import (
+    Any,
+    Callable,
+    Deque,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    TextIO,
+    Tuple,
+    TypeVar,
+    Union,
+)
+from uuid import NAMESPACE_URL, UUID, uuid5
+
+import numpy as np
+
+from autoguru.questionanswering.answering import BatchAnswerer
+from autoguru.questionanswering.answers import AnswerLookup, AnswerMatch, lookup_path
+from autoguru.questionanswering.deduplication import (
+    NearDuplicate,
+    NearDuplicateDetector,
+    duplicates_path,
+)
+from autoguru.questionanswering.embeddings import Embedder
+from autoguru.questionanswering.embeddings.projection import (
+    Projection,
+    evaluate,
+    projection_path,
+)
+from autoguru.questionanswering.lexical import (
+    BM25Builder,
+    BM25Index,
+    lexical_path,
+)
+from autoguru.questionanswering.nearestneighbors import index_class
+from autoguru.questionanswering.nearestneighbors.filtering import (
+    RowAttributesBuilder,
+    attributes_path,
+)
+from autoguru.questionanswering.nearestneighbors.reranking import (
+    RerankedNearestNeighbors,
+    vectors_path,
+)
+from autoguru.questionanswering.nearestneighbors.tuning import (
+    Tuner,
+    TuningResult,
+    tuning_path,
+)
+from autoguru.questionanswering.utilities.instrumentation import (
+    DATABASE_LATENCY,
+    SPANS,
+)
+
+T = TypeVar("T")
+
+DEFAULT_DATABASE_URL: str = "sqlite://db.sqlite3"
+
+
+def chunked(items: Iterable[T], size: int) -> Iterator[List[T]]:
+    chunk: List[T] = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class Progress:
+    """
+    Counts processed items and reports the running throughput at most once per interval.
+
+    Args:
+        report (Optional[Callable[[str], None]]): where to send progress messages. If None, progress isn't reported.
+        unit (str): what's being counted, for the messages
+        interval (float): the fewest seconds between messages
+    """
+
+    DEFAULT_INTERVAL: float = 5.0
+
+    def __init__(
+        self,
+        report: Optional[Callable[[str], None]] = None,
+        unit: str = "questions",
+        interval: float = DEFAULT_INTERVAL,
+    ) -> None:
+        self._report: Optional[Callable[[str], None]] = report
+        self._unit: str = unit
+        self._interval: float = interval
+        self._start: float = time.perf_counter()
+        self._reported: float = self._start
+        self.count: int = 0
+
+    @property
+    def seconds(self) -> float:
+        return time.perf_counter() - self._start
+
+    @property
+    def per_second(self) -> float:
+        seconds = self.seconds
+        return self.count / seconds if seconds > 0 else 0.0
+
+    def update(self, count: int) -> None:
+        self.count += count
+        now = time.perf_counter()
+        if self._report is not None and now - self._reported >= self._interval:
+            self._reported = now
+            self.log()
+
+    def log(self) -> None:
+        if self._report is not None:
+            self._report(
+                f"{self.count} {self._unit} in {self.seconds:.1f}s ({self.per_second:.1f}/s)"
+            )
+
+    def summary(self) -> Dict[str, float]:
+        return {
+            self._unit: self.count,
+            "seconds": self.seconds,
+            f"{self._unit}_per_second": self.per_second,
+        }
+
+
+@dataclass
+class QuestionRecord:
+    """
+    A question to build an index from.
+
+    Args:
+        id (UUID): the question's id
+        text (str): the question
+        answer_id (Optional[UUID]): the id of the question's answer, if it has one
+        answer (Optional[str]): the formatted text of the question's answer, if it has one
+        attributes (Optional[Dict[str, Any]]): JSON values to filter searches by, like the question's tenant or language
+    """
+
+    id: UUID
+    text: str
+    answer_id: Optional[UUID] = None
+    answer: Optional[str] = None
+    attributes: Optional[Dict[str, Any]] = None
+
+
+@dataclass
+class LineError:
+    """
+    A line of input that couldn't be read, reported in its place.
+
+    Args:
+        line (int): the line's number, starting from 1
+        error (str): what was wrong with it
+    """
+
+    line: int
+    error: str
+
+
+def _optional_uuid(record: Dict[str, Any], key: str) -> Optional[UUID]:
+    value = record.get(key)
+    if value is None:
+        return None
+    if not isinstance(value, str):
+        raise ValueError(f'"{key}" has to be a UUID string')
+    return UUID(value)
+
+
+def _parse_record(line: str) -> QuestionRecord:
+    if not line.startswith("{"):
+        return QuestionRecord(id=uuid5(NAMESPACE_URL, line), text=line)
+
+    try:
+        record = json.loads(line)
+    except ValueError as error:
+        raise ValueError(f"invalid JSON: {error}")
+    if not isinstance(record, dict) or not isinstance(record.get("text"), str):
+        raise ValueError('expected an object with a "text" string')
+    if not isinstance(record.get("attributes") or {}, dict):
+        raise ValueError('"attributes" has to be an object')
+    text = record["text"]
+    question_id = _optional_uuid(record, "id")
+    return QuestionRecord(
+        id=question_id if question_id is not None else uuid5(NAMESPACE_URL, text),
+        text=text,
+        answer_id=_optional_uuid(record, "answer_id"),
+        answer=record.get("answer"),
+        attributes=record.get("attributes"),
+    )
+
+
+def read_records(
+    lines: Iterable[str], report: Optional[Callable[[LineError], None]] = None
+) -> Iterator[QuestionRecord]:
+    """
+    Reads questions one per line. A line is either a JSON object like
+
+    {"id": "...", "text": "How do I reset my password?", "answer_id": "...", "answer": "...", "attributes": {...}}
+
+    where only "text" is required, or just the question's text. Questions without an id get one derived from their text.
+    Blank lines are skipped, and so are lines that can't be read, which are passed to report if it's given.
+    """
+    for number, line in enumerate(lines, start=1):
+        line = line.strip()
+        if not line:
+            continue
+
+        try:
+            record = _parse_record(line)
+        except ValueError as error:
+            if report is not None:
+                report(LineError(line=number, error=str(error)))
+            continue
+        yield record
+
+
+_SELECT_LATENCY = DATABASE_LATENCY.labels("select")
+
+
+def fetch_records(
+    database_url: str = DEFAULT_DATABASE_URL, chunk_size: int = 1000
+) -> Iterator[QuestionRecord]:
+    """
+    Streams every question and its answer out of the database in id order, chunk_size questions per query, so the
+    questions never all have to be in memory at once.
+
+    Args:
+        database_url (str): the Tortoise database URL
+        chunk_size (int): how many questions to query at once
+    """
+    from tortoise import Tortoise
+
+    from autoguru.persistence import Question
+
+    loop = asyncio.new_event_loop()
+    loop.run_until_complete(
+        Tortoise.init(db_url=database_url, modules={"models": ["autoguru.persistence"]})
+    )
+    try:
+        last: Optional[UUID] = None
+        while True:
+            query = Question.all() if last is None else Question.filter(id__gt=last)
+            # Also records a db.select span, so profiled builds show how long they wait on the database
+            with _SELECT_LATENCY.time():
+                questions = loop.run_until_complete(
+                    query.order_by("id").limit(chunk_size).prefetch_related("answer")
+                )
+            for question in questions:
+                answer = question.answer
+                yield QuestionRecord(
+                    id=question.id,
+                    text=question.text,
+                    answer_id=answer.id if answer is not None else None,
+                    answer=answer.formatted_text if answer is not None else None,
+                )
+            if len(questions) < chunk_size:
+                break
+            last = questions[-1].id
+    finally:
+        loop.run_until_complete(Tortoise.close_connections())
+        loop.close()
+
+
+def deduplicate(
+    records: Iterable[QuestionRecord], detector: NearDuplicateDetector
+) -> Iterator[Tuple[QuestionRecord, Optional[NearDuplicate]]]:
+    """
+    Matches each question against the ones added to the detector before it, and adds it unless it's a near duplicate.
+    Questions only match other phrasings of the same answer, unless they don't have an answer.
+
+    Returns:
+        Each question and the earlier question it's a near duplicate of, if it is one
+    """
+    for record in records:
+        yield record, detector.add_unless_duplicate(
+            record.id, record.text, group=record.answer_id
+        )
+
+
+def _sidecar_summaries(
+    index_path: Union[str, Path],
+    bm25: Optional[BM25Index],
+    detector: Optional[NearDuplicateDetector],
+    collapsed: int,
+    projection_summary: Optional[Dict[str, Any]],
+    tuning: Optional[TuningResult],
+) -> Dict[str, Any]:
+    """
+    Summarizes the optional files build_index saved next to the index.
+    """
+    summary: Dict[str, Any] = {}
+    if bm25 is not None:
+        summary["lexical"] = {
+            "path": str(lexical_path(index_path)),
+            "terms": bm25.vocabulary_size,
+        }
+    if detector is not None:
+        summary["duplicates"] = {
+            "path": str(duplicates_path(index_path)),
+            "threshold": detector.threshold,
+            "collapsed": collapsed,
+        }
+    if projection_summary is not None:
+        summary["projection"] = {
+            "path": str(projection_path(index_path)),
+            **projection_summary,
+        }
+    if tuning is not None:
+        summary["tuning"] = {
+            "path": str(tuning_path(index_path)),
+            "target_met": tuning.target_met,
+            "recall": tuning.best.recall,
+            "p95_ms": tuning.best.p95_ms,
+            "trials": len(tuning.trials),
+        }
+    return summary
+
+
+def build_index(
+    records: Iterable[QuestionRecord],
+    embedder: Embedder,
+    index_path: Union[str, Path],
+    index_type: str = "descent",
+    index_options: Optional[Dict[str, Any]] = None,
+    chunk_size: int = 256,
+    progress: Optional[Progress] = None,
+    rerank: bool = False,
+    tuner: Optional[Tuner] = None,
+    fit_projection: Optional[Callable[[np.ndarray], Projection]] = None,
+    detector: Optional[NearDuplicateDetector] = None,
+    lexical: bool = False,
+) -> Dict[str, Any]:
+    """
+    Embeds questions chunk_size at a time as they're read, builds a nearest neighbor index from them and saves it along
+    with the answer lookup and the attributes of its rows. Every row has an answered attribute besides the record's own.
+
+    Args:
+        records (Iterable[QuestionRecord]): the questions to index
+        embedder (Embedder): embeds the questions
+        index_path (Union[str, Path]): where to save the index. The answer lookup is saved next to it.
+        index_type (str): which index backend to build
+        index_options (Optional[Dict[str, Any]]): keyword arguments for the backend's create method
+        chunk_size (int): how many questions to embed at once
+        progress (Optional[Progress]): counts the embedded questions
+        rerank (bool): whether to also save the vectors so searches can be reranked exactly with RerankedNearestNeighbors
+        tuner (Optional[Tuner]): if given, first tunes the options index_options doesn't set on a sample of the questions.
+            The results are saved next to the index.
+        fit_projection (Optional[Callable[[np.ndarray], Projection]]): if given, fits a projection to the embeddings
+            to reduce them before they're indexed. It's saved next to the index, and loading the index projects queries
+            the same way.
+        detector (Optional[NearDuplicateDetector]): if given, near duplicates of earlier questions with the same answer
+            are collapsed into them before they're embedded. The detector is saved next to the index, so later imports
+            can be checked against what's indexed.
+        lexical (bool): whether to also build a BM25 index of the questions' words and save it next to the index, for
+            HybridSearch
+
+    Returns:
+        A summary of the build with the throughput of each step
+    """
+    if progress is None:
+        progress = Progress()
+
+    collapsed = 0
+    if detector is not None:
+
+        def unique(records: Iterable[QuestionRecord]) -> Iterator[QuestionRecord]:
+            nonlocal collapsed
+            for record, duplicate in deduplicate(records, detector):
+                if duplicate is None:
+                    yield record
+                else:
+                    collapsed += 1
+
+        records = unique(records)
+
+    # Only the embeddings and the answers are kept, not the question text
+    chunks: List[np.ndarray] = []
+    rows: List[Tuple[UUID, Optional[UUID], Optional[str]]] = []
+    terms: Optional[BM25Builder] = BM25Builder() if lexical else None
+    attributes = RowAttributesBuilder()
+    for chunk in chunked(records, chunk_size):
+        if terms is not None:
+            terms.add(record.text for record in chunk)
+        for record in chunk:
+            attributes.add(
+                {"answered": record.answer_id is not None, **(record.attributes or {})}
+            )
+        chunks.append(
+            np.asarray(
+                embedder.embed([record.text for record in chunk]), dtype=np.float32
+            )
+        )
+        rows.extend((record.id, record.answer_id, record.answer) for record in chunk)
+        progress.update(len(chunk))
+    progress.log()
+    embedding = progress.summary()
+    if not rows:
+        raise ValueError("There are no questions to index")
+
+    vectors = np.concatenate(chunks)
+    del chunks
+
+    projection: Optional[Projection] = None
+    projection_summary: Optional[Dict[str, Any]] = None
+    if fit_projection is not None:
+        with SPANS.span("projection"):
+            projection = fit_projection(vectors)
+            projection_summary = evaluate(projection, vectors)
+            vectors = projection.transform(vectors)
+
+    tuning: Optional[TuningResult] = None
+    if tuner is not None:
+        with SPANS.span("index_tuning"):
+            tuning = tuner.tune(vectors, index_types=[index_type], fixed=index_options)
+        index_options = tuning.best.options
+
+    start = time.perf_counter()
+    with SPANS.span("index_build"):
+        index = index_class(index_type).create(vectors, **(index_options or {}))
+    if rerank:
+        index = RerankedNearestNeighbors.create(vectors, index)
+    del vectors
+    bm25 = terms.build() if terms is not None else None
+    index_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    with SPANS.span("save"):
+        index.save(index_path)
+        if not rerank:
+            # Vectors left from an earlier build would be used to rerank searches of this one
+            vectors_path(index_path).unlink(missing_ok=True)
+        answers = AnswerLookup.create(rows)
+        answers.save(lookup_path(index_path))
+        row_attributes = attributes.build()
+        row_attributes.save(attributes_path(index_path))
+        if tuning is not None:
+            tuning.save(tuning_path(index_path))
+        if detector is not None:
+            detector.save(duplicates_path(index_path))
+        if bm25 is not None:
+            bm25.save(lexical_path(index_path))
+        else:
+            lexical_path(index_path).unlink(missing_ok=True)
+        if projection is not None:
+            projection.save(projection_path(index_path))
+        else:
+            # A projection left from an earlier build would be applied to queries against this one
+            projection_path(index_path).unlink(missing_ok=True)
+    save_seconds = time.perf_counter() - start
+
+    summary: Dict[str, Any] = {
+        "index": str(index_path),
+        "index_type": index_type,
+        "index_options": index_options or {},
+        "reranked": rerank,
+        "answers": str(lookup_path(index_path)),
+        "attributes": {
+            "path": str(attributes_path(index_path)),
+            "names": row_attributes.names,
+        },
+        "embedding": embedding,
+        "index_seconds": index_seconds,
+        "save_seconds": save_seconds,
+    }
+    summary.update(
+        _sidecar_summaries(
+            index_path,
+            bm25=bm25,
+            detector=detector,
+            collapsed=collapsed,
+            projection_summary=projection_summary,
+            tuning=tuning,
+        )
+    )
+    return summary
+
+
+@dataclass
+class AskedQuestion:
+    id: Any
+    text: str
+
+
+def read_questions(
+    lines: Iterable[str],
+) -> Iterator[Union[AskedQuestion, LineError]]:
+    """
+    Reads questions one per line, either as a JSON object with "text" and an optional "id" or as just the question's
+    text. Questions without an id are identified by their line number. Blank lines are skipped, and lines that can't be
+    read are yielded as a LineError in their place.
+    """
+    for number, line in enumerate(lines, start=1):
+        line = line.strip()
+        if not line:
+            continue
+
+        if not line.startswith("{"):
+            yield AskedQuestion(id=number, text=line)
+            continue
+
+        try:
+            record = json.loads(line)
+        except ValueError as error:
+            yield LineError(line=number, error=f"invalid JSON: {error}")
+            continue
+        if isinstance(record, dict) and isinstance(record.get("text"), str):
+            yield AskedQuestion(id=record.get("id", number), text=record["text"])
+        else:
+            yield LineError(
+                line=number, error='expected an object with a "text" string'
+            )
+
+
+# Each worker process loads its own models once and keeps them here
+_worker_answerer: Optional[BatchAnswerer] = None
+
+
+def _initialize_worker(loader: Callable[[], BatchAnswerer]) -> None:
+    global _worker_answerer
+    _worker_answerer = loader()
+
+
+def _answer_in_worker(questions: List[str], k: int) -> List[List[AnswerMatch]]:
+    assert _worker_answerer is not None
+    if not questions:
+        return []
+    return _worker_answerer.answer(questions, k=k)
+
+
+def _write_answers(
+    output: TextIO,
+    batch: List[Union[AskedQuestion, LineError]],
+    answers: List[List[AnswerMatch]],
+) -> int:
+    """
+    Writes the answers to a batch's questions, and an error in place of each of its lines that couldn't be read.
+
+    Returns:
+        How many questions were answered
+    """
+    found = iter(answers)
+    answered = 0
+    for question in batch:
+        if isinstance(question, LineError):
+            output.write(
+                json.dumps({"id": question.line, "error": question.error}) + "\n"
+            )
+            continue
+
+        answered += 1
+        output.write(
+            json.dumps(
+                {
+                    "id": question.id,
+                    "question": question.text,
+                    "answers": [
+                        {
+                            "question_id": str(match.question_id),
+                            "answer_id": (
+                                str(match.answer_id)
+                                if match.answer_id is not None
+                                else None
+                            ),
+                            "text": match.text,
+                            "similarity": match.similarity,
+                        }
+                        for match in next(found)
+                    ],
+                }
+            )
+            + "\n"
+        )
+    return answered
+
+
+def ask(
+    questions: Iterable[Union[AskedQuestion, LineError]],
+    loader: Callable[[], BatchAnswerer],
+    output: TextIO,
+    k: int = 1,
+    batch_size: int = 64,
+    jobs: int = 1,
+    progress: Optional[Progress] = None,
+) -> Dict[str, Any]:
+    """
+    Answers a stream of questions in micro-batches and writes one JSON line per question to output, in input order. Lines
+    that couldn't be read get a line with their error in their place rather than stopping the run.
+
+    With one job, questions go through a QuestionAnsweringPipeline so the stages overlap. With more, batches are answered
+    by that many worker processes that each load the models once. At most two batches per worker are in flight, so
+    memory stays bounded however long the input is.
+
+    Args:
+        questions (Iterable[Union[AskedQuestion, LineError]]): the questions to answer
+        loader (Callable[[], BatchAnswerer]): loads the models. It has to be picklable to use more than one job.
+        output (TextIO): where to write the answers
+        k (int): how many answers to find for each question
+        batch_size (int): how many questions to answer at once
+        jobs (int): how many worker processes to answer with. With one, questions are answered in this process.
+        progress (Optional[Progress]): counts the answered questions
+
+    Returns:
+        A summary with the throughput
+    """
+    if progress is None:
+        progress = Progress()
+
+    errors = 0
+    if jobs <= 1:
+        # The questions are read by the pipeline's input thread, and come out in the same order. Lines that couldn't be
+        # read wait in between them to be written in their place.
+        read: Deque[Union[AskedQuestion, LineError]] = deque()
+
+        def texts() -> Iterator[str]:
+            for question in questions:
+                read.append(question)
+                if isinstance(question, AskedQuestion):
+                    yield question.text
+
+        pipeline = loader().pipeline(k=k, batch_size=batch_size)
+        for answered in chunked(pipeline.run(texts()), batch_size):
+            batch: List[Union[AskedQuestion, LineError]] = []
+            for _ in answered:
+                while isinstance(read[0], LineError):
+                    batch.append(read.popleft())
+                batch.append(read.popleft())
+            count = _write_answers(
+                output, batch, [result.answers for result in answered]
+            )
+            errors += len(batch) - count
+            progress.update(count)
+        # Whatever is left after the last question couldn't be read
+        errors += len(read)
+        _write_answers(output, list(read), [])
+    else:
+        # Workers are spawned rather than forked since TensorFlow isn't fork safe
+        with ProcessPoolExecutor(
+            max_workers=jobs,
+            mp_context=get_context("spawn"),
+            initializer=_initialize_worker,
+            initargs=(loader,),
+        ) as executor:
+            pending: Deque[Tuple[List[Union[AskedQuestion, LineError]], Future]] = (
+                deque()
+            )
+            for batch in chunked(questions, batch_size):
+                asked = [q.text for q in batch if isinstance(q, AskedQuestion)]
+                pending.append((batch, executor.submit(_answer_in_worker, asked, k)))
+                while len(pending) >= jobs * 2:
+                    done, future = pending.popleft()
+                    count = _write_answers(output, done, future.result())
+                    errors += len(done) - count
+                    progress.update(count)
+            while pending:
+                done, future = pending.popleft()
+                count = _write_answers(output, done, future.result())
+                errors += len(done) - count
+                progress.update(count)
+    progress.log()
+
+    summary = progress.summary()
+    summary.update({"batch_size": batch_size, "jobs": jobs, "errors": errors})
+    return summary
@@ -0,0 +1,448 @@
+import hashlib
+import io
+import json
+import mmap
+import os
+import pickle
+import shutil
+import struct
+import tarfile
+import tempfile
+from dataclasses import asdict, dataclass, field
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, BinaryIO, Dict, List, Optional, Union
+
+import numpy as np
+
+from autoguru.questionanswering.answers import AnswerLookup, lookup_path
+from autoguru.questionanswering.embeddings.model import Embedder
+from autoguru.questionanswering.embeddings.projection import (
+    ProjectedEmbedder,
+    Projection,
+    projection_path,
+)
+from autoguru.questionanswering.nearestneighbors import (
+    Metric,
+    NearestNeighbors,
+    index_class,
+)
+from autoguru.questionanswering.nearestneighbors.reranking import (
+    RerankedNearestNeighbors,
+    vectors_path,
+)
+from autoguru.questionanswering.nearestneighbors.tuning import (
+    TuningResult,
+    tuning_path,
+)
+
+BUNDLE_SUFFIX: str = ".bundle"
+BUNDLE_FORMAT: int = 1
+# Every section starts on a page boundary, so its arrays can be memory mapped straight out of the bundle
+PAGE_SIZE: int = 4096
+
+_MAGIC: bytes = b"AGQABNDL"
+# The magic and the format version
+_HEADER = struct.Struct("<8sI")
+# The manifest's offset and length, then the magic again
+_TRAILER = struct.Struct("<QQ8s")
+
+_INDEX_SECTION: str = "index"
+_INDEX_BUFFER_SECTION: str = "index/buffers/{}"
+_ANSWERS_SECTION: str = "answers/{}"
+_VECTORS_SECTION: str = "vectors"
+_PROJECTION_SECTION: str = "projection"
+_CLASSIFIER_SECTION: str = "classifier"
+
+
+def is_bundle(path: Union[str, Path]) -> bool:
+    try:
+        with open(path, "rb") as in_file:
+            return in_file.read(len(_MAGIC)) == _MAGIC
+    except OSError:
+        return False
+
+
+@dataclass
+class Section:
+    """
+    Args:
+        offset (int): where the section starts in the bundle, always a multiple of PAGE_SIZE
+        length (int): how many bytes long the section is
+        sha256 (str): the hex SHA-256 digest of the section's bytes
+        dtype (Optional[str]): the numpy dtype of an array section
+        shape (Optional[List[int]]): the shape of an array section
+    """
+
+    offset: int
+    length: int
+    sha256: str
+    dtype: Optional[str] = None
+    shape: Optional[List[int]] = None
+
+
+@dataclass
+class BundleManifest:
+    """
+    Args:
+        version (str): the version of the artifacts. Defaults to a digest of the sections, so identical bundles share a version.
+        created (str): when the bundle was written, as an ISO 8601 timestamp
+        embedder_url (str): the TensorFlow Hub embedder the index was built with
+        index_type (str): the index backend
+        metric (str): the name of the Metric the index reports similarities in
+        rows (int): how many questions the index holds
+        rerank_factor (int): how many candidates to rerank exactly per answer. 0 doesn't rerank.
+        index_options (Dict[str, Any]): the options the index was tuned to, if it was
+        sections (Dict[str, Section]): where each part of the bundle is
+        format (int): the version of the bundle format
+    """
+
+    version: str
+    created: str
+    embedder_url: str
+    index_type: str
+    metric: str
+    rows: int
+    rerank_factor: int = 0
+    index_options: Dict[str, Any] = field(default_factory=dict)
+    sections: Dict[str, Section] = field(default_factory=dict)
+    format: int = BUNDLE_FORMAT
+
+    def to_json(self) -> Dict[str, Any]:
+        return asdict(self)
+
+    @classmethod
+    def from_json(cls, manifest: Dict[str, Any]) -> "BundleManifest":
+        return cls(
+            **{
+                **manifest,
+                "sections": {
+                    name: Section(**section)
+                    for name, section in manifest["sections"].items()
+                },
+            }
+        )
+
+
+class _BundleWriter:
+    def __init__(self, out_file: BinaryIO) -> None:
+        self._out_file: BinaryIO = out_file
+        self._out_file.write(_HEADER.pack(_MAGIC, BUNDLE_FORMAT))
+        self.sections: Dict[str, Section] = {}
+
+    def _pad(self) -> int:
+        offset = self._out_file.tell()
+        padding = -offset % PAGE_SIZE
+        self._out_file.write(b"\0" * padding)
+        return offset + padding
+
+    def write(
+        self,
+        name: str,
+        data: Union[bytes, memoryview],
+        dtype: Optional[str] = None,
+        shape: Optional[List[int]] = None,
+    ) -> None:
+        offset = self._pad()
+        self._out_file.write(data)
+        self.sections[name] = Section(
+            offset=offset,
+            length=len(data),
+            sha256=hashlib.sha256(data).hexdigest(),
+            dtype=dtype,
+            shape=shape,
+        )
+
+    def write_array(self, name: str, array: np.ndarray) -> None:
+        array = np.ascontiguousarray(array)
+        self.write(
+            name,
+            memoryview(array.reshape(-1).view(np.uint8)),
+            dtype=array.dtype.str,
+            shape=list(array.shape),
+        )
+
+    def finish(self, manifest: BundleManifest) -> None:
+        encoded = json.dumps(manifest.to_json()).encode("UTF-8")
+        offset = self._out_file.tell()
+        self._out_file.write(encoded)
+        self._out_file.write(_TRAILER.pack(offset, len(encoded), _MAGIC))
+
+
+def _classifier_archive(classifier_path: Path) -> bytes:
+    archive = io.BytesIO()
+    with tarfile.open(fileobj=archive, mode="w") as tar:
+        tar.add(str(classifier_path), arcname=_CLASSIFIER_SECTION)
+    return archive.getvalue()
+
+
+class Bundle:
+    """
+    Everything one version of question answering needs in a single file: the embedder it was built with and how its
+    embeddings are projected, the classifier's SavedModel, the nearest neighbor index, the index row -> answer lookup
+    and the metric and reranking settings, with a SHA-256 digest of each part in the manifest.
+
+    The file starts with a magic number and the format version, followed by each section starting on a page boundary,
+    then the manifest as JSON and a trailer giving its offset and length. Loading maps the file copy-on-write and
+    points the lookup's and index's arrays straight into it, so a process only reads the pages its searches touch and
+    processes loading the same bundle share them. The index is pickled with its arrays out of band for this.
+
+    Args:
+        manifest (BundleManifest): what the bundle holds
+        bundle_file (Path): the bundle
+        buffer (mmap.mmap): the bundle's contents
+    """
+
+    def __init__(
+        self, manifest: BundleManifest, bundle_file: Path, buffer: mmap.mmap
+    ) -> None:
+        self._manifest: BundleManifest = manifest
+        self._path: Path = bundle_file
+        self._buffer: mmap.mmap = buffer
+
+    @property
+    def manifest(self) -> BundleManifest:
+        return self._manifest
+
+    @property
+    def path(self) -> Path:
+        return self._path
+
+    @property
+    def has_classifier(self) -> bool:
+        return _CLASSIFIER_SECTION in self._manifest.sections
+
+    def _bytes(self, name: str) -> memoryview:
+        section = self._manifest.sections[name]
+        return memoryview(self._buffer)[
+            section.offset : section.offset + section.length
+        ]
+
+    def _array(self, name: str) -> np.ndarray:
+        section = self._manifest.sections[name]
+        return np.ndarray(
+            shape=tuple(section.shape or ()),
+            dtype=np.dtype(section.dtype),
+            buffer=self._buffer,
+            offset=section.offset,
+        )
+
+    def verify(self) -> None:
+        """
+        Checks every section against its digest. This reads the whole bundle, so it isn't done on every load.
+
+        Raises:
+            ValueError: if a section doesn't match its digest
+        """
+        for name, section in self._manifest.sections.items():
+            if hashlib.sha256(self._bytes(name)).hexdigest() != section.sha256:
+                raise ValueError(f"The {name} section of {self._path} is corrupt")
+
+    def projection(self) -> Optional[Projection]:
+        if _PROJECTION_SECTION not in self._manifest.sections:
+            return None
+        return Projection.load(io.BytesIO(self._bytes(_PROJECTION_SECTION)))
+
+    def project(self, embedder: Embedder) -> Embedder:
+        """
+        Projects the bundle's embedder the same way the index's embeddings were, if they were projected.
+        """
+        projection = self.projection()
+        if projection is None:
+            return embedder
+        return ProjectedEmbedder(embedder=embedder, projection=projection)
+
+    def index(self) -> NearestNeighbors:
+        buffers = []
+        while _INDEX_BUFFER_SECTION.format(len(buffers)) in self._manifest.sections:
+            buffers.append(self._bytes(_INDEX_BUFFER_SECTION.format(len(buffers))))
+        index: NearestNeighbors = pickle.loads(
+            self._bytes(_INDEX_SECTION), buffers=buffers
+        )
+
+        if self._manifest.rerank_factor > 0:
+            return RerankedNearestNeighbors(
+                index=index,
+                vectors=self._array(_VECTORS_SECTION),
+                factor=self._manifest.rerank_factor,
+                metric=Metric[self._manifest.metric],
+            )
+        return index
+
+    def answers(self) -> AnswerLookup:
+        prefix = _ANSWERS_SECTION.format("")
+        return AnswerLookup(
+            **{
+                name[len(prefix) :]: self._array(name)
+                for name in self._manifest.sections
+                if name.startswith(prefix)
+            }
+        )
+
+    def classifier_path(self, directory: Optional[Union[str, Path]] = None) -> Path:
+        """
+        Extracts the classifier's SavedModel, which TensorFlow can only load from a directory. Each version is only
+        extracted once, so later loads reuse it.
+
+        Args:
+            directory (Optional[Union[str, Path]]): where to extract classifiers to. Defaults to the temporary directory.
+
+        Returns:
+            The SavedModel directory
+        """
+        if not self.has_classifier:
+            raise ValueError(f"{self._path} doesn't have a classifier")
+
+        if directory is None:
+            directory = Path(tempfile.gettempdir(), "autoguru-bundles")
+        elif isinstance(directory, str):
+            directory = Path(directory)
+
+        section = self._manifest.sections[_CLASSIFIER_SECTION]
+        extracted = directory.joinpath(section.sha256[:16])
+        if not extracted.exists():
+            directory.mkdir(parents=True, exist_ok=True)
+            # Extracted next to where it's going and renamed into place, so other processes never see half of it
+            staging = Path(tempfile.mkdtemp(dir=directory))
+            with tarfile.open(
+                fileobj=io.BytesIO(self._bytes(_CLASSIFIER_SECTION)), mode="r"
+            ) as tar:
+                if hasattr(tarfile, "data_filter"):
+                    tar.extractall(staging, filter="data")
+                else:
+                    tar.extractall(staging)
+            try:
+                os.rename(staging, extracted)
+            except OSError:
+                # Another process extracted it first
+                shutil.rmtree(staging, ignore_errors=True)
+        return extracted.joinpath(_CLASSIFIER_SECTION)
+
+    @classmethod
+    def load(cls, bundle_file: Union[str, Path], verify: bool = False) -> "Bundle":
+        if isinstance(bundle_file, str):
+            bundle_file = Path(bundle_file)
+
+        with bundle_file.open("rb") as in_file:
+            # Copy-on-write, since some index backends want writable arrays even though they never write to them
+            buffer = mmap.mmap(in_file.fileno(), 0, access=mmap.ACCESS_COPY)
+
+        magic, bundle_format = _HEADER.unpack_from(buffer, 0)
+        if magic != _MAGIC:
+            raise ValueError(f"{bundle_file} isn't a question answering bundle")
+        if bundle_format > BUNDLE_FORMAT:
+            raise ValueError(
+                f"{bundle_file} is format {bundle_format}, but only formats up to {BUNDLE_FORMAT} can be loaded"
+            )
+        offset, length, magic = _TRAILER.unpack_from(
+            buffer, len(buffer) - _TRAILER.size
+        )
+        if magic != _MAGIC:
+            raise ValueError(f"{bundle_file} is truncated")
+
+        manifest = BundleManifest.from_json(
+            json.loads(buffer[offset : offset + length].decode("UTF-8"))
+        )
+        bundle = cls(manifest=manifest, bundle_file=bundle_file, buffer=buffer)
+        if verify:
+            bundle.verify()
+        return bundle
+
+    @classmethod
+    def create(
+        cls,
+        bundle_file: Union[str, Path],
+        index_path: Union[str, Path],
+        index_type: str = "descent",
+        embedder_url: str = "https://tfhub.dev/google/universal-sentence-encoder/4",
+        classifier_path: Optional[Union[str, Path]] = None,
+        answers_path: Optional[Union[str, Path]] = None,
+        version: Optional[str] = None,
+        rerank_factor: int = 0,
+        metric: Metric = Metric.COSINE,
+    ) -> "Bundle":
+        """
+        Bundles an index built by build-index with everything saved next to it, and the classifier if given. The
+        bundle is written beside its destination and renamed into place, so a server never loads half of one.
+
+        Args:
+            bundle_file (Union[str, Path]): where to write the bundle
+            index_path (Union[str, Path]): the index
+            index_type (str): the type of the index
+            embedder_url (str): the TensorFlow Hub embedder the index was built with
+            classifier_path (Optional[Union[str, Path]]): the question classifier's SavedModel
+            answers_path (Optional[Union[str, Path]]): the answer lookup. Defaults to the one next to the index.
+            version (Optional[str]): the version of the bundle. Defaults to a digest of its contents.
+            rerank_factor (int): how many candidates to rerank per answer. Needs an index built with --rerank.
+            metric (Metric): the metric the index reports similarities in
+        """
+        if isinstance(bundle_file, str):
+            bundle_file = Path(bundle_file)
+        if isinstance(index_path, str):
+            index_path = Path(index_path)
+
+        index = index_class(index_type).load(index_path)
+        answers = AnswerLookup.load(
+            answers_path if answers_path is not None else lookup_path(index_path)
+        )
+        tuning = tuning_path(index_path)
+        vectors: Optional[np.ndarray] = None
+        if rerank_factor > 0:
+            vectors = np.load(vectors_path(index_path), mmap_mode="r")
+            if vectors.shape[0] != index.size:
+                raise ValueError(
+                    f"There are {vectors.shape[0]} vectors to rerank with but the index has {index.size} rows"
+                )
+
+        staging = bundle_file.with_name(bundle_file.name + ".tmp")
+        with staging.open("wb") as out_file:
+            writer = _BundleWriter(out_file)
+
+            # numpy hands contiguous arrays to the callback instead of copying them into the pickle
+            buffers: List[pickle.PickleBuffer] = []
+            writer.write(
+                _INDEX_SECTION,
+                pickle.dumps(index, protocol=5, buffer_callback=buffers.append),
+            )
+            for number, buffer in enumerate(buffers):
+                writer.write(_INDEX_BUFFER_SECTION.format(number), buffer.raw())
+
+            for name, array in answers.arrays.items():
+                writer.write_array(_ANSWERS_SECTION.format(name), array)
+            if vectors is not None:
+                writer.write_array(_VECTORS_SECTION, vectors)
+            if projection_path(index_path).exists():
+                writer.write(
+                    _PROJECTION_SECTION, projection_path(index_path).read_bytes()
+                )
+            if classifier_path is not None:
+                writer.write(
+                    _CLASSIFIER_SECTION, _classifier_archive(Path(classifier_path))
+                )
+
+            contents = hashlib.sha256(
+                "".join(section.sha256 for section in writer.sections.values()).encode(
+                    "UTF-8"
+                )
+            )
+            writer.finish(
+                BundleManifest(
+                    version=(
+                        version if version is not None else contents.hexdigest()[:12]
+                    ),
+                    created=datetime.now(timezone.utc).isoformat(),
+                    embedder_url=embedder_url,
+                    index_type=index_type,
+                    metric=metric.name,
+                    rows=len(answers),
+                    rerank_factor=rerank_factor,
+                    index_options=(
+                        TuningResult.load(tuning).best.options
+                        if tuning.exists()
+                        else {}
+                    ),
+                    sections=writer.sections,
+                )
+            )
+        os.replace(staging, bundle_file)
+        return cls.load(bundle_file)
@@ -0,0 +1,219 @@
+import pickle
+import zlib
+from collections import defaultdict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Hashable, List, Optional, Set, Tuple, Union
+
+import numpy as np
+
+from autoguru.questionanswering.answers import normalize_question
+
+DUPLICATES_SUFFIX: str = ".duplicates"
+
+# Shingle hashes are reduced mod this Mersenne prime, so the permutations can be computed in 64 bit integers
+_PRIME: int = (1 << 31) - 1
+
+
+def duplicates_path(index_file: Union[str, Path]) -> Path:
+    if isinstance(index_file, str):
+        index_file = Path(index_file)
+
+    return index_file.with_name(index_file.name + DUPLICATES_SUFFIX)
+
+
+def shingles(text: str, size: int = 4) -> Set[str]:
+    """
+    Splits normalized text into its overlapping character n-grams. Characters rather than words are used since
+    questions are short, and a typo or plural then only changes a few shingles instead of whole words.
+    """
+    text = normalize_question(text)
+    if len(text) <= size:
+        return {text}
+    return {text[start : start + size] for start in range(len(text) - size + 1)}
+
+
+def _bands(threshold: float, permutations: int) -> Tuple[int, int]:
+    """
+    Picks how many bands of how many rows to split signatures into, so that texts about as similar as the threshold
+    have even odds of sharing a bucket. The chance is 1 - (1 - s^rows)^bands for similarity s, with its steepest rise
+    at about (1 / bands)^(1 / rows).
+    """
+    return min(
+        (
+            (bands, permutations // bands)
+            for bands in range(1, permutations + 1)
+            if permutations // bands > 0
+        ),
+        key=lambda split: abs((1.0 / split[0]) ** (1.0 / split[1]) - threshold),
+    )
+
+
+@dataclass
+class NearDuplicate:
+    key: Hashable
+    similarity: float
+
+
+class NearDuplicateDetector:
+    """
+    Finds texts that are nearly the same as ones already added in sub-linear time, by locality sensitive hashing MinHash
+    signatures of their shingles. Texts whose estimated Jaccard similarity reaches the threshold are near duplicates.
+
+    Texts can be added in groups, like the answer a question belongs to, to only match texts in the same group.
+
+    Args:
+        threshold (float): the estimated Jaccard similarity of the shingles of two near duplicates
+        permutations (int): how many hash functions make up each signature. More make the estimates more accurate.
+        shingle_size (int): how many characters are in each shingle
+        seed (int): seeds the hash functions
+    """
+
+    DEFAULT_THRESHOLD: float = 0.8
+    DEFAULT_PERMUTATIONS: int = 128
+    DEFAULT_SHINGLE_SIZE: int = 4
+
+    def __init__(
+        self,
+        threshold: float = DEFAULT_THRESHOLD,
+        permutations: int = DEFAULT_PERMUTATIONS,
+        shingle_size: int = DEFAULT_SHINGLE_SIZE,
+        seed: int = 1,
+    ) -> None:
+        self._threshold: float = threshold
+        self._shingle_size: int = shingle_size
+        random = np.random.default_rng(seed)
+        self._a: np.ndarray = random.integers(
+            1, _PRIME, size=permutations, dtype=np.uint64
+        )
+        self._b: np.ndarray = random.integers(
+            0, _PRIME, size=permutations, dtype=np.uint64
+        )
+        self._band_count, self._rows = _bands(threshold, permutations)
+        self._buckets: List[Dict[bytes, List[Hashable]]] = [
+            defaultdict(list) for _ in range(self._band_count)
+        ]
+        self._signatures: Dict[Hashable, np.ndarray] = {}
+        self._groups: Dict[Hashable, Optional[Hashable]] = {}
+
+    @property
+    def threshold(self) -> float:
+        return self._threshold
+
+    def __len__(self) -> int:
+        return len(self._signatures)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._signatures
+
+    def signature(self, text: str) -> np.ndarray:
+        hashes = np.fromiter(
+            (
+                zlib.crc32(shingle.encode("UTF-8")) % _PRIME
+                for shingle in shingles(text, self._shingle_size)
+            ),
+            dtype=np.uint64,
+        )
+        # Each row is one hash function applied to every shingle, and the signature is the smallest hash of each row
+        minimums = ((np.outer(self._a, hashes) + self._b[:, np.newaxis]) % _PRIME).min(
+            axis=1
+        )
+        # Every hash is below the 31 bit prime, so signatures can be kept in half the memory
+        return minimums.astype(np.uint32)
+
+    def _band_keys(self, signature: np.ndarray) -> List[bytes]:
+        return [
+            signature[band * self._rows : (band + 1) * self._rows].tobytes()
+            for band in range(self._band_count)
+        ]
+
+    def add(
+        self, key: Hashable, text: str, group: Optional[Hashable] = None
+    ) -> np.ndarray:
+        """
+        Adds a text to match later texts against.
+
+        Returns:
+            The text's signature
+        """
+        signature = self.signature(text)
+        self._insert(key, signature, group)
+        return signature
+
+    def find(
+        self,
+        text: str,
+        group: Optional[Hashable] = None,
+        signature: Optional[np.ndarray] = None,
+    ) -> List[NearDuplicate]:
+        """
+        Finds the added texts that are near duplicates of a text, most similar first.
+
+        Args:
+            text (str): the text to match
+            group (Optional[Hashable]): if not None, only texts added to this group match
+            signature (Optional[np.ndarray]): the text's signature, if it's already known
+        """
+        if signature is None:
+            signature = self.signature(text)
+
+        candidates: Set[Hashable] = set()
+        for bucket, band_key in zip(self._buckets, self._band_keys(signature)):
+            candidates.update(bucket.get(band_key, ()))
+
+        matches = []
+        for key in candidates:
+            if group is not None and self._groups[key] != group:
+                continue
+            # The fraction of matching minimums is an unbiased estimate of the Jaccard similarity
+            similarity = float(np.mean(self._signatures[key] == signature))
+            if similarity >= self._threshold:
+                matches.append(NearDuplicate(key=key, similarity=similarity))
+        matches.sort(key=lambda match: match.similarity, reverse=True)
+        return matches
+
+    def add_unless_duplicate(
+        self, key: Hashable, text: str, group: Optional[Hashable] = None
+    ) -> Optional[NearDuplicate]:
+        """
+        Adds a text unless it's a near duplicate of one already added.
+
+        Returns:
+            The most similar near duplicate, or None if the text was added or already had been
+        """
+        if key in self._signatures:
+            return None
+
+        signature = self.signature(text)
+        matches = self.find(text, group=group, signature=signature)
+        if matches:
+            return matches[0]
+
+        self._insert(key, signature, group)
+        return None
+
+    def _insert(
+        self, key: Hashable, signature: np.ndarray, group: Optional[Hashable]
+    ) -> None:
+        if key in self._signatures:
+            raise KeyError(f"{key} has already been added")
+
+        self._signatures[key] = signature
+        self._groups[key] = group
+        for bucket, band_key in zip(self._buckets, self._band_keys(signature)):
+            bucket[band_key].append(key)
+
+    def save(self, detector_file: Union[str, Path]) -> None:
+        if isinstance(detector_file, str):
+            detector_file = Path(detector_file)
+
+        with detector_file.open("wb") as out_file:
+            pickle.dump(self, out_file)
+
+    @classmethod
+    def load(cls, detector_file: Union[str, Path]) -> "NearDuplicateDetector":
+        if isinstance(detector_file, str):
+            detector_file = Path(detector_file)
+
+        with detector_file.open("rb") as in_file:
+            return pickle.load(in_file)
@@ -0,0 +1,39 @@
+from typing import Iterable, List, Union
+
+import numpy as np
+
+from autoguru.questionanswering.embeddings.model import Embedder
+from autoguru.questionanswering.nearestneighbors import Metric
+from autoguru.questionanswering.utilities.instrumentation import (
+    STAGE_BATCH_SIZE,
+    STAGE_LATENCY,
+)
+
+
+class InstrumentedEmbedder(Embedder):
+    DEFAULT_STAGE: str = "embed"
+
+    def __init__(self, embedder: Embedder, stage: str = DEFAULT_STAGE) -> None:
+        self._embedder: Embedder = embedder
+        self._latency = STAGE_LATENCY.labels(stage)
+        self._batch_size = STAGE_BATCH_SIZE.labels(stage)
+
+    def embed(self, text: Union[str, Iterable[str]]) -> np.ndarray:
+        with self._latency.time():
+            embeddings = self._embedder.embed(text)
+        self._batch_size.observe(1 if embeddings.ndim == 1 else embeddings.shape[0])
+        return embeddings
+
+    @property
+    def embedding_size(self) -> int:
+        return self._embedder.embedding_size
+
+    @property
+    def suggested_metrics(self) -> List[Metric]:
+        return self._embedder.suggested_metrics
+
+    @classmethod
+    def create(
+        cls, embedder: Embedder, stage: str = DEFAULT_STAGE
+    ) -> "InstrumentedEmbedder":
+        return cls(embedder=embedder, stage=stage)
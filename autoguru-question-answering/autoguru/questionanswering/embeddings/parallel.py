@@ -0,0 +1,182 @@
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from multiprocessing.shared_memory import SharedMemory
+from types import TracebackType
+from typing import Iterable, List, Optional, Tuple, Type, Union
+
+import numpy as np
+
+from autoguru.questionanswering.embeddings.model import Embedder
+from autoguru.questionanswering.nearestneighbors import Metric
+
+_worker_embedder: Optional[Embedder] = None
+
+
+def _initialize_worker(url: str, signature: str, threads: int) -> None:
+    global _worker_embedder
+    from autoguru.questionanswering.embeddings.tfhub import TfHubEmbedder
+    from autoguru.questionanswering.utilities.tensorflow import pin_threads
+
+    # The thread counts have to be set before the model is loaded
+    pin_threads(threads)
+    _worker_embedder = TfHubEmbedder.create(url, signature=signature)
+
+
+def _embedding_size_in_worker() -> int:
+    assert _worker_embedder is not None
+    return _worker_embedder.embedding_size
+
+
+def _embed_in_worker(
+    texts: List[str], memory_name: str, shape: Tuple[int, int], start: int
+) -> int:
+    assert _worker_embedder is not None
+    vectors = _worker_embedder.embed(texts)
+    memory = SharedMemory(name=memory_name)
+    try:
+        output = np.ndarray(shape, dtype=np.float32, buffer=memory.buf)
+        output[start : start + len(texts)] = vectors
+        # The view has to go before the memory can be closed
+        del output
+    finally:
+        memory.close()
+    return len(texts)
+
+
+class ParallelEmbedder(Embedder):
+    """
+    Embeds with a TfHubEmbedder in each of several worker processes, each pinned to its own few TensorFlow threads. A
+    single TensorFlow process stops getting faster past a few cores on the small batches the Universal Sentence Encoder
+    is given, so on bigger machines embedding a whole corpus is quicker split between processes.
+
+    Each batch is split into contiguous chunks, one per worker, and the workers write their vectors straight into a
+    shared memory array rather than sending them back pickled. Workers are spawned rather than forked since TensorFlow
+    isn't fork safe, and each loads its own copy of the model the first time it's given a chunk.
+
+    Call close() or use it as a context manager to stop the workers.
+
+    Args:
+        executor (ProcessPoolExecutor): the workers, initialized with a model by _initialize_worker
+        workers (int): how many workers the executor has
+        embedding_size (int): the size of the model's embeddings
+        suggested_metrics (List[Metric]): the metrics suited to the model's embeddings
+        min_chunk_size (int): the fewest texts to give a worker at once. Smaller batches are split between fewer
+            workers, since the round trip costs more than embedding them.
+    """
+
+    DEFAULT_SIGNATURE: str = "serving_default"
+    DEFAULT_MIN_CHUNK_SIZE: int = 16
+
+    def __init__(
+        self,
+        executor: ProcessPoolExecutor,
+        workers: int,
+        embedding_size: int,
+        suggested_metrics: List[Metric] = None,
+        min_chunk_size: int = DEFAULT_MIN_CHUNK_SIZE,
+    ) -> None:
+        self._executor: ProcessPoolExecutor = executor
+        self._workers: int = workers
+        self._embedding_size: int = embedding_size
+        self._suggested_metrics: List[Metric] = (
+            suggested_metrics if suggested_metrics is not None else []
+        )
+        self._min_chunk_size: int = min_chunk_size
+
+    @property
+    def workers(self) -> int:
+        return self._workers
+
+    def embed(self, text: Union[str, Iterable[str]]) -> np.ndarray:
+        if isinstance(text, str):
+            return self.embed([text])[0]
+
+        texts = list(text)
+        shape = (len(texts), self._embedding_size)
+        if not texts:
+            return np.empty(shape, dtype=np.float32)
+
+        chunks = min(self._workers, math.ceil(len(texts) / self._min_chunk_size))
+        bounds = np.linspace(0, len(texts), chunks + 1).astype(int)
+        memory = SharedMemory(create=True, size=int(np.prod(shape)) * 4)
+        try:
+            futures = [
+                self._executor.submit(
+                    _embed_in_worker, texts[start:stop], memory.name, shape, start
+                )
+                for start, stop in zip(bounds[:-1], bounds[1:])
+            ]
+            for future in futures:
+                future.result()
+            embeddings = np.ndarray(shape, dtype=np.float32, buffer=memory.buf).copy()
+        finally:
+            memory.close()
+            memory.unlink()
+        return embeddings
+
+    @property
+    def embedding_size(self) -> int:
+        return self._embedding_size
+
+    @property
+    def suggested_metrics(self) -> List[Metric]:
+        return self._suggested_metrics
+
+    def close(self) -> None:
+        self._executor.shutdown()
+
+    def __enter__(self) -> "ParallelEmbedder":
+        return self
+
+    def __exit__(
+        self,
+        exception_type: Optional[Type[BaseException]],
+        exception: Optional[BaseException],
+        traceback: Optional[TracebackType],
+    ) -> None:
+        self.close()
+
+    @classmethod
+    def create(
+        cls,
+        url: str,
+        workers: int,
+        threads: Optional[int] = None,
+        signature: str = DEFAULT_SIGNATURE,
+        suggested_metrics: List[Metric] = None,
+        min_chunk_size: int = DEFAULT_MIN_CHUNK_SIZE,
+    ) -> "ParallelEmbedder":
+        """
+        Starts the workers and waits for one to load the model.
+
+        Args:
+            url (str): the TensorFlow Hub model to embed with
+            workers (int): how many worker processes to embed with
+            threads (Optional[int]): how many threads each worker runs TensorFlow ops with. Defaults to an even share of the CPUs.
+            signature (str): the model's signature
+            suggested_metrics (List[Metric]): the metrics suited to the model's embeddings
+            min_chunk_size (int): the fewest texts to give a worker at once
+        """
+        if threads is None:
+            threads = max(1, (os.cpu_count() or 1) // workers)
+
+        executor = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=get_context("spawn"),
+            initializer=_initialize_worker,
+            initargs=(url, signature, threads),
+        )
+        try:
+            embedding_size = executor.submit(_embedding_size_in_worker).result()
+        except BaseException:
+            executor.shutdown()
+            raise
+        return cls(
+            executor=executor,
+            workers=workers,
+            embedding_size=embedding_size,
+            suggested_metrics=suggested_metrics,
+            min_chunk_size=min_chunk_size,
+        )
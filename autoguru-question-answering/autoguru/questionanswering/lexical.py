@@ -0,0 +1,511 @@
+import heapq
+import unicodedata
+from collections import Counter, defaultdict
+from dataclasses import dataclass
+from enum import Enum
+from operator import itemgetter
+from pathlib import Path
+from typing import Any, BinaryIO, Dict, Iterable, List, Optional, Sequence, Union
+
+import numpy as np
+
+from autoguru.questionanswering.embeddings import Embedder
+from autoguru.questionanswering.nearestneighbors import (
+    NearestNeighbors,
+    Neighbor,
+    RowFilter,
+)
+from autoguru.questionanswering.utilities.instrumentation import (
+    LEXICAL_SHORT_CIRCUITS,
+    STAGE_BATCH_SIZE,
+    STAGE_LATENCY,
+)
+
+LEXICAL_SUFFIX: str = ".bm25.npz"
+
+# Cormack et al.'s constant, which damps how much the very top ranks dominate reciprocal rank fusion
+RRF_CONSTANT: int = 60
+
+
+def lexical_path(index_file: Union[str, Path]) -> Path:
+    if isinstance(index_file, str):
+        index_file = Path(index_file)
+
+    return index_file.with_name(index_file.name + LEXICAL_SUFFIX)
+
+
+def lexical_terms(text: str) -> List[str]:
+    """
+    Splits text into the terms the lexical index matches on. Terms are words, so product names, model numbers and error
+    codes like "Nokia-3310" and "0x80070005" stay whole, and they're case folded so the capitalization doesn't matter.
+    """
+    # Importing the tokenizer fetches its models, so it waits until text is actually tokenized
+    from autoguru.questionanswering.utilities.tokenization import tokenize_words
+
+    # Questions are short, so they aren't split into sentences first
+    return [
+        word.casefold()
+        for word in tokenize_words(
+            unicodedata.normalize("NFKC", text), preserve_line=True
+        )
+    ]
+
+
+@dataclass
+class LexicalMatches:
+    """
+    The rows that share terms with a text, by BM25 score.
+
+    Args:
+        neighbors (List[Neighbor]): the best matching rows first, with their BM25 scores as similarities
+        confidence (float): how exactly the best row matches the text, from 0 to 1. It's the idf weighted Jaccard
+            similarity of their terms, so 1 means they have the same terms and missing rare terms cost the most.
+    """
+
+    neighbors: List[Neighbor]
+    confidence: float
+
+
+class BM25Index:
+    """
+    An inverted index of the terms of each row's text that ranks rows by their Okapi BM25 scores. The BM25 weight of
+    every term in every row is computed when the index is built, so scoring a batch of texts is one sparse matrix
+    product.
+
+    Args:
+        vocabulary (Dict[str, int]): maps each term to its row in postings
+        postings (Any): the terms x rows BM25 weights, as a SciPy CSR matrix
+        idf (np.ndarray): the inverse document frequency of each term
+        row_idf (np.ndarray): the summed idf of each row's distinct terms
+        k1 (float): how quickly repeating a term stops raising a row's score
+        b (float): how much longer rows are penalized, from 0 for not at all to 1 for in proportion to their length
+    """
+
+    DEFAULT_K1: float = 1.2
+    DEFAULT_B: float = 0.75
+
+    def __init__(
+        self,
+        vocabulary: Dict[str, int],
+        postings: Any,
+        idf: np.ndarray,
+        row_idf: np.ndarray,
+        k1: float = DEFAULT_K1,
+        b: float = DEFAULT_B,
+    ) -> None:
+        self._vocabulary: Dict[str, int] = vocabulary
+        self._postings: Any = postings
+        self._idf: np.ndarray = idf
+        self._row_idf: np.ndarray = row_idf
+        self._k1: float = k1
+        self._b: float = b
+        # Terms no row has get the idf of a term in none of them
+        rows = postings.shape[1]
+        self._unknown_idf: float = float(np.log1p((rows + 0.5) / 0.5))
+
+    def __len__(self) -> int:
+        return self._postings.shape[1]
+
+    @property
+    def vocabulary_size(self) -> int:
+        return len(self._vocabulary)
+
+    def search(
+        self, texts: Sequence[str], k: int = 1, allowed: Optional[RowFilter] = None
+    ) -> List[LexicalMatches]:
+        """
+        Finds the k rows with the highest BM25 scores for each text. Rows that share no terms with a text aren't
+        matched, so there can be fewer than k. If allowed is given, only its rows are matched.
+        """
+        from scipy import sparse
+
+        query_terms: List[List[int]] = []
+        unknown_idf: List[float] = []
+        columns: List[int] = []
+        indptr = [0]
+        for text in texts:
+            terms = set(lexical_terms(text))
+            known = sorted(
+                {self._vocabulary[term] for term in terms if term in self._vocabulary}
+            )
+            query_terms.append(known)
+            unknown_idf.append(self._unknown_idf * (len(terms) - len(known)))
+            columns.extend(known)
+            indptr.append(len(columns))
+
+        queries = sparse.csr_matrix(
+            (np.ones(len(columns), dtype=np.float32), columns, indptr),
+            shape=(len(texts), len(self._vocabulary)),
+        )
+        scores = (queries @ self._postings).tocsr()
+
+        results = []
+        for query, (terms, unknown) in enumerate(zip(query_terms, unknown_idf)):
+            start, end = scores.indptr[query], scores.indptr[query + 1]
+            rows, row_scores = scores.indices[start:end], scores.data[start:end]
+            if allowed is not None:
+                keep = allowed.allowed[rows]
+                rows, row_scores = rows[keep], row_scores[keep]
+            if len(rows) > k:
+                top = np.argpartition(-row_scores, k - 1)[:k]
+                rows, row_scores = rows[top], row_scores[top]
+            order = np.argsort(-row_scores, kind="stable")
+            neighbors = [
+                Neighbor(index=int(rows[i]), similarity=float(row_scores[i]))
+                for i in order
+            ]
+            results.append(
+                LexicalMatches(
+                    neighbors=neighbors,
+                    confidence=(
+                        self._confidence(terms, unknown, neighbors[0].index)
+                        if neighbors
+                        else 0.0
+                    ),
+                )
+            )
+        return results
+
+    def _confidence(self, terms: List[int], unknown_idf: float, row: int) -> float:
+        shared = 0.0
+        for term in terms:
+            start, end = self._postings.indptr[term], self._postings.indptr[term + 1]
+            # Each term's rows are sorted, so whether the row has the term is a binary search
+            position = np.searchsorted(self._postings.indices[start:end], row)
+            if (
+                position < end - start
+                and self._postings.indices[start + position] == row
+            ):
+                shared += self._idf[term]
+        query_idf = float(self._idf[terms].sum()) + unknown_idf
+        union = query_idf + self._row_idf[row] - shared
+        return float(shared / union) if union > 0 else 0.0
+
+    def save(self, lexical_file: Union[str, Path]) -> None:
+        if isinstance(lexical_file, str):
+            lexical_file = Path(lexical_file)
+
+        # Terms can't contain whitespace, so the vocabulary is stored as one newline separated string in column order
+        terms = sorted(self._vocabulary, key=self._vocabulary.__getitem__)
+        with lexical_file.open("wb") as out_file:
+            np.savez(
+                out_file,
+                terms=np.frombuffer("\n".join(terms).encode("UTF-8"), dtype=np.uint8),
+                data=self._postings.data,
+                indices=self._postings.indices,
+                indptr=self._postings.indptr,
+                shape=np.array(self._postings.shape),
+                idf=self._idf,
+                row_idf=self._row_idf,
+                parameters=np.array([self._k1, self._b]),
+            )
+
+    @classmethod
+    def load(cls, lexical_file: Union[str, Path, BinaryIO]) -> "BM25Index":
+        from scipy import sparse
+
+        with np.load(lexical_file) as arrays:
+            terms = arrays["terms"].tobytes().decode("UTF-8")
+            k1, b = arrays["parameters"].tolist()
+            return cls(
+                vocabulary={
+                    term: column
+                    for column, term in enumerate(terms.split("\n") if terms else [])
+                },
+                postings=sparse.csr_matrix(
+                    (arrays["data"], arrays["indices"], arrays["indptr"]),
+                    shape=tuple(arrays["shape"]),
+                ),
+                idf=arrays["idf"],
+                row_idf=arrays["row_idf"],
+                k1=k1,
+                b=b,
+            )
+
+    @classmethod
+    def create(
+        cls, texts: Iterable[str], k1: float = DEFAULT_K1, b: float = DEFAULT_B
+    ) -> "BM25Index":
+        builder = BM25Builder()
+        builder.add(texts)
+        return builder.build(k1=k1, b=b)
+
+
+class BM25Builder:
+    """
+    Builds a BM25Index from texts added a chunk at a time, keeping only their term counts rather than the texts.
+    """
+
+    def __init__(self) -> None:
+        self._vocabulary: Dict[str, int] = {}
+        self._terms: List[int] = []
+        self._rows: List[int] = []
+        self._counts: List[int] = []
+        self._lengths: List[int] = []
+
+    def __len__(self) -> int:
+        return len(self._lengths)
+
+    def add(self, texts: Iterable[str]) -> None:
+        """
+        Adds texts as the next rows of the index.
+        """
+        for text in texts:
+            row = len(self._lengths)
+            terms = lexical_terms(text)
+            for term, count in Counter(terms).items():
+                self._terms.append(
+                    self._vocabulary.setdefault(term, len(self._vocabulary))
+                )
+                self._rows.append(row)
+                self._counts.append(count)
+            self._lengths.append(len(terms))
+
+    def build(
+        self, k1: float = BM25Index.DEFAULT_K1, b: float = BM25Index.DEFAULT_B
+    ) -> BM25Index:
+        from scipy import sparse
+
+        terms = np.array(self._terms, dtype=np.int32)
+        rows = np.array(self._rows, dtype=np.int32)
+        counts = np.array(self._counts, dtype=np.float32)
+        lengths = np.array(self._lengths, dtype=np.float32)
+        row_count = len(lengths)
+
+        # The Lucene variant of idf, which stays positive for terms in over half the rows
+        frequencies = np.bincount(terms, minlength=len(self._vocabulary))
+        idf = np.log1p((row_count - frequencies + 0.5) / (frequencies + 0.5)).astype(
+            np.float32
+        )
+        average_length = float(lengths.mean()) if row_count and lengths.any() else 1.0
+        saturation = k1 * (1.0 - b + b * lengths[rows] / average_length)
+        weights = idf[terms] * counts * (k1 + 1.0) / (counts + saturation)
+
+        postings = sparse.csr_matrix(
+            (weights.astype(np.float32), (terms, rows)),
+            shape=(len(self._vocabulary), row_count),
+        )
+        postings.sort_indices()
+        return BM25Index(
+            vocabulary=dict(self._vocabulary),
+            postings=postings,
+            idf=idf,
+            row_idf=np.bincount(rows, weights=idf[terms], minlength=row_count).astype(
+                np.float32
+            ),
+            k1=k1,
+            b=b,
+        )
+
+
+class Fusion(Enum):
+    RECIPROCAL_RANK = "rrf"
+    WEIGHTED = "weighted"
+
+
+def reciprocal_rank_fusion(
+    rankings: Sequence[Sequence[Neighbor]],
+    weights: Sequence[float],
+    k: int,
+    constant: int = RRF_CONSTANT,
+) -> List[Neighbor]:
+    """
+    Fuses rankings of the same rows by the weighted sum of 1 / (constant + rank) over the rankings each row is in. Only
+    the ranks count, so the rankings' scores don't have to be comparable.
+
+    Returns:
+        The k best rows. Their similarities are scaled so a row ranked first by every ranking gets 1.
+    """
+    scores: Dict[int, float] = defaultdict(float)
+    for ranking, weight in zip(rankings, weights):
+        for rank, neighbor in enumerate(ranking, start=1):
+            scores[neighbor.index] += weight / (constant + rank)
+    best = sum(weights) / (constant + 1)
+    return [
+        Neighbor(index=row, similarity=score / best)
+        for row, score in heapq.nlargest(k, scores.items(), key=itemgetter(1))
+    ]
+
+
+def weighted_fusion(
+    rankings: Sequence[Sequence[Neighbor]], weights: Sequence[float], k: int
+) -> List[Neighbor]:
+    """
+    Fuses rankings of the same rows by the weighted sum of their scores. Each ranking's scores are min-max scaled to
+    between 0 and 1 first, since BM25 scores and similarities have different ranges. A row missing from a ranking scores
+    0 in it.
+
+    Returns:
+        The k best rows, with their fused scores divided by the total weight as similarities
+    """
+    scores: Dict[int, float] = defaultdict(float)
+    for ranking, weight in zip(rankings, weights):
+        if not ranking:
+            continue
+        low = min(neighbor.similarity for neighbor in ranking)
+        spread = max(neighbor.similarity for neighbor in ranking) - low
+        for neighbor in ranking:
+            scaled = (neighbor.similarity - low) / spread if spread > 0 else 1.0
+            scores[neighbor.index] += weight * scaled
+    total = sum(weights)
+    return [
+        Neighbor(index=row, similarity=score / total)
+        for row, score in heapq.nlargest(k, scores.items(), key=itemgetter(1))
+    ]
+
+
+class HybridSearch:
+    """
+    Searches known questions by their words with a BM25 index as well as by their meaning with a nearest neighbor
+    index, and fuses the two rankings. Sentence embeddings blur the product names, model numbers and error codes BM25
+    matches exactly, and the lexical search costs a fraction of embedding a question.
+
+    Questions whose best lexical match is about as good as exact skip the embedder and the nearest neighbor index
+    altogether. Their similarities are the match's confidence, scaled down by BM25 score for the rest of the k.
+    Otherwise the similarities are fused scores rather than cosine similarities.
+
+    Args:
+        lexical (BM25Index): the BM25 index of the same rows as the nearest neighbor index
+        fusion (Fusion): how to fuse the rankings
+        lexical_weight (float): the lexical ranking's share of the fused score, from 0 to 1
+        min_lexical_confidence (Optional[float]): how confident the best lexical match has to be to skip the semantic
+            search. If None, it's never skipped.
+        depth (int): how many candidates to fetch from each index before fusing them
+    """
+
+    DEFAULT_FUSION: Fusion = Fusion.RECIPROCAL_RANK
+    DEFAULT_LEXICAL_WEIGHT: float = 0.5
+    DEFAULT_MIN_LEXICAL_CONFIDENCE: float = 0.9
+    DEFAULT_DEPTH: int = 20
+    STAGE: str = "lexical"
+
+    def __init__(
+        self,
+        lexical: BM25Index,
+        fusion: Fusion = DEFAULT_FUSION,
+        lexical_weight: float = DEFAULT_LEXICAL_WEIGHT,
+        min_lexical_confidence: Optional[float] = DEFAULT_MIN_LEXICAL_CONFIDENCE,
+        depth: int = DEFAULT_DEPTH,
+    ) -> None:
+        if not 0.0 <= lexical_weight <= 1.0:
+            raise ValueError(
+                f"The lexical weight has to be from 0 to 1, not {lexical_weight}"
+            )
+        self._lexical: BM25Index = lexical
+        self._fusion: Fusion = fusion
+        self._weights: List[float] = [1.0 - lexical_weight, lexical_weight]
+        self._min_lexical_confidence: Optional[float] = min_lexical_confidence
+        self._depth: int = depth
+        self._latency = STAGE_LATENCY.labels(self.STAGE)
+        self._batch_size = STAGE_BATCH_SIZE.labels(self.STAGE)
+
+    @property
+    def lexical(self) -> BM25Index:
+        return self._lexical
+
+    def candidates(self, k: int, allowed: Optional[RowFilter] = None) -> int:
+        """
+        How many candidates to fetch from each index to find the k best fused ones.
+        """
+        return min(
+            max(k, self._depth),
+            allowed.count if allowed is not None else len(self._lexical),
+        )
+
+    def match(
+        self, texts: Sequence[str], k: int = 1, allowed: Optional[RowFilter] = None
+    ) -> List[LexicalMatches]:
+        """
+        Searches the lexical index for the candidates to find the k best fused rows from.
+        """
+        with self._latency.time():
+            matches = self._lexical.search(
+                texts, k=self.candidates(k, allowed), allowed=allowed
+            )
+        self._batch_size.observe(len(texts))
+        return matches
+
+    def short_circuit(
+        self, matches: LexicalMatches, k: int = 1
+    ) -> Optional[List[Neighbor]]:
+        """
+        Returns:
+            The k best rows if the lexical match is confident enough to skip the semantic search, or else None
+        """
+        if (
+            self._min_lexical_confidence is None
+            or not matches.neighbors
+            or matches.confidence < self._min_lexical_confidence
+        ):
+            return None
+
+        LEXICAL_SHORT_CIRCUITS.labels().inc()
+        best = matches.neighbors[0].similarity
+        return [
+            Neighbor(
+                index=neighbor.index,
+                similarity=matches.confidence * neighbor.similarity / best,
+            )
+            for neighbor in matches.neighbors[:k]
+        ]
+
+    def fuse(
+        self, semantic: Sequence[Neighbor], matches: LexicalMatches, k: int = 1
+    ) -> List[Neighbor]:
+        rankings = [semantic, matches.neighbors]
+        if self._fusion is Fusion.WEIGHTED:
+            return weighted_fusion(rankings, self._weights, k)
+        return reciprocal_rank_fusion(rankings, self._weights, k)
+
+    def search(
+        self,
+        texts: Sequence[str],
+        embedder: Embedder,
+        index: NearestNeighbors,
+        k: int = 1,
+        allowed: Optional[RowFilter] = None,
+    ) -> List[List[Neighbor]]:
+        """
+        Finds the k best rows for each text, only embedding the texts the lexical index can't answer by itself.
+
+        Args:
+            texts (Sequence[str]): the texts to search for
+            embedder (Embedder): embeds the texts for the index
+            index (NearestNeighbors): the nearest neighbor index of the same rows as the lexical index
+            k (int): how many rows to find for each text
+            allowed (Optional[RowFilter]): if given, only these rows are returned
+        """
+        matches = self.match(texts, k=k, allowed=allowed)
+        results: List[Optional[List[Neighbor]]] = [
+            self.short_circuit(text_matches, k=k) for text_matches in matches
+        ]
+        pending = [row for row, result in enumerate(results) if result is None]
+        if pending:
+            semantic = index.nearest_neighbors(
+                embedder.embed([texts[row] for row in pending]),
+                k=self.candidates(k, allowed),
+                allowed=allowed,
+            )
+            for row, neighbors in zip(pending, semantic):
+                results[row] = self.fuse(neighbors, matches[row], k=k)
+        return [result if result is not None else [] for result in results]
+
+    @classmethod
+    def load(
+        cls,
+        index_file: Union[str, Path],
+        fusion: Fusion = DEFAULT_FUSION,
+        lexical_weight: float = DEFAULT_LEXICAL_WEIGHT,
+        min_lexical_confidence: Optional[float] = DEFAULT_MIN_LEXICAL_CONFIDENCE,
+        depth: int = DEFAULT_DEPTH,
+    ) -> "HybridSearch":
+        """
+        Loads the lexical index saved next to a nearest neighbor index by build_index(lexical=True).
+        """
+        return cls(
+            lexical=BM25Index.load(lexical_path(index_file)),
+            fusion=fusion,
+            lexical_weight=lexical_weight,
+            min_lexical_confidence=min_lexical_confidence,
+            depth=depth,
+        )
@@ -1,4 +1,30 @@
+import importlib
+from typing import Dict, Tuple, Type
+
 from autoguru.questionanswering.nearestneighbors.metrics import Metric
-from autoguru.questionanswering.nearestneighbors.model import NearestNeighbors, Neighbor
+from autoguru.questionanswering.nearestneighbors.model import (
+    NearestNeighbors,
+    Neighbor,
+    RowFilter,
+)
+
+# The index backends are only imported once one is used, so commands that don't need them start quickly
+INDEX_TYPES: Dict[str, Tuple[str, str]] = {
+    "descent": ("autoguru.questionanswering.nearestneighbors.descent", "Descent"),
+    "balltree": ("autoguru.questionanswering.nearestneighbors.balltree", "BallTree"),
+}
+
+
+def index_class(index_type: str) -> Type[NearestNeighbors]:
+    module_name, class_name = INDEX_TYPES[index_type]
+    return getattr(importlib.import_module(module_name), class_name)
+
 
-__all__ = ["Metric", "NearestNeighbors", "Neighbor"]
+__all__ = [
+    "INDEX_TYPES",
+    "Metric",
+    "NearestNeighbors",
+    "Neighbor",
+    "RowFilter",
+    "index_class",
+]
@@ -1,13 +1,21 @@
 import pickle
 from pathlib import Path
-from typing import Callable, Dict, List, Union
+from typing import Callable, Dict, List, Optional, Union
 
 import numpy as np
 from scipy.spatial.distance import cosine
 from sklearn.neighbors import BallTree as SkBallTree
 
+from autoguru.questionanswering.nearestneighbors.filtering import (
+    exact_search,
+    search_filtered,
+)
 from autoguru.questionanswering.nearestneighbors.metrics import Metric
-from autoguru.questionanswering.nearestneighbors.model import NearestNeighbors, Neighbor
+from autoguru.questionanswering.nearestneighbors.model import (
+    NearestNeighbors,
+    Neighbor,
+    RowFilter,
+)
 
 _METRICS: Dict[Metric, Callable[[np.ndarray, np.ndarray], np.floating]] = {
     Metric.COSINE: cosine
@@ -26,12 +34,35 @@ class BallTree(NearestNeighbors):
         self._index: SkBallTree = index
         self._similarity: Callable[[np.ndarray], np.ndarray] = metric.similarity
 
+    @property
+    def size(self) -> int:
+        return self._index.data.shape[0]
+
     def nearest_neighbors(
-        self, vectors: np.ndarray, k: int = 1
+        self, vectors: np.ndarray, k: int = 1, allowed: Optional[RowFilter] = None
     ) -> List[List[Neighbor]]:
         if vectors.ndim != 2:
             vectors = vectors.reshape((-1, self._index.data.shape[1]))
 
+        if allowed is not None:
+            return search_filtered(
+                self._search,
+                self._exact,
+                vectors,
+                k,
+                allowed,
+                size=self.size,
+            )
+        return self._search(vectors, k)
+
+    def _exact(
+        self, vectors: np.ndarray, rows: np.ndarray, k: int
+    ) -> List[List[Neighbor]]:
+        return exact_search(
+            np.asarray(self._index.data), rows, vectors, k, self._similarity
+        )
+
+    def _search(self, vectors: np.ndarray, k: int) -> List[List[Neighbor]]:
         query_distances, query_indexes = self._index.query(X=vectors, k=k)
         query_similarities = self._similarity(query_distances)
         return [
@@ -1,12 +1,20 @@
 import pickle
 from pathlib import Path
-from typing import Callable, Dict, List, Union
+from typing import Callable, Dict, List, Optional, Union
 
 import numpy as np
 from pynndescent import NNDescent
 
+from autoguru.questionanswering.nearestneighbors.filtering import (
+    exact_search,
+    search_filtered,
+)
 from autoguru.questionanswering.nearestneighbors.metrics import Metric
-from autoguru.questionanswering.nearestneighbors.model import NearestNeighbors, Neighbor
+from autoguru.questionanswering.nearestneighbors.model import (
+    NearestNeighbors,
+    Neighbor,
+    RowFilter,
+)
 
 _METRIC_NAMES: Dict[Metric, str] = {Metric.COSINE: "cosine"}
 
@@ -28,12 +36,60 @@ class Descent(NearestNeighbors):
         self._similarity: Callable[[np.ndarray], np.ndarray] = metric.similarity
         self._epsilon: float = epsilon
 
+    @property
+    def size(self) -> int:
+        return self._index._raw_data.shape[0]
+
+    @property
+    def epsilon(self) -> float:
+        return self._epsilon
+
+    @epsilon.setter
+    def epsilon(self, epsilon: float) -> None:
+        # Only searches use epsilon, so it can be changed without rebuilding the index
+        self._epsilon = epsilon
+
     def nearest_neighbors(
-        self, vectors: np.ndarray, k: int = 1
+        self, vectors: np.ndarray, k: int = 1, allowed: Optional[RowFilter] = None
     ) -> List[List[Neighbor]]:
         if vectors.ndim != 2:
             vectors = vectors.reshape((-1, self._index.dim))
 
+        if allowed is not None:
+            return search_filtered(
+                self._search,
+                self._exact,
+                vectors,
+                k,
+                allowed,
+                size=self.size,
+            )
+        return self._search(vectors, k)
+
+    def _exact(
+        self, vectors: np.ndarray, rows: np.ndarray, k: int
+    ) -> List[List[Neighbor]]:
+        # pynndescent keeps the indexed vectors reordered for locality, with each one's row in _vertex_order
+        order = getattr(self._index, "_vertex_order", None)
+        if order is None:
+            return exact_search(
+                self._index._raw_data, rows, vectors, k, self._similarity
+            )
+        positions = np.empty_like(order)
+        positions[order] = np.arange(len(order))
+        return [
+            [
+                Neighbor(
+                    index=int(order[neighbor.index]), similarity=neighbor.similarity
+                )
+                for neighbor in neighbors
+            ]
+            for neighbors in exact_search(
+                self._index._raw_data, positions[rows], vectors, k, self._similarity
+            )
+        ]
+
+    def _search(self, vectors: np.ndarray, k: int) -> List[List[Neighbor]]:
         query_indexes, query_distances = self._index.query(
             query_data=vectors, k=k, epsilon=self._epsilon
         )
@@ -0,0 +1,281 @@
+import json
+import math
+from pathlib import Path
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    List,
+    Mapping,
+    Sequence,
+    Tuple,
+    Union,
+)
+
+import numpy as np
+
+from autoguru.questionanswering.nearestneighbors.model import Neighbor, RowFilter
+
+ATTRIBUTES_SUFFIX: str = ".attributes.npz"
+
+# Filters allowing at most this many rows are searched exactly, which costs less than over-fetching from the index
+EXACT_SEARCH_ROWS: int = 4096
+# How many more neighbors than the filter's selectivity calls for to over-fetch, since similar rows tend to share
+# attributes and the allowed ones aren't spread evenly
+OVERFETCH_MARGIN: float = 2.0
+# How many rows an exact search compares queries with at once
+EXACT_SEARCH_CHUNK_SIZE: int = 65536
+
+
+def attributes_path(index_file: Union[str, Path]) -> Path:
+    if isinstance(index_file, str):
+        index_file = Path(index_file)
+
+    return index_file.with_name(index_file.name + ATTRIBUTES_SUFFIX)
+
+
+def _unit(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0.0] = 1.0
+    return vectors / norms
+
+
+def exact_search(
+    index_vectors: np.ndarray,
+    rows: np.ndarray,
+    vectors: np.ndarray,
+    k: int,
+    similarity: Callable[[np.ndarray], np.ndarray],
+) -> List[List[Neighbor]]:
+    """
+    Finds the k rows with the highest cosine similarity to each vector out of only the given rows, comparing them
+    EXACT_SEARCH_CHUNK_SIZE rows at a time.
+
+    Args:
+        index_vectors (np.ndarray): the vectors of every index row
+        rows (np.ndarray): the rows to search
+        vectors (np.ndarray): the vectors to search for
+        k (int): how many rows to find for each vector
+        similarity (Callable[[np.ndarray], np.ndarray]): turns cosine distances into the similarities the index reports
+    """
+    queries = _unit(vectors)
+    k = min(k, len(rows))
+    best_rows = np.empty((len(queries), 0), dtype=np.int64)
+    best_cosines = np.empty((len(queries), 0), dtype=np.float32)
+    for start in range(0, len(rows), EXACT_SEARCH_CHUNK_SIZE):
+        chunk = rows[start : start + EXACT_SEARCH_CHUNK_SIZE]
+        cosines = queries @ _unit(index_vectors[chunk]).T
+        # The best of this chunk compete with the best of the chunks before it
+        best_rows = np.concatenate(
+            [best_rows, np.broadcast_to(chunk, cosines.shape)], axis=1
+        )
+        best_cosines = np.concatenate([best_cosines, cosines], axis=1)
+        if best_cosines.shape[1] > k:
+            top = np.argpartition(-best_cosines, k - 1, axis=1)[:, :k]
+            best_rows = np.take_along_axis(best_rows, top, axis=1)
+            best_cosines = np.take_along_axis(best_cosines, top, axis=1)
+
+    order = np.argsort(-best_cosines, axis=1, kind="stable")
+    best_rows = np.take_along_axis(best_rows, order, axis=1)
+    similarities = similarity(
+        1.0 - np.clip(np.take_along_axis(best_cosines, order, axis=1), -1.0, 1.0)
+    )
+    return [
+        [
+            Neighbor(index=index.item(), similarity=row_similarity.item())
+            for index, row_similarity in zip(query_rows, query_similarities)
+        ]
+        for query_rows, query_similarities in zip(best_rows, similarities)
+    ]
+
+
+def search_filtered(
+    search: Callable[[np.ndarray, int], Sequence[Sequence[Neighbor]]],
+    exact: Callable[[np.ndarray, np.ndarray, int], List[List[Neighbor]]],
+    vectors: np.ndarray,
+    k: int,
+    allowed: RowFilter,
+    size: int,
+) -> List[List[Neighbor]]:
+    """
+    Finds the k nearest allowed rows to each vector. Filters that allow few rows are searched exactly over just those
+    rows. Otherwise the index is asked for as many neighbors as should include k allowed ones given the filter's
+    selectivity, and only the vectors that came up short are searched again for twice as many, until they would have
+    to fetch every row and are searched exactly instead.
+
+    Args:
+        search (Callable[[np.ndarray, int], Sequence[Sequence[Neighbor]]]): the index's unfiltered search
+        exact (Callable[[np.ndarray, np.ndarray, int], List[List[Neighbor]]]): searches only the given rows exactly
+        vectors (np.ndarray): the vectors to search for
+        k (int): how many rows to find for each vector
+        allowed (RowFilter): the rows that may be returned
+        size (int): how many rows the index has
+    """
+    if len(allowed) != size:
+        raise ValueError(f"The filter has {len(allowed)} rows but the index has {size}")
+
+    k = min(k, allowed.count)
+    if k == 0:
+        return [[] for _ in vectors]
+    if allowed.count <= EXACT_SEARCH_ROWS:
+        return exact(vectors, allowed.rows(), k)
+
+    results: List[List[Neighbor]] = [[] for _ in vectors]
+    pending = np.arange(len(vectors))
+    fetch = math.ceil(k / allowed.selectivity * OVERFETCH_MARGIN)
+    while len(pending) > 0 and fetch < size:
+        short = []
+        for query, neighbors in zip(pending, search(vectors[pending], fetch)):
+            kept = [
+                neighbor for neighbor in neighbors if allowed.allowed[neighbor.index]
+            ]
+            if len(kept) >= k:
+                results[query] = kept[:k]
+            else:
+                short.append(query)
+        pending = np.array(short, dtype=np.int64)
+        fetch *= 2
+
+    if len(pending) > 0:
+        for query, neighbors in zip(
+            pending, exact(vectors[pending], allowed.rows(), k)
+        ):
+            results[query] = neighbors
+    return results
+
+
+def _meets(value: Any, condition: Any) -> bool:
+    if callable(condition):
+        return bool(condition(value))
+    if isinstance(condition, (list, tuple, set, frozenset)):
+        return value in condition
+    return bool(value == condition)
+
+
+class RowAttributes:
+    """
+    Named attributes of each row of an index, like its tenant, its language or whether it's answered, to build search
+    filters from. Each attribute is stored as its distinct values and a code per row, so a filter only checks each
+    distinct value once and then finds the rows with one pass over the codes.
+
+    Args:
+        codes (Dict[str, np.ndarray]): each attribute's value code for each row
+        values (Dict[str, List[Any]]): each attribute's values by code. Rows without an attribute have None.
+    """
+
+    def __init__(
+        self, codes: Dict[str, np.ndarray], values: Dict[str, List[Any]]
+    ) -> None:
+        self._codes: Dict[str, np.ndarray] = codes
+        self._values: Dict[str, List[Any]] = values
+
+    @property
+    def names(self) -> List[str]:
+        return list(self._codes)
+
+    def __len__(self) -> int:
+        return len(next(iter(self._codes.values()))) if self._codes else 0
+
+    def values(self, name: str) -> List[Any]:
+        """
+        The distinct values of an attribute.
+        """
+        return list(self._values[name])
+
+    def filter(self, **conditions: Any) -> RowFilter:
+        """
+        Allows the rows whose attributes meet every condition. A condition is a value the attribute has to equal, a
+        list, tuple or set of values it has to be one of, or a function of the value that's true for the values to
+        allow.
+
+        Raises:
+            KeyError: if an attribute doesn't exist
+        """
+        allowed = np.ones(len(self), dtype=bool)
+        for name, condition in conditions.items():
+            if name not in self._codes:
+                raise KeyError(f"The index has no {name} attribute")
+
+            codes = [
+                code
+                for code, value in enumerate(self._values[name])
+                if _meets(value, condition)
+            ]
+            allowed &= np.isin(self._codes[name], codes)
+        return RowFilter(allowed)
+
+    def save(self, attributes_file: Union[str, Path]) -> None:
+        if isinstance(attributes_file, str):
+            attributes_file = Path(attributes_file)
+
+        arrays: Dict[str, np.ndarray] = {}
+        for name, codes in self._codes.items():
+            arrays[f"codes/{name}"] = codes
+            arrays[f"values/{name}"] = np.frombuffer(
+                json.dumps(self._values[name]).encode("UTF-8"), dtype=np.uint8
+            )
+        with attributes_file.open("wb") as out_file:
+            np.savez(out_file, **arrays)
+
+    @classmethod
+    def load(cls, attributes_file: Union[str, Path]) -> "RowAttributes":
+        codes: Dict[str, np.ndarray] = {}
+        values: Dict[str, List[Any]] = {}
+        with np.load(attributes_file) as arrays:
+            for key in arrays.files:
+                kind, name = key.split("/", 1)
+                if kind == "codes":
+                    codes[name] = arrays[key]
+                else:
+                    values[name] = json.loads(arrays[key].tobytes().decode("UTF-8"))
+        return cls(codes=codes, values=values)
+
+
+class RowAttributesBuilder:
+    """
+    Builds RowAttributes from each row's attributes in order. Attributes can be any JSON values, and rows can have
+    different attributes.
+    """
+
+    def __init__(self) -> None:
+        self._rows: int = 0
+        self._codes: Dict[str, List[int]] = {}
+        # Each attribute's values by their JSON, so unhashable values can be encoded too
+        self._values: Dict[str, Dict[str, Tuple[int, Any]]] = {}
+
+    def __len__(self) -> int:
+        return self._rows
+
+    def _code(self, name: str, value: Any) -> int:
+        values = self._values[name]
+        key = json.dumps(value, sort_keys=True)
+        if key not in values:
+            values[key] = (len(values), value)
+        return values[key][0]
+
+    def add(self, attributes: Mapping[str, Any]) -> None:
+        """
+        Adds the attributes of the next row.
+        """
+        for name in attributes:
+            if name not in self._codes:
+                self._values[name] = {}
+                # Earlier rows didn't have the attribute
+                self._codes[name] = (
+                    [self._code(name, None)] * self._rows if self._rows else []
+                )
+        for name, codes in self._codes.items():
+            codes.append(self._code(name, attributes.get(name)))
+        self._rows += 1
+
+    def build(self) -> RowAttributes:
+        values: Dict[str, List[Any]] = {}
+        codes: Dict[str, np.ndarray] = {}
+        for name, encoded in self._values.items():
+            values[name] = [value for _, value in encoded.values()]
+            # Most attributes have few values, so their codes fit in a byte per row
+            codes[name] = np.array(
+                self._codes[name], dtype=np.min_scalar_type(len(values[name]) - 1)
+            )
+        return RowAttributes(codes=codes, values=values)
@@ -0,0 +1,61 @@
+import pickle
+from pathlib import Path
+from typing import Optional, Sequence, Union
+
+import numpy as np
+
+from autoguru.questionanswering.nearestneighbors.model import (
+    NearestNeighbors,
+    Neighbor,
+    RowFilter,
+)
+from autoguru.questionanswering.utilities.instrumentation import (
+    STAGE_BATCH_SIZE,
+    STAGE_LATENCY,
+)
+
+
+class InstrumentedNearestNeighbors(NearestNeighbors):
+    DEFAULT_STAGE: str = "nearest_neighbors"
+
+    def __init__(self, index: NearestNeighbors, stage: str = DEFAULT_STAGE) -> None:
+        self._index: NearestNeighbors = index
+        self._stage: str = stage
+        self._latency = STAGE_LATENCY.labels(stage)
+        self._batch_size = STAGE_BATCH_SIZE.labels(stage)
+
+    @property
+    def index(self) -> NearestNeighbors:
+        return self._index
+
+    @property
+    def size(self) -> int:
+        return self._index.size
+
+    def nearest_neighbors(
+        self, vectors: np.ndarray, k: int = 1, allowed: Optional[RowFilter] = None
+    ) -> Sequence[Sequence[Neighbor]]:
+        with self._latency.time():
+            neighbors = self._index.nearest_neighbors(vectors, k=k, allowed=allowed)
+        self._batch_size.observe(len(neighbors))
+        return neighbors
+
+    def save(self, index_file: Union[str, Path]) -> None:
+        # Only the wrapped index is saved so the file can be loaded with or without instrumentation
+        self._index.save(index_file)
+
+    @classmethod
+    def load(
+        cls, index_file: Union[str, Path], stage: str = DEFAULT_STAGE
+    ) -> "InstrumentedNearestNeighbors":
+        if isinstance(index_file, str):
+            index_file = Path(index_file)
+
+        with index_file.open("rb") as in_file:
+            return cls(index=pickle.load(in_file), stage=stage)
+
+    @classmethod
+    def create(
+        cls, index: NearestNeighbors, stage: str = DEFAULT_STAGE
+    ) -> "InstrumentedNearestNeighbors":
+        return cls(index=index, stage=stage)
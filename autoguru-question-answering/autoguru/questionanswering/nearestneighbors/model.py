@@ -1,7 +1,7 @@
 from abc import ABC, abstractmethod
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Any, Sequence, Union, no_type_check
+from typing import Any, Iterable, Optional, Sequence, Union, no_type_check
 
 import numpy as np
 
@@ -14,11 +14,89 @@ class Neighbor:
     similarity: float
 
 
+class RowFilter:
+    """
+    The rows of an index a search may return, as a bitmap of one bool per row. Filters combine with &, | and ~.
+
+    Args:
+        allowed (np.ndarray): whether each row may be returned
+    """
+
+    def __init__(self, allowed: np.ndarray) -> None:
+        self._allowed: np.ndarray = np.asarray(allowed, dtype=bool)
+        self._count: int = int(np.count_nonzero(self._allowed))
+        self._rows: Optional[np.ndarray] = None
+
+    @property
+    def allowed(self) -> np.ndarray:
+        return self._allowed
+
+    @property
+    def count(self) -> int:
+        """
+        How many rows are allowed.
+        """
+        return self._count
+
+    @property
+    def selectivity(self) -> float:
+        """
+        The fraction of rows that are allowed.
+        """
+        return self._count / len(self._allowed) if len(self._allowed) else 0.0
+
+    def rows(self) -> np.ndarray:
+        """
+        The allowed rows in order.
+        """
+        if self._rows is None:
+            self._rows = np.flatnonzero(self._allowed)
+        return self._rows
+
+    def __len__(self) -> int:
+        return len(self._allowed)
+
+    def __contains__(self, row: int) -> bool:
+        return bool(self._allowed[row])
+
+    def __and__(self, other: "RowFilter") -> "RowFilter":
+        return RowFilter(self._allowed & other.allowed)
+
+    def __or__(self, other: "RowFilter") -> "RowFilter":
+        return RowFilter(self._allowed | other.allowed)
+
+    def __invert__(self) -> "RowFilter":
+        return RowFilter(~self._allowed)
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[int], size: int) -> "RowFilter":
+        allowed = np.zeros(size, dtype=bool)
+        allowed[np.fromiter(rows, dtype=np.int64)] = True
+        return cls(allowed)
+
+
 class NearestNeighbors(ABC):
+    @property
+    @abstractmethod
+    def size(self) -> int:
+        """
+        How many rows the index has.
+        """
+        raise NotImplementedError
+
     @abstractmethod
     def nearest_neighbors(
-        self, vectors: np.ndarray, k: int = 1
+        self, vectors: np.ndarray, k: int = 1, allowed: Optional[RowFilter] = None
     ) -> Sequence[Sequence[Neighbor]]:
+        """
+        Finds the k nearest rows to each vector.
+
+        Args:
+            vectors (np.ndarray): the vectors to search for
+            k (int): how many rows to find for each vector
+            allowed (Optional[RowFilter]): if given, only these rows are returned. Backends apply it while searching,
+                so there are still k results unless fewer rows are allowed.
+        """
         raise NotImplementedError
 
     @abstractmethod
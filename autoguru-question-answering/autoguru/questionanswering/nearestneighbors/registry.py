@@ -0,0 +1,261 @@
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from dataclasses import dataclass
+from pathlib import Path
+from typing import (
+    Callable,
+    Dict,
+    Generic,
+    Iterable,
+    List,
+    Optional,
+    Set,
+    TypeVar,
+    Union,
+)
+
+from autoguru.questionanswering.answers import AnswerLookup, lookup_path
+from autoguru.questionanswering.nearestneighbors import NearestNeighbors, index_class
+from autoguru.questionanswering.utilities.instrumentation import (
+    INDEX_REGISTRY_EVENTS,
+    INDEX_REGISTRY_MEMORY,
+)
+from autoguru.questionanswering.utilities.memory import footprint
+
+V = TypeVar("V")
+
+
+def _footprint_size(value: object) -> int:
+    return footprint(value).total
+
+
+@dataclass
+class IndexedAnswers:
+    """
+    A namespace's index with the lookup from its rows to their answers.
+    """
+
+    index: NearestNeighbors
+    answers: AnswerLookup
+
+
+@dataclass
+class _Entry(Generic[V]):
+    value: V
+    size: int
+
+
+class IndexRegistry(Generic[V]):
+    """
+    A thread-safe registry of one index per namespace, like a Discord guild or a product, for serving many knowledge
+    bases from one process without keeping all of them loaded.
+
+    Indexes are loaded the first time their namespace is asked for. Concurrent first requests for the same namespace
+    share one load rather than each loading their own copy. Once the indexes held go over the memory budget, the least
+    recently used ones are dropped until they fit, except for pinned namespaces and the index that was just loaded.
+    Dropped indexes are loaded again the next time they're asked for, and callers still using one keep it alive until
+    they're done with it.
+
+    The registry holds whatever the loader returns, so a namespace can also be a whole tenant's models.
+
+    Args:
+        loader (Callable[[str], V]): loads a namespace's index. Raises KeyError for namespaces that don't exist.
+        memory_budget (Optional[int]): the most bytes of indexes to hold. If None, indexes are never evicted.
+        size (Optional[Callable[[V], int]]): how many bytes an index takes. Defaults to the footprint of everything reachable from it, memory mapped arrays included.
+        pinned (Iterable[str]): namespaces that are never evicted
+        name (Optional[str]): if given, lookups and memory are recorded in the autoguru_index_registry_* metrics under this name
+    """
+
+    def __init__(
+        self,
+        loader: Callable[[str], V],
+        memory_budget: Optional[int] = None,
+        size: Optional[Callable[[V], int]] = None,
+        pinned: Iterable[str] = (),
+        name: Optional[str] = None,
+    ) -> None:
+        self._loader: Callable[[str], V] = loader
+        self._memory_budget: Optional[int] = memory_budget
+        self._size: Callable[[V], int] = size if size is not None else _footprint_size
+        self._pinned: Set[str] = set(pinned)
+        self._name: Optional[str] = name
+        self._entries: "OrderedDict[str, _Entry[V]]" = OrderedDict()
+        self._loading: Dict[str, "Future[V]"] = {}
+        self._memory: int = 0
+        self._lock: threading.Lock = threading.Lock()
+
+    @property
+    def memory(self) -> int:
+        """
+        How many bytes the indexes held take.
+        """
+        return self._memory
+
+    @property
+    def memory_budget(self) -> Optional[int]:
+        return self._memory_budget
+
+    @property
+    def namespaces(self) -> List[str]:
+        """
+        The namespaces whose indexes are held, least recently used first.
+        """
+        with self._lock:
+            return list(self._entries)
+
+    @property
+    def pinned(self) -> Set[str]:
+        return set(self._pinned)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, namespace: str) -> bool:
+        return namespace in self._entries
+
+    def get(self, namespace: str) -> V:
+        """
+        Gets a namespace's index, loading it if it isn't held. This blocks while the index loads, so async callers
+        should call it from an executor.
+
+        Raises:
+            KeyError: if the namespace doesn't exist
+        """
+        with self._lock:
+            entry = self._entries.get(namespace)
+            if entry is not None:
+                self._entries.move_to_end(namespace)
+                self._record("hit")
+                return entry.value
+
+            loading = self._loading.get(namespace)
+            if loading is None:
+                loading = Future()
+                self._loading[namespace] = loading
+                loads = True
+            else:
+                loads = False
+
+        if not loads:
+            self._record("shared")
+            return loading.result()
+
+        # Loaded outside the lock, so other namespaces can be served and loaded in the meantime
+        try:
+            value = self._loader(namespace)
+            size = self._size(value)
+        except BaseException as error:
+            with self._lock:
+                del self._loading[namespace]
+            self._record("failure")
+            loading.set_exception(error)
+            raise
+
+        with self._lock:
+            del self._loading[namespace]
+            self._entries[namespace] = _Entry(value=value, size=size)
+            self._memory += size
+            self._evict(keep=namespace)
+        self._record("load")
+        loading.set_result(value)
+        return value
+
+    def pin(self, namespace: str) -> None:
+        """
+        Keeps a namespace's index from being evicted. It's still only loaded once it's asked for.
+        """
+        with self._lock:
+            self._pinned.add(namespace)
+
+    def unpin(self, namespace: str) -> None:
+        with self._lock:
+            self._pinned.discard(namespace)
+            self._evict()
+
+    def evict(self, namespace: str) -> bool:
+        """
+        Drops a namespace's index, even if it's pinned.
+
+        Returns:
+            Whether the index was held
+        """
+        with self._lock:
+            return self._remove(namespace)
+
+    def clear(self) -> None:
+        with self._lock:
+            for namespace in list(self._entries):
+                self._remove(namespace)
+
+    def _remove(self, namespace: str) -> bool:
+        entry = self._entries.pop(namespace, None)
+        if entry is None:
+            return False
+        self._memory -= entry.size
+        self._record("evict")
+        self._publish()
+        return True
+
+    def _evict(self, keep: Optional[str] = None) -> None:
+        if self._memory_budget is not None:
+            for namespace in list(self._entries):
+                if self._memory <= self._memory_budget:
+                    break
+                if namespace != keep and namespace not in self._pinned:
+                    self._remove(namespace)
+        self._publish()
+
+    def _publish(self) -> None:
+        if self._name is not None:
+            INDEX_REGISTRY_MEMORY.labels(self._name).set(self._memory)
+
+    def _record(self, event: str) -> None:
+        if self._name is not None:
+            INDEX_REGISTRY_EVENTS.labels(self._name, event).inc()
+
+    @classmethod
+    def from_directory(
+        cls,
+        directory: Union[str, Path],
+        index_type: str = "descent",
+        memory_budget: Optional[int] = None,
+        pinned: Iterable[str] = (),
+        name: Optional[str] = None,
+    ) -> "IndexRegistry[IndexedAnswers]":
+        """
+        Creates a registry of the indexes in a directory and their answers, one per namespace. A namespace's index is
+        its bundle, <namespace>.bundle, or else <namespace>.index of index_type with the answer lookup saved next to it.
+
+        Args:
+            directory (Union[str, Path]): the directory of indexes
+            index_type (str): the type of the indexes that aren't bundled
+            memory_budget (Optional[int]): the most bytes of indexes to hold
+            pinned (Iterable[str]): namespaces that are never evicted
+            name (Optional[str]): the name to record metrics under
+        """
+        from autoguru.questionanswering.bundle import BUNDLE_SUFFIX, Bundle
+
+        if isinstance(directory, str):
+            directory = Path(directory)
+
+        def load(namespace: str) -> IndexedAnswers:
+            # Namespaces come from requests, so they mustn't be able to reach outside the directory
+            if namespace in ("", ".", "..") or Path(namespace).name != namespace:
+                raise KeyError(namespace)
+
+            bundle_file = directory.joinpath(namespace + BUNDLE_SUFFIX)
+            if bundle_file.exists():
+                bundle = Bundle.load(bundle_file)
+                return IndexedAnswers(index=bundle.index(), answers=bundle.answers())
+            index_file = directory.joinpath(namespace + ".index")
+            if index_file.exists():
+                return IndexedAnswers(
+                    index=index_class(index_type).load(index_file),
+                    answers=AnswerLookup.load(lookup_path(index_file)),
+                )
+            raise KeyError(namespace)
+
+        return IndexRegistry(
+            loader=load, memory_budget=memory_budget, pinned=pinned, name=name
+        )
@@ -0,0 +1,177 @@
+import pickle
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Union
+
+import numpy as np
+
+from autoguru.questionanswering.nearestneighbors.metrics import Metric
+from autoguru.questionanswering.nearestneighbors.model import (
+    NearestNeighbors,
+    Neighbor,
+    RowFilter,
+)
+
+VECTORS_SUFFIX: str = ".vectors.npy"
+
+
+def vectors_path(index_file: Union[str, Path]) -> Path:
+    if isinstance(index_file, str):
+        index_file = Path(index_file)
+
+    return index_file.with_name(index_file.name + VECTORS_SUFFIX)
+
+
+def _cosine_similarity(cosines: np.ndarray) -> np.ndarray:
+    # Rounding in float32 can push the dot product of unit vectors just past 1
+    return np.clip(cosines, -1.0, 1.0)
+
+
+def _angular_similarity(cosines: np.ndarray) -> np.ndarray:
+    return 1.0 - np.arccos(_cosine_similarity(cosines)) / np.pi
+
+
+# Turns exact cosine similarities into the similarity each metric reports
+_SCORES: Dict[Metric, Callable[[np.ndarray], np.ndarray]] = {
+    Metric.COSINE: _cosine_similarity,
+    Metric.ANGULAR_DISTANCE: _angular_similarity,
+}
+
+
+def _unit(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0.0] = 1.0
+    return vectors / norms
+
+
+class RerankedNearestNeighbors(NearestNeighbors):
+    """
+    Over-fetches k * factor candidates from an approximate index and rescores them exactly against the original vectors,
+    returning the true top k of the candidates. This lets the approximate search run at much cheaper settings (like a
+    low Descent epsilon) without losing recall, for the cost of one batched gather and dot product. Descent's epsilon
+    shouldn't be 0 though, since pynndescent barely searches when asked for more candidates than its graph's neighbors.
+
+    The vectors are saved next to the index as a float32 .npy file and memory mapped on load.
+
+    Args:
+        index (NearestNeighbors): the approximate index
+        vectors (np.ndarray): the unit length float32 vector of each index row
+        factor (int): how many candidates to fetch per neighbor returned
+        metric (Metric): the metric to report similarities in
+
+    Raises:
+        ValueError: if there isn't a vector for each row of the index
+    """
+
+    DEFAULT_FACTOR: int = 4
+    DEFAULT_METRIC: Metric = Metric.COSINE
+
+    def __init__(
+        self,
+        index: NearestNeighbors,
+        vectors: np.ndarray,
+        factor: int = DEFAULT_FACTOR,
+        metric: Metric = DEFAULT_METRIC,
+    ) -> None:
+        # Vectors left from an earlier build of the index would rerank candidates against the wrong rows
+        if vectors.shape[0] != index.size:
+            raise ValueError(
+                f"There are {vectors.shape[0]} vectors to rerank with but the index has {index.size} rows"
+            )
+
+        self._index: NearestNeighbors = index
+        self._vectors: np.ndarray = vectors
+        self._factor: int = factor
+        self._score: Callable[[np.ndarray], np.ndarray] = _SCORES[metric]
+
+    @property
+    def index(self) -> NearestNeighbors:
+        return self._index
+
+    @property
+    def size(self) -> int:
+        return self._index.size
+
+    def nearest_neighbors(
+        self, vectors: np.ndarray, k: int = 1, allowed: Optional[RowFilter] = None
+    ) -> List[List[Neighbor]]:
+        if vectors.ndim != 2:
+            vectors = vectors.reshape((-1, self._vectors.shape[1]))
+
+        # The approximate index applies the filter, so every candidate is already allowed
+        fetch = min(
+            k * self._factor,
+            allowed.count if allowed is not None else self.size,
+        )
+        candidates = self._index.nearest_neighbors(vectors, k=fetch, allowed=allowed)
+
+        # Backends can return fewer candidates than asked for, so short rows are padded and masked out
+        width = max((len(row) for row in candidates), default=0)
+        if width == 0:
+            return [[] for _ in candidates]
+        indexes = np.full((len(candidates), width), -1, dtype=np.int64)
+        for row, neighbors in enumerate(candidates):
+            indexes[row, : len(neighbors)] = [neighbor.index for neighbor in neighbors]
+        valid = indexes >= 0
+
+        # (queries x candidates x dimensions) gathered rows dotted with each query
+        gathered = self._vectors[np.where(valid, indexes, 0)]
+        cosines = np.einsum("qcd,qd->qc", gathered, _unit(vectors))
+        cosines[~valid] = -np.inf
+
+        top = min(k, width)
+        best = np.argsort(-cosines, axis=1, kind="stable")[:, :top]
+        best_cosines = np.take_along_axis(cosines, best, axis=1)
+        best_indexes = np.take_along_axis(indexes, best, axis=1)
+        similarities = self._score(best_cosines)
+        return [
+            [
+                Neighbor(index=index.item(), similarity=similarity.item())
+                for index, similarity, cosine in zip(
+                    row_indexes, row_similarities, row_cosines
+                )
+                if cosine != -np.inf
+            ]
+            for row_indexes, row_similarities, row_cosines in zip(
+                best_indexes, similarities, best_cosines
+            )
+        ]
+
+    def save(self, index_file: Union[str, Path]) -> None:
+        self._index.save(index_file)
+        np.save(vectors_path(index_file), np.asarray(self._vectors, dtype=np.float32))
+
+    @classmethod
+    def load(
+        cls,
+        index_file: Union[str, Path],
+        factor: int = DEFAULT_FACTOR,
+        metric: Metric = DEFAULT_METRIC,
+        memory_map: bool = True,
+    ) -> "RerankedNearestNeighbors":
+        if isinstance(index_file, str):
+            index_file = Path(index_file)
+
+        # Every backend pickles itself whole, so the index can be loaded without knowing its type
+        with index_file.open("rb") as in_file:
+            index = pickle.load(in_file)
+        return cls(
+            index=index,
+            vectors=np.load(
+                vectors_path(index_file), mmap_mode="r" if memory_map else None
+            ),
+            factor=factor,
+            metric=metric,
+        )
+
+    @classmethod
+    def create(
+        cls,
+        index_vectors: np.ndarray,
+        index: NearestNeighbors,
+        factor: int = DEFAULT_FACTOR,
+        metric: Metric = DEFAULT_METRIC,
+    ) -> "RerankedNearestNeighbors":
+        return cls(
+            index=index, vectors=_unit(index_vectors), factor=factor, metric=metric
+        )
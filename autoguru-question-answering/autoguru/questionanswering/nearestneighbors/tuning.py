@@ -0,0 +1,329 @@
+import itertools
+import json
+import time
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    Union,
+)
+
+import numpy as np
+
+from autoguru.questionanswering.nearestneighbors import NearestNeighbors, index_class
+
+TUNING_SUFFIX: str = ".tuning.json"
+
+# The values to try for each option of each index type
+DEFAULT_GRIDS: Dict[str, Dict[str, Sequence[Any]]] = {
+    "descent": {
+        "neighbors": (15, 30, 60),
+        "diversify_probability": (0.5, 1.0),
+        "pruning_degree_multiplier": (1.5, 3.0),
+        "epsilon": (0.05, 0.1, 0.2, 0.4),
+    },
+    "balltree": {"leaf_size": (10, 20, 40, 80)},
+}
+# Options that only change how an index is searched, so they're set on each built index instead of rebuilding it
+SEARCH_OPTIONS: Dict[str, Sequence[str]] = {"descent": ("epsilon",)}
+
+
+def tuning_path(index_file: Union[str, Path]) -> Path:
+    if isinstance(index_file, str):
+        index_file = Path(index_file)
+
+    return index_file.with_name(index_file.name + TUNING_SUFFIX)
+
+
+def exact_neighbors(
+    index_vectors: np.ndarray, vectors: np.ndarray, k: int
+) -> List[Set[int]]:
+    """
+    Finds the true k nearest neighbors of each vector by cosine similarity with a brute force search.
+    """
+
+    def unit(rows: np.ndarray) -> np.ndarray:
+        rows = np.asarray(rows, dtype=np.float32)
+        norms = np.linalg.norm(rows, axis=1, keepdims=True)
+        norms[norms == 0.0] = 1.0
+        return rows / norms
+
+    similarities = unit(vectors) @ unit(index_vectors).T
+    nearest = np.argpartition(-similarities, k - 1, axis=1)[:, :k]
+    return [set(row.tolist()) for row in nearest]
+
+
+@dataclass
+class Trial:
+    """
+    Args:
+        index_type (str): the index backend
+        options (Dict[str, Any]): the keyword arguments for the backend's create method
+        recall (float): the fraction of the true k nearest neighbors found, over every query
+        p95_ms (float): the 95th percentile latency of a single query in milliseconds
+        mean_ms (float): the mean latency of a single query in milliseconds
+        build_seconds (float): how long building the sample index took
+    """
+
+    index_type: str
+    options: Dict[str, Any]
+    recall: float
+    p95_ms: float
+    mean_ms: float
+    build_seconds: float
+
+
+def pareto_front(trials: Sequence[Trial]) -> List[Trial]:
+    """
+    Finds the trials that no other trial beats on both recall and p95 latency, fastest first.
+    """
+    front: List[Trial] = []
+    for trial in sorted(trials, key=lambda trial: (trial.p95_ms, -trial.recall)):
+        if not front or trial.recall > front[-1].recall:
+            front.append(trial)
+    return front
+
+
+@dataclass
+class TuningResult:
+    """
+    Args:
+        best (Trial): the chosen options
+        target_met (bool): whether the chosen options meet the recall target and latency budget
+        pareto (List[Trial]): the Pareto optimal trials, fastest first
+        trials (List[Trial]): every trial
+        k (int): how many neighbors each query searched for
+        sample_size (int): how many vectors the trial indexes had
+        queries (int): how many queries each trial was timed with
+        min_recall (Optional[float]): the recall target
+        max_latency_ms (Optional[float]): the p95 latency budget in milliseconds
+    """
+
+    best: Trial
+    target_met: bool
+    pareto: List[Trial]
+    trials: List[Trial]
+    k: int
+    sample_size: int
+    queries: int
+    min_recall: Optional[float]
+    max_latency_ms: Optional[float]
+
+    def save(self, path: Union[str, Path]) -> None:
+        if isinstance(path, str):
+            path = Path(path)
+
+        with path.open("w", encoding="UTF-8") as out_file:
+            json.dump(asdict(self), out_file, indent=2)
+
+    @classmethod
+    def load(cls, path: Union[str, Path]) -> "TuningResult":
+        if isinstance(path, str):
+            path = Path(path)
+
+        with path.open("r", encoding="UTF-8") as in_file:
+            result = json.load(in_file)
+        result["best"] = Trial(**result["best"])
+        result["pareto"] = [Trial(**trial) for trial in result["pareto"]]
+        result["trials"] = [Trial(**trial) for trial in result["trials"]]
+        return cls(**result)
+
+
+class Tuner:
+    """
+    Tunes index options for the embeddings they'll actually hold. Builds an index of a sample of the real vectors with
+    every combination of options in a grid, times held-out queries against each one at a time and measures their recall
+    against an exact search. Then picks the fastest Pareto optimal options that reach the recall target, or the most
+    accurate ones within the latency budget.
+
+    Searches get slower as the index grows, so the latencies of a sample are a lower bound for the full index. Tune with
+    as large a sample as is practical.
+
+    Args:
+        grids (Optional[Mapping[str, Mapping[str, Sequence[Any]]]]): the values to try for each option of each index type. Defaults to DEFAULT_GRIDS.
+        k (int): how many neighbors each query searches for
+        sample_size (int): the most vectors to index
+        query_count (int): how many vectors to hold out of the sample as queries when no queries are given
+        min_recall (Optional[float]): the recall to reach. If neither target is given, it's DEFAULT_MIN_RECALL.
+        max_latency_ms (Optional[float]): the p95 latency in milliseconds to stay within
+        seed (int): seeds the choice of sample and queries
+        report (Optional[Callable[[str], None]]): where to report each trial
+    """
+
+    DEFAULT_K: int = 10
+    DEFAULT_SAMPLE_SIZE: int = 10000
+    DEFAULT_QUERY_COUNT: int = 200
+    DEFAULT_MIN_RECALL: float = 0.95
+
+    def __init__(
+        self,
+        grids: Optional[Mapping[str, Mapping[str, Sequence[Any]]]] = None,
+        k: int = DEFAULT_K,
+        sample_size: int = DEFAULT_SAMPLE_SIZE,
+        query_count: int = DEFAULT_QUERY_COUNT,
+        min_recall: Optional[float] = None,
+        max_latency_ms: Optional[float] = None,
+        seed: int = 0,
+        report: Optional[Callable[[str], None]] = None,
+    ) -> None:
+        self._grids: Mapping[str, Mapping[str, Sequence[Any]]] = (
+            grids if grids is not None else DEFAULT_GRIDS
+        )
+        self._k: int = k
+        self._sample_size: int = sample_size
+        self._query_count: int = query_count
+        self._min_recall: Optional[float] = (
+            self.DEFAULT_MIN_RECALL
+            if min_recall is None and max_latency_ms is None
+            else min_recall
+        )
+        self._max_latency_ms: Optional[float] = max_latency_ms
+        self._seed: int = seed
+        self._report: Optional[Callable[[str], None]] = report
+
+    def tune(
+        self,
+        vectors: np.ndarray,
+        index_types: Sequence[str] = ("descent", "balltree"),
+        queries: Optional[np.ndarray] = None,
+        fixed: Optional[Mapping[str, Any]] = None,
+    ) -> TuningResult:
+        """
+        Args:
+            vectors (np.ndarray): the vectors the index will hold
+            index_types (Sequence[str]): the index backends to try
+            queries (Optional[np.ndarray]): the queries to time. If None, query_count of the vectors are held out instead.
+            fixed (Optional[Mapping[str, Any]]): options to use as they are in every trial rather than tune
+        """
+        order = np.random.default_rng(self._seed).permutation(len(vectors))
+        if queries is None:
+            queries = vectors[order[: self._query_count]]
+            order = order[self._query_count :]
+        sample = np.asarray(
+            vectors[np.sort(order[: self._sample_size])], dtype=np.float32
+        )
+        queries = np.asarray(queries, dtype=np.float32)
+        if len(sample) < self._k or len(queries) == 0:
+            raise ValueError(
+                f"Tuning needs at least {self._k} vectors to index and one to query"
+            )
+
+        exact = exact_neighbors(sample, queries, self._k)
+        trials: List[Trial] = []
+        for index_type in index_types:
+            trials.extend(
+                self._trials(index_type, sample, queries, exact, dict(fixed or {}))
+            )
+
+        best, target_met = self.choose(trials)
+        return TuningResult(
+            best=best,
+            target_met=target_met,
+            pareto=pareto_front(trials),
+            trials=trials,
+            k=self._k,
+            sample_size=len(sample),
+            queries=len(queries),
+            min_recall=self._min_recall,
+            max_latency_ms=self._max_latency_ms,
+        )
+
+    def choose(self, trials: Sequence[Trial]) -> Tuple[Trial, bool]:
+        """
+        Chooses the best of the trials for the targets.
+
+        Returns:
+            The best trial and whether it meets the targets. If none do, it's the most accurate trial when there's a
+            recall target and the fastest when there's only a latency budget.
+        """
+        front = pareto_front(trials)
+        if not front:
+            raise ValueError("There are no trials to choose from")
+
+        meeting = [
+            trial
+            for trial in front
+            if (self._min_recall is None or trial.recall >= self._min_recall)
+            and (self._max_latency_ms is None or trial.p95_ms <= self._max_latency_ms)
+        ]
+        # The front runs from fastest to most accurate
+        if meeting:
+            return (meeting[0] if self._min_recall is not None else meeting[-1]), True
+        return (front[-1] if self._min_recall is not None else front[0]), False
+
+    def _trials(
+        self,
+        index_type: str,
+        sample: np.ndarray,
+        queries: np.ndarray,
+        exact: List[Set[int]],
+        fixed: Dict[str, Any],
+    ) -> Iterator[Trial]:
+        grid = {
+            name: values
+            for name, values in self._grids.get(index_type, {}).items()
+            if name not in fixed
+        }
+        search_names = [
+            name for name in grid if name in SEARCH_OPTIONS.get(index_type, ())
+        ]
+        build_names = [name for name in grid if name not in search_names]
+
+        for build_values in itertools.product(*(grid[name] for name in build_names)):
+            build_options = {**fixed, **dict(zip(build_names, build_values))}
+            start = time.perf_counter()
+            index = index_class(index_type).create(sample, **build_options)
+            build_seconds = time.perf_counter() - start
+
+            for search_values in itertools.product(
+                *(grid[name] for name in search_names)
+            ):
+                search_options = dict(zip(search_names, search_values))
+                for name, value in search_options.items():
+                    setattr(index, name, value)
+                recall, p95_ms, mean_ms = self._measure(index, queries, exact)
+                trial = Trial(
+                    index_type=index_type,
+                    options={**build_options, **search_options},
+                    recall=recall,
+                    p95_ms=p95_ms,
+                    mean_ms=mean_ms,
+                    build_seconds=build_seconds,
+                )
+                if self._report is not None:
+                    self._report(
+                        f"{index_type} {json.dumps(trial.options)}: recall {recall:.3f},"
+                        f" p95 {p95_ms:.2f}ms, mean {mean_ms:.2f}ms"
+                    )
+                yield trial
+
+    def _measure(
+        self, index: NearestNeighbors, queries: np.ndarray, exact: List[Set[int]]
+    ) -> Tuple[float, float, float]:
+        # The first search can compile or page in code, which shouldn't count towards the latency
+        index.nearest_neighbors(queries[:1], k=self._k)
+
+        latencies = np.empty(len(queries))
+        found = 0
+        for row, query in enumerate(queries):
+            start = time.perf_counter()
+            neighbors = index.nearest_neighbors(query[np.newaxis], k=self._k)[0]
+            latencies[row] = time.perf_counter() - start
+            found += len(
+                exact[row].intersection(neighbor.index for neighbor in neighbors)
+            )
+
+        return (
+            found / (len(queries) * self._k),
+            float(np.percentile(latencies, 95)) * 1000.0,
+            float(latencies.mean()) * 1000.0,
+        )
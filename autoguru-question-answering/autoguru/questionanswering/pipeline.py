@@ -0,0 +1,397 @@
+import queue
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence
+
+import numpy as np
+
+from autoguru.questionanswering.answers import AnswerLookup, AnswerMatch
+from autoguru.questionanswering.embeddings import Embedder
+from autoguru.questionanswering.lexical import HybridSearch, LexicalMatches
+from autoguru.questionanswering.nearestneighbors import (
+    NearestNeighbors,
+    Neighbor,
+    RowFilter,
+)
+from autoguru.questionanswering.questionclassification import (
+    DEFAULT_MIN_CONFIDENCE,
+    QuestionClassification,
+    QuestionClassifier,
+    is_answerable,
+)
+from autoguru.questionanswering.utilities.instrumentation import QUEUE_DEPTH
+
+# How often blocked workers check whether the pipeline is stopping
+_POLL_INTERVAL: float = 0.1
+
+
+@dataclass
+class StageOptions:
+    """
+    Args:
+        batch_size (int): the most questions the stage handles at once
+        workers (int): how many threads run the stage. More than one only helps if the stage releases the GIL, which TensorFlow, numpy and the index backends mostly do.
+        max_wait (float): how many seconds a worker waits for a batch to fill once it has a question
+    """
+
+    batch_size: int = 64
+    workers: int = 1
+    max_wait: float = 0.005
+
+
+@dataclass
+class AnsweredQuestion:
+    question: str
+    classification: Optional[QuestionClassification]
+    answers: List[AnswerMatch]
+
+
+@dataclass
+class _Item:
+    position: int
+    question: str
+    classification: Optional[QuestionClassification] = None
+    answerable: bool = True
+    vector: Optional[np.ndarray] = None
+    lexical: Optional[LexicalMatches] = None
+    # Set once the question's neighbors are found, which the lexical search can do before it's embedded
+    searched: bool = False
+    neighbors: Sequence[Neighbor] = field(default_factory=list)
+    answers: List[AnswerMatch] = field(default_factory=list)
+
+
+class _Done:
+    pass
+
+
+_DONE = _Done()
+
+
+class _Stage:
+    def __init__(
+        self,
+        name: str,
+        process: Callable[[List[_Item]], None],
+        options: StageOptions,
+        inputs: "queue.Queue",
+        outputs: "queue.Queue",
+        stopping: threading.Event,
+        fail: Callable[[BaseException], None],
+    ) -> None:
+        self.name: str = name
+        self._process: Callable[[List[_Item]], None] = process
+        self._options: StageOptions = options
+        self._inputs: queue.Queue = inputs
+        self._outputs: queue.Queue = outputs
+        self._stopping: threading.Event = stopping
+        self._fail: Callable[[BaseException], None] = fail
+        self._running: int = options.workers
+        self._lock: threading.Lock = threading.Lock()
+        self._depth = QUEUE_DEPTH.labels(f"pipeline_{name}")
+        self.threads: List[threading.Thread] = [
+            threading.Thread(
+                target=self._work, name=f"pipeline-{name}-{worker}", daemon=True
+            )
+            for worker in range(options.workers)
+        ]
+
+    def _work(self) -> None:
+        try:
+            while True:
+                batch = self._next_batch()
+                if batch is None:
+                    break
+                self._process(batch)
+                for item in batch:
+                    _put(self._outputs, item, self._stopping)
+        except BaseException as error:
+            self._fail(error)
+        finally:
+            with self._lock:
+                self._running -= 1
+                last = self._running == 0
+            # The last worker out tells the next stage there's nothing more coming
+            if last:
+                _put(self._outputs, _DONE, self._stopping)
+
+    def _next_batch(self) -> Optional[List[_Item]]:
+        first = _get(self._inputs, self._stopping, timeout=None)
+        if first is _DONE:
+            # Leave it for this stage's other workers
+            _put(self._inputs, _DONE, self._stopping)
+            return None
+        if first is None:
+            return None
+
+        batch = [first]
+        deadline = time.perf_counter() + self._options.max_wait
+        while len(batch) < self._options.batch_size:
+            item = _get(
+                self._inputs,
+                self._stopping,
+                timeout=max(deadline - time.perf_counter(), 0.0),
+            )
+            if item is _DONE:
+                _put(self._inputs, _DONE, self._stopping)
+                break
+            if item is None:
+                break
+            batch.append(item)
+        self._depth.set(self._inputs.qsize())
+        return batch
+
+
+def _put(target: "queue.Queue", item: object, stopping: threading.Event) -> None:
+    while not stopping.is_set():
+        try:
+            target.put(item, timeout=_POLL_INTERVAL)
+            return
+        except queue.Full:
+            continue
+
+
+def _get(
+    source: "queue.Queue", stopping: threading.Event, timeout: Optional[float]
+) -> object:
+    """
+    Gets the next item, or None if the timeout passes or the pipeline is stopping first. A None timeout waits until
+    there is an item or the pipeline stops.
+    """
+    deadline = None if timeout is None else time.perf_counter() + timeout
+    while not stopping.is_set():
+        wait = _POLL_INTERVAL
+        if deadline is not None:
+            wait = min(wait, deadline - time.perf_counter())
+            if wait <= 0:
+                try:
+                    return source.get_nowait()
+                except queue.Empty:
+                    return None
+        try:
+            return source.get(timeout=wait)
+        except queue.Empty:
+            continue
+    return None
+
+
+class QuestionAnsweringPipeline:
+    """
+    Answers a stream of questions through classify -> embed -> nearest neighbors -> answer lookup, with each stage
+    running in its own threads and handing questions to the next through a bounded queue. Batch N+1 can be classified
+    while batch N is embedded and batch N-1 searched, so throughput approaches that of the slowest stage rather than the
+    sum of all of them, and each stage batches at the size that suits it.
+
+    With a hybrid search, the embed stage searches the lexical index first and only embeds the questions it can't
+    answer by itself, and the nearest neighbors stage fuses both rankings.
+
+    Questions the classifier doesn't think are questions pass through the later stages untouched and get no answers.
+
+    Args:
+        embedder (Embedder): embeds the questions for the index
+        index (NearestNeighbors): the index of known questions
+        answers (AnswerLookup): maps index rows to answers
+        classifier (Optional[QuestionClassifier]): the question gate. If None, every question is answered.
+        k (int): how many answers to find for each question
+        answer_all (bool): whether to answer text the classifier doesn't think is a question
+        min_confidence (float): how confident the classifier has to be that text is a question
+        classify (StageOptions): how the classify stage batches and how many threads run it
+        embed (StageOptions): how the embed stage batches and how many threads run it
+        nearest_neighbors (StageOptions): how the index search batches and how many threads run it
+        answer (StageOptions): how the answer lookup batches and how many threads run it
+        queue_size (int): how many questions can wait in front of each stage. Reading the input pauses when the first queue is full.
+        hybrid (Optional[HybridSearch]): if given, also searches the questions' words and fuses the results
+        allowed (Optional[RowFilter]): if given, only these rows of the index are matched
+    """
+
+    DEFAULT_MIN_CONFIDENCE: float = DEFAULT_MIN_CONFIDENCE
+    DEFAULT_QUEUE_SIZE: int = 1024
+
+    def __init__(
+        self,
+        embedder: Embedder,
+        index: NearestNeighbors,
+        answers: AnswerLookup,
+        classifier: Optional[QuestionClassifier] = None,
+        k: int = 1,
+        answer_all: bool = False,
+        min_confidence: float = DEFAULT_MIN_CONFIDENCE,
+        classify: Optional[StageOptions] = None,
+        embed: Optional[StageOptions] = None,
+        nearest_neighbors: Optional[StageOptions] = None,
+        answer: Optional[StageOptions] = None,
+        queue_size: int = DEFAULT_QUEUE_SIZE,
+        hybrid: Optional[HybridSearch] = None,
+        allowed: Optional[RowFilter] = None,
+    ) -> None:
+        self._embedder: Embedder = embedder
+        self._index: NearestNeighbors = index
+        self._answers: AnswerLookup = answers
+        self._classifier: Optional[QuestionClassifier] = classifier
+        self._k: int = k
+        self._answer_all: bool = answer_all
+        self._min_confidence: float = min_confidence
+        self._options: Dict[str, StageOptions] = {
+            "classify": classify or StageOptions(),
+            "embed": embed or StageOptions(),
+            "nearest_neighbors": nearest_neighbors or StageOptions(),
+            "answer": answer or StageOptions(),
+        }
+        self._queue_size: int = queue_size
+        self._hybrid: Optional[HybridSearch] = hybrid
+        self._allowed: Optional[RowFilter] = allowed
+
+    def _classify(self, batch: List[_Item]) -> None:
+        if self._classifier is None:
+            return
+        classifications = self._classifier.classify(
+            [item.question for item in batch], k=1
+        )
+        for item, classification in zip(batch, classifications):
+            item.classification = classification[0]
+            item.answerable = is_answerable(
+                item.classification, self._min_confidence, self._answer_all
+            )
+
+    def _embed(self, batch: List[_Item]) -> None:
+        answerable = [item for item in batch if item.answerable]
+        if not answerable:
+            return
+        if self._hybrid is not None:
+            matches = self._hybrid.match(
+                [item.question for item in answerable],
+                k=self._k,
+                allowed=self._allowed,
+            )
+            for item, item_matches in zip(answerable, matches):
+                item.lexical = item_matches
+                neighbors = self._hybrid.short_circuit(item_matches, k=self._k)
+                if neighbors is not None:
+                    item.neighbors = neighbors
+                    item.searched = True
+            answerable = [item for item in answerable if not item.searched]
+            if not answerable:
+                return
+        vectors = self._embedder.embed([item.question for item in answerable])
+        for item, vector in zip(answerable, vectors):
+            item.vector = vector
+
+    def _search(self, batch: List[_Item]) -> None:
+        answerable = [item for item in batch if item.answerable and not item.searched]
+        if not answerable:
+            return
+        neighbors = self._index.nearest_neighbors(
+            np.stack([item.vector for item in answerable]),
+            k=(
+                self._hybrid.candidates(self._k, self._allowed)
+                if self._hybrid is not None
+                else self._k
+            ),
+            allowed=self._allowed,
+        )
+        for item, item_neighbors in zip(answerable, neighbors):
+            if self._hybrid is not None and item.lexical is not None:
+                item.neighbors = self._hybrid.fuse(
+                    item_neighbors, item.lexical, k=self._k
+                )
+                item.lexical = None
+            else:
+                item.neighbors = item_neighbors
+            item.searched = True
+            # The vector isn't needed anymore, so it doesn't have to be held until the question comes out
+            item.vector = None
+
+    def _answer(self, batch: List[_Item]) -> None:
+        answerable = [item for item in batch if item.answerable]
+        if not answerable:
+            return
+        for item, matches in zip(
+            answerable,
+            self._answers.answers([item.neighbors for item in answerable]),
+        ):
+            item.answers = matches
+
+    def run(self, questions: Iterable[str]) -> Iterator[AnsweredQuestion]:
+        """
+        Answers questions as they're read, yielding the results in input order. The input is read from another thread,
+        and at most about queue_size questions per stage are read ahead of the results, so it can be an unbounded stream.
+
+        If a stage fails, the pipeline stops and the error is raised here.
+        """
+        stopping = threading.Event()
+        errors: List[BaseException] = []
+
+        def fail(error: BaseException) -> None:
+            errors.append(error)
+            stopping.set()
+
+        processes = [
+            ("classify", self._classify),
+            ("embed", self._embed),
+            ("nearest_neighbors", self._search),
+            ("answer", self._answer),
+        ]
+        queues: List[queue.Queue] = [
+            queue.Queue(maxsize=self._queue_size) for _ in range(len(processes) + 1)
+        ]
+        stages = [
+            _Stage(
+                name=name,
+                process=process,
+                options=self._options[name],
+                inputs=queues[i],
+                outputs=queues[i + 1],
+                stopping=stopping,
+                fail=fail,
+            )
+            for i, (name, process) in enumerate(processes)
+        ]
+
+        def feed() -> None:
+            try:
+                for position, question in enumerate(questions):
+                    if stopping.is_set():
+                        return
+                    _put(
+                        queues[0], _Item(position=position, question=question), stopping
+                    )
+            except BaseException as error:
+                fail(error)
+            finally:
+                _put(queues[0], _DONE, stopping)
+
+        threads = [thread for stage in stages for thread in stage.threads]
+        for thread in threads:
+            thread.start()
+        # The input thread isn't joined since it may be blocked reading the input. It stops at the next question.
+        threading.Thread(target=feed, name="pipeline-input", daemon=True).start()
+
+        # Stages with several workers can finish questions out of order, so early ones wait here for the ones before
+        waiting: Dict[int, _Item] = {}
+        position = 0
+        try:
+            while True:
+                item = _get(queues[-1], stopping, timeout=None)
+                if item is None or item is _DONE:
+                    break
+                assert isinstance(item, _Item)
+                waiting[item.position] = item
+                while position in waiting:
+                    ready = waiting.pop(position)
+                    position += 1
+                    yield AnsweredQuestion(
+                        question=ready.question,
+                        classification=ready.classification,
+                        answers=ready.answers,
+                    )
+        finally:
+            # Stops the threads if the caller stopped iterating early or something failed
+            stopping.set()
+            for thread in threads:
+                thread.join()
+
+        if errors:
+            raise errors[0]
+
+    def answer(self, questions: Sequence[str]) -> List[AnsweredQuestion]:
+        return list(self.run(questions))
@@ -1,11 +1,15 @@
 from autoguru.questionanswering.questionclassification.model import (
+    DEFAULT_MIN_CONFIDENCE,
     QuestionClass,
     QuestionClassification,
     QuestionClassifier,
+    is_answerable,
 )
 
 __all__ = [
+    "DEFAULT_MIN_CONFIDENCE",
     "QuestionClass",
     "QuestionClassification",
     "QuestionClassifier",
+    "is_answerable",
 ]
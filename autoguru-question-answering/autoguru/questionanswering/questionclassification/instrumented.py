@@ -0,0 +1,35 @@
+from typing import Iterable, List, Union
+
+from autoguru.questionanswering.questionclassification.model import (
+    QuestionClassification,
+    QuestionClassifier,
+)
+from autoguru.questionanswering.utilities.instrumentation import (
+    STAGE_BATCH_SIZE,
+    STAGE_LATENCY,
+)
+
+
+class InstrumentedQuestionClassifier(QuestionClassifier):
+    DEFAULT_STAGE: str = "classify"
+
+    def __init__(
+        self, classifier: QuestionClassifier, stage: str = DEFAULT_STAGE
+    ) -> None:
+        self._classifier: QuestionClassifier = classifier
+        self._latency = STAGE_LATENCY.labels(stage)
+        self._batch_size = STAGE_BATCH_SIZE.labels(stage)
+
+    def classify(
+        self, questions: Union[str, Iterable[str]], k: int = 1
+    ) -> List[List[QuestionClassification]]:
+        with self._latency.time():
+            classifications = self._classifier.classify(questions, k=k)
+        self._batch_size.observe(len(classifications))
+        return classifications
+
+    @classmethod
+    def create(
+        cls, classifier: QuestionClassifier, stage: str = DEFAULT_STAGE
+    ) -> "InstrumentedQuestionClassifier":
+        return cls(classifier=classifier, stage=stage)
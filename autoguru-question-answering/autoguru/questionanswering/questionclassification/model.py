@@ -1,7 +1,10 @@
 from abc import ABC, abstractmethod
 from dataclasses import dataclass
 from enum import Enum, auto
-from typing import Any, Iterable, List, Union, no_type_check
+from typing import Any, Iterable, List, Optional, Union, no_type_check
+
+# How confident the classifier has to be that text is a question for it to be answered
+DEFAULT_MIN_CONFIDENCE: float = 0.5
 
 
 class QuestionClass(Enum):
@@ -15,6 +18,25 @@ class QuestionClassification:
     confidence: float
 
 
+def is_answerable(
+    classification: Optional[QuestionClassification],
+    min_confidence: float = DEFAULT_MIN_CONFIDENCE,
+    answer_all: bool = False,
+) -> bool:
+    """
+    The question gate every frontend answers through. Text is answered if it wasn't classified, if the classifier is
+    at least min_confidence sure it's a question, or if everything is being answered.
+    """
+    return (
+        answer_all
+        or classification is None
+        or (
+            classification.classification is QuestionClass.QUESTION
+            and classification.confidence >= min_confidence
+        )
+    )
+
+
 class QuestionClassifier(ABC):
     @abstractmethod
     def classify(
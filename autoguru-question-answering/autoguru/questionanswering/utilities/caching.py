@@ -0,0 +1,84 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Generic, Hashable, Optional, Tuple, TypeVar, Union
+
+from autoguru.questionanswering.utilities.instrumentation import CACHE_REQUESTS
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+D = TypeVar("D")
+
+
+class TTLCache(Generic[K, V]):
+    """
+    A thread-safe LRU cache whose entries also expire after a time to live.
+
+    Args:
+        max_size (int): the most entries to keep. The least recently used entry is evicted to make room for a new one.
+        ttl (Optional[float]): the default number of seconds an entry lives for. If None, entries only leave by eviction.
+        name (Optional[str]): if given, hits and misses are recorded in the autoguru_cache_requests_total metric under this name
+    """
+
+    def __init__(
+        self, max_size: int, ttl: Optional[float] = None, name: Optional[str] = None
+    ) -> None:
+        self._max_size: int = max_size
+        self._ttl: Optional[float] = ttl
+        self._entries: "OrderedDict[K, Tuple[Optional[float], V]]" = OrderedDict()
+        self._lock: threading.Lock = threading.Lock()
+        self._hits = CACHE_REQUESTS.labels(name, "hit") if name is not None else None
+        self._misses = CACHE_REQUESTS.labels(name, "miss") if name is not None else None
+
+    @property
+    def max_size(self) -> int:
+        return self._max_size
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: K) -> bool:
+        return self._lookup(key, record=False) is not None
+
+    def get(self, key: K, default: Optional[D] = None) -> Union[V, Optional[D]]:
+        entry = self._lookup(key, record=True)
+        return entry[1] if entry is not None else default
+
+    def set(self, key: K, value: V, ttl: Optional[float] = None) -> None:
+        if ttl is None:
+            ttl = self._ttl
+        expires = time.monotonic() + ttl if ttl is not None else None
+        with self._lock:
+            self._entries[key] = (expires, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+
+    def expires(self, key: K) -> Optional[float]:
+        """
+        Gets the monotonic time the entry for a key expires at, or None if it doesn't exist or never expires.
+        """
+        entry = self._lookup(key, record=False)
+        return entry[0] if entry is not None else None
+
+    def delete(self, key: K) -> bool:
+        with self._lock:
+            return self._entries.pop(key, None) is not None
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def _lookup(self, key: K, record: bool) -> Optional[Tuple[Optional[float], V]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] is not None and entry[0] <= time.monotonic():
+                    del self._entries[key]
+                    entry = None
+                else:
+                    self._entries.move_to_end(key)
+
+        if record and self._hits is not None:
+            (self._hits if entry is not None else self._misses).inc()
+        return entry
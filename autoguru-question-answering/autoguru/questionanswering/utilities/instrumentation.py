@@ -0,0 +1,522 @@
+import bisect
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from pathlib import Path
+from typing import (
+    Dict,
+    Generic,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    TypeVar,
+    Union,
+)
+
+DEFAULT_LATENCY_BUCKETS: Tuple[float, ...] = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+DEFAULT_SIZE_BUCKETS: Tuple[float, ...] = tuple(float(2**power) for power in range(11))
+
+
+Sample = Tuple[str, Sequence[Tuple[str, str]], float]
+
+# Each process's samples are written to <pid>.json in the metrics directory
+_PROCESS_FILE_SUFFIX: str = ".json"
+
+
+def _escape_label_value(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _escape_help(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("\n", "\\n")
+
+
+def _format_labels(labels: Sequence[Tuple[str, str]]) -> str:
+    if not labels:
+        return ""
+    return (
+        "{"
+        + ",".join(f'{name}="{_escape_label_value(value)}"' for name, value in labels)
+        + "}"
+    )
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+class _CounterValue:
+    __slots__ = ["_lock", "_value"]
+
+    def __init__(self) -> None:
+        self._lock: threading.Lock = threading.Lock()
+        self._value: float = 0.0
+
+    def inc(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self._value += amount
+
+    @property
+    def value(self) -> float:
+        return self._value
+
+
+class _GaugeValue:
+    __slots__ = ["_value"]
+
+    def __init__(self) -> None:
+        self._value: float = 0.0
+
+    def set(self, value: float) -> None:
+        self._value = value
+
+    @property
+    def value(self) -> float:
+        return self._value
+
+
+class _HistogramValue:
+    __slots__ = ["_lock", "_buckets", "_counts", "_sum", "_count", "_span"]
+
+    def __init__(self, buckets: Tuple[float, ...], span: Optional[str] = None) -> None:
+        self._lock: threading.Lock = threading.Lock()
+        self._buckets: Tuple[float, ...] = buckets
+        self._counts: List[int] = [0] * (len(buckets) + 1)
+        self._sum: float = 0.0
+        self._count: int = 0
+        self._span: Optional[str] = span
+
+    def observe(self, value: float) -> None:
+        index = bisect.bisect_left(self._buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+            self._count += 1
+
+    @contextmanager
+    def time(self) -> Iterator[None]:
+        with SPANS.span(self._span):
+            start = time.perf_counter()
+            try:
+                yield
+            finally:
+                self.observe(time.perf_counter() - start)
+
+    def snapshot(self) -> Tuple[List[int], float, int]:
+        with self._lock:
+            return list(self._counts), self._sum, self._count
+
+
+V = TypeVar("V", _CounterValue, _GaugeValue, _HistogramValue)
+
+
+class _Metric(Generic[V]):
+    TYPE: str = "untyped"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()) -> None:
+        self.name: str = name
+        self.help: str = help
+        self._label_names: Tuple[str, ...] = tuple(labels)
+        self._values: Dict[Tuple[str, ...], V] = {}
+        self._lock: threading.Lock = threading.Lock()
+        REGISTRY.register(self)
+
+    def _create_value(self, values: Tuple[str, ...]) -> V:
+        raise NotImplementedError
+
+    def labels(self, *values: str) -> V:
+        """
+        Gets the value for a combination of labels. Callers on a hot path should look this up once and keep it.
+        """
+        try:
+            return self._values[values]
+        except KeyError:
+            if len(values) != len(self._label_names):
+                raise ValueError(
+                    f"{self.name} expects labels {self._label_names}, got {values}"
+                )
+            with self._lock:
+                return self._values.setdefault(values, self._create_value(values))
+
+    def _samples(self) -> Iterator[Sample]:
+        raise NotImplementedError
+
+    def _merge(self, samples: Dict[int, List[Sample]]) -> Iterator[Sample]:
+        """
+        Combines the samples each process wrote into one series per label combination, adding them up.
+
+        Args:
+            samples (Dict[int, List[Sample]]): each process's samples by its pid
+        """
+        totals: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float] = {}
+        for process_samples in samples.values():
+            for name, labels, value in process_samples:
+                key = (
+                    name,
+                    tuple((label, label_value) for label, label_value in labels),
+                )
+                totals[key] = totals.get(key, 0.0) + value
+        for (name, labels), value in totals.items():
+            yield name, list(labels), value
+
+    def render(self, samples: Optional[Iterable[Sample]] = None) -> str:
+        """
+        Args:
+            samples (Optional[Iterable[Sample]]): the samples to render. Defaults to this process's.
+        """
+        lines = [
+            f"# HELP {self.name} {_escape_help(self.help)}",
+            f"# TYPE {self.name} {self.TYPE}",
+        ]
+        for name, labels, value in samples if samples is not None else self._samples():
+            lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines)
+
+
+class Counter(_Metric[_CounterValue]):
+    TYPE: str = "counter"
+
+    def _create_value(self, values: Tuple[str, ...]) -> _CounterValue:
+        return _CounterValue()
+
+    def _samples(self) -> Iterator[Sample]:
+        for values, counter in list(self._values.items()):
+            yield self.name, list(zip(self._label_names, values)), counter.value
+
+
+class Gauge(_Metric[_GaugeValue]):
+    TYPE: str = "gauge"
+
+    def _create_value(self, values: Tuple[str, ...]) -> _GaugeValue:
+        return _GaugeValue()
+
+    def _merge(self, samples: Dict[int, List[Sample]]) -> Iterator[Sample]:
+        # Memory and queue depths don't add up across processes, so each process keeps its own series
+        for pid, process_samples in sorted(samples.items()):
+            for name, labels, value in process_samples:
+                yield name, list(labels) + [("pid", str(pid))], value
+
+    def _samples(self) -> Iterator[Sample]:
+        for values, gauge in list(self._values.items()):
+            yield self.name, list(zip(self._label_names, values)), gauge.value
+
+
+class Histogram(_Metric[_HistogramValue]):
+    """
+    Args:
+        name (str): the metric's name
+        help (str): what the metric measures
+        labels (Sequence[str]): the names of the metric's labels
+        buckets (Tuple[float, ...]): the upper bounds of the buckets
+        span (Optional[str]): if given, time() also records a span while SPANS is recording. This is formatted with the label values to name the span, like "db.{}".
+    """
+
+    TYPE: str = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labels: Sequence[str] = (),
+        buckets: Tuple[float, ...] = DEFAULT_LATENCY_BUCKETS,
+        span: Optional[str] = None,
+    ) -> None:
+        self._buckets: Tuple[float, ...] = tuple(sorted(buckets))
+        self._span: Optional[str] = span
+        super(Histogram, self).__init__(name=name, help=help, labels=labels)
+
+    def _create_value(self, values: Tuple[str, ...]) -> _HistogramValue:
+        return _HistogramValue(
+            self._buckets,
+            span=self._span.format(*values) if self._span is not None else None,
+        )
+
+    def _samples(self) -> Iterator[Sample]:
+        for values, histogram in list(self._values.items()):
+            labels = list(zip(self._label_names, values))
+            counts, total, count = histogram.snapshot()
+            cumulative = 0
+            for bound, bucket_count in zip(self._buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                yield f"{self.name}_bucket", labels + [
+                    ("le", _format_value(bound))
+                ], cumulative
+            yield f"{self.name}_sum", labels, total
+            yield f"{self.name}_count", labels, count
+
+
+class Registry:
+    def __init__(self) -> None:
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock: threading.Lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> None:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"A metric named {metric.name} is already registered")
+            self._metrics[metric.name] = metric
+
+    def _registered(self) -> List[_Metric]:
+        with self._lock:
+            return list(self._metrics.values())
+
+    def render(self) -> str:
+        """
+        Renders every registered metric in the Prometheus text exposition format.
+        """
+        return "\n".join(metric.render() for metric in self._registered()) + "\n"
+
+    def write(self, directory: Union[str, Path], pid: Optional[int] = None) -> None:
+        """
+        Writes this process's samples to its own file in a directory shared with the other processes serving the same
+        metrics, for render_processes() to merge. The file is replaced whole, so readers never see half of it.
+
+        Args:
+            directory (Union[str, Path]): the shared metrics directory
+            pid (Optional[int]): the process to write the samples as. Defaults to this one.
+        """
+        if isinstance(directory, str):
+            directory = Path(directory)
+
+        pid = pid if pid is not None else os.getpid()
+        samples = {
+            metric.name: [list(sample) for sample in metric._samples()]
+            for metric in self._registered()
+        }
+        staging = directory.joinpath(f".{pid}{_PROCESS_FILE_SUFFIX}.tmp")
+        staging.write_text(json.dumps(samples), encoding="UTF-8")
+        os.replace(staging, directory.joinpath(f"{pid}{_PROCESS_FILE_SUFFIX}"))
+
+    def _read(self, directory: Path) -> Dict[int, Dict[str, List[Sample]]]:
+        processes: Dict[int, Dict[str, List[Sample]]] = {}
+        for process_file in directory.glob(f"*{_PROCESS_FILE_SUFFIX}"):
+            try:
+                samples = json.loads(process_file.read_text(encoding="UTF-8"))
+            except FileNotFoundError:
+                # Removed since it was listed
+                continue
+            processes[int(process_file.stem)] = {
+                name: [
+                    (sample_name, [tuple(label) for label in labels], value)
+                    for sample_name, labels, value in metric_samples
+                ]
+                for name, metric_samples in samples.items()
+            }
+        return processes
+
+    def render_processes(self, directory: Union[str, Path]) -> str:
+        """
+        Renders every registered metric merged across all the processes that write their samples to a directory, like
+        the workers of one server. Counters and histograms are added up, and gauges keep a series per process with a pid
+        label. This process's samples are written first so they're current.
+
+        Args:
+            directory (Union[str, Path]): the shared metrics directory
+        """
+        if isinstance(directory, str):
+            directory = Path(directory)
+
+        self.write(directory)
+        processes = self._read(directory)
+        return (
+            "\n".join(
+                metric.render(
+                    metric._merge(
+                        {
+                            pid: samples.get(metric.name, [])
+                            for pid, samples in processes.items()
+                        }
+                    )
+                )
+                for metric in self._registered()
+            )
+            + "\n"
+        )
+
+    def mark_process_dead(self, directory: Union[str, Path], pid: int) -> None:
+        """
+        Drops the gauges of a process that has exited from the metrics directory, since what it measured is gone. Its
+        counters and histograms are kept so the totals never go backwards.
+
+        Args:
+            directory (Union[str, Path]): the shared metrics directory
+            pid (int): the process that exited
+        """
+        if isinstance(directory, str):
+            directory = Path(directory)
+
+        process_file = directory.joinpath(f"{pid}{_PROCESS_FILE_SUFFIX}")
+        try:
+            samples = json.loads(process_file.read_text(encoding="UTF-8"))
+        except FileNotFoundError:
+            return
+        gauges = {
+            metric.name for metric in self._registered() if isinstance(metric, Gauge)
+        }
+        staging = directory.joinpath(f".{pid}{_PROCESS_FILE_SUFFIX}.tmp")
+        staging.write_text(
+            json.dumps(
+                {name: value for name, value in samples.items() if name not in gauges}
+            ),
+            encoding="UTF-8",
+        )
+        os.replace(staging, process_file)
+
+
+@dataclass
+class Span:
+    """
+    One timed section of work.
+
+    Args:
+        path (Tuple[str, ...]): the names of the spans it was nested in, ending with its own name
+        start (float): when it started, in seconds since recording started
+        seconds (float): how long it took
+        thread (str): the name of the thread it ran in
+    """
+
+    path: Tuple[str, ...]
+    start: float
+    seconds: float
+    thread: str
+
+    @property
+    def name(self) -> str:
+        return self.path[-1]
+
+
+class SpanRecorder:
+    """
+    Records nested timings of the question answering stages, database queries and anything else wrapped in span(), but
+    only while it's recording so it costs next to nothing otherwise. Nesting follows the context, so spans from
+    concurrent asyncio tasks and threads don't get mixed up.
+    """
+
+    def __init__(self) -> None:
+        self._recording: bool = False
+        self._origin: float = 0.0
+        self._spans: List[Span] = []
+        self._lock: threading.Lock = threading.Lock()
+        self._path: ContextVar[Tuple[str, ...]] = ContextVar("span_path", default=())
+
+    @property
+    def recording(self) -> bool:
+        return self._recording
+
+    def start(self) -> None:
+        with self._lock:
+            self._spans = []
+            self._origin = time.perf_counter()
+            self._recording = True
+
+    def stop(self) -> List[Span]:
+        with self._lock:
+            self._recording = False
+            spans, self._spans = self._spans, []
+        return spans
+
+    @contextmanager
+    def span(self, name: Optional[str]) -> Iterator[None]:
+        if name is None or not self._recording:
+            yield
+            return
+
+        path = self._path.get() + (name,)
+        token = self._path.set(path)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            self._path.reset(token)
+            with self._lock:
+                if self._recording:
+                    self._spans.append(
+                        Span(
+                            path=path,
+                            start=start - self._origin,
+                            seconds=seconds,
+                            thread=threading.current_thread().name,
+                        )
+                    )
+
+
+REGISTRY: Registry = Registry()
+SPANS: SpanRecorder = SpanRecorder()
+
+STAGE_LATENCY: Histogram = Histogram(
+    "autoguru_stage_latency_seconds",
+    "Time spent in each question answering stage per batch",
+    labels=["stage"],
+    span="{}",
+)
+STAGE_BATCH_SIZE: Histogram = Histogram(
+    "autoguru_stage_batch_size",
+    "Number of items passed to each question answering stage per batch",
+    labels=["stage"],
+    buckets=DEFAULT_SIZE_BUCKETS,
+)
+DATABASE_LATENCY: Histogram = Histogram(
+    "autoguru_database_latency_seconds",
+    "Time spent executing database queries",
+    labels=["operation"],
+    span="db.{}",
+)
+CACHE_REQUESTS: Counter = Counter(
+    "autoguru_cache_requests_total",
+    "Cache lookups by cache and result (hit or miss)",
+    labels=["cache", "result"],
+)
+QUEUE_DEPTH: Gauge = Gauge(
+    "autoguru_queue_depth",
+    "Number of items waiting in each queue",
+    labels=["queue"],
+)
+PROCESS_MEMORY: Gauge = Gauge(
+    "autoguru_process_memory_bytes",
+    "Memory of this process by kind of page (rss, pss, shared, private or swap)",
+    labels=["kind"],
+)
+COMPONENT_MEMORY: Gauge = Gauge(
+    "autoguru_component_memory_bytes",
+    "Memory reachable from each loaded component by kind (objects, arrays, mapped or tensors)",
+    labels=["component", "kind"],
+)
+INDEX_REGISTRY_EVENTS: Counter = Counter(
+    "autoguru_index_registry_events_total",
+    "Index registry lookups by registry and event (hit, load, shared, failure or evict)",
+    labels=["registry", "event"],
+)
+INDEX_REGISTRY_MEMORY: Gauge = Gauge(
+    "autoguru_index_registry_memory_bytes",
+    "Memory of the indexes each index registry holds",
+    labels=["registry"],
+)
+LEXICAL_SHORT_CIRCUITS: Counter = Counter(
+    "autoguru_lexical_short_circuits_total",
+    "Questions answered from the lexical index alone, without embedding them",
+)
@@ -0,0 +1,410 @@
+import mmap
+import os
+import re
+import resource
+import sys
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field, fields
+from pathlib import Path
+from types import BuiltinFunctionType, FunctionType, MethodType, ModuleType
+from typing import Any, Dict, Iterator, List, Mapping, Optional, Set
+
+import numpy as np
+
+from autoguru.questionanswering.utilities.instrumentation import (
+    COMPONENT_MEMORY,
+    PROCESS_MEMORY,
+)
+
+_PROC: Path = Path("/proc/self")
+# The kB fields of /proc/self/smaps and what they count towards
+_SMAPS_FIELDS: Dict[str, str] = {
+    "Rss": "rss",
+    "Pss": "pss",
+    "Shared_Clean": "shared",
+    "Shared_Dirty": "shared",
+    "Private_Clean": "private",
+    "Private_Dirty": "private",
+    "Swap": "swap",
+}
+_MAPPING_HEADER = re.compile(r"^[0-9a-f]+-[0-9a-f]+ ")
+# Objects from these packages are either measured specially or not worth walking into
+_TENSORFLOW_MODULES = ("tensorflow", "keras", "tf_keras")
+_OPAQUE_MODULES = ("numba", "llvmlite", "_thread", "threading", "asyncio")
+_SKIPPED_TYPES = (type, ModuleType, FunctionType, BuiltinFunctionType, MethodType)
+
+
+@dataclass
+class Pages:
+    """
+    Memory in bytes by kind of page. Shared pages are also mapped by another process, like a library or a memory mapped
+    file open elsewhere, and PSS splits each shared page evenly between the processes mapping it.
+    """
+
+    rss: int = 0
+    pss: int = 0
+    shared: int = 0
+    private: int = 0
+    swap: int = 0
+
+    def __add__(self, other: "Pages") -> "Pages":
+        return Pages(
+            **{
+                kind.name: getattr(self, kind.name) + getattr(other, kind.name)
+                for kind in fields(self)
+            }
+        )
+
+    def __sub__(self, other: "Pages") -> "Pages":
+        return Pages(
+            **{
+                kind.name: getattr(self, kind.name) - getattr(other, kind.name)
+                for kind in fields(self)
+            }
+        )
+
+
+def _read_smaps_fields(lines: Iterator[str], pages: Pages) -> None:
+    for line in lines:
+        name, _, value = line.partition(":")
+        kind = _SMAPS_FIELDS.get(name)
+        if kind is not None:
+            setattr(pages, kind, getattr(pages, kind) + int(value.split()[0]) * 1024)
+
+
+def process_memory() -> Pages:
+    """
+    Measures this process's memory. Only Linux reports shared and private pages; elsewhere only the peak RSS is known.
+    """
+    pages = Pages()
+    try:
+        with _PROC.joinpath("smaps_rollup").open("r", encoding="UTF-8") as in_file:
+            _read_smaps_fields(iter(in_file), pages)
+        return pages
+    except OSError:
+        pass
+
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    pages.rss = peak if sys.platform == "darwin" else peak * 1024
+    return pages
+
+
+def mapped_files() -> Dict[str, Pages]:
+    """
+    Measures the memory of each file this process has mapped, like libraries and memory mapped arrays. Anonymous
+    memory, which holds the Python heap, array buffers and TensorFlow's allocations, is under "[anonymous]".
+    """
+    files: Dict[str, Pages] = defaultdict(Pages)
+    try:
+        with _PROC.joinpath("smaps").open("r", encoding="UTF-8") as in_file:
+            current = files["[anonymous]"]
+            for line in in_file:
+                if _MAPPING_HEADER.match(line):
+                    parts = line.rstrip("\n").split(maxsplit=5)
+                    path = parts[5] if len(parts) > 5 else ""
+                    current = files[path if path.startswith("/") else "[anonymous]"]
+                else:
+                    _read_smaps_fields(iter([line]), current)
+    except OSError:
+        pass
+    return dict(files)
+
+
+def _mapping_kind(path: str) -> str:
+    if path == "[anonymous]":
+        return "anonymous"
+    if any(module in path for module in _TENSORFLOW_MODULES):
+        return "tensorflow"
+    if path.endswith(".so") or ".so." in path:
+        return "libraries"
+    return "files"
+
+
+@dataclass
+class Footprint:
+    """
+    The memory reachable from an object, in bytes.
+
+    Args:
+        objects (int): Python object overhead, like the dicts, lists and strings of a cache
+        arrays (int): numpy buffers in memory
+        mapped (int): numpy buffers memory mapped from files. Only the pages that have been read are resident, and they can be shared with other processes.
+        tensors (int): TensorFlow variables, like model weights. TensorFlow's own runtime allocations aren't counted.
+        files (Set[str]): the files the mapped buffers are from
+    """
+
+    objects: int = 0
+    arrays: int = 0
+    mapped: int = 0
+    tensors: int = 0
+    files: Set[str] = field(default_factory=set)
+
+    @property
+    def total(self) -> int:
+        return self.objects + self.arrays + self.mapped + self.tensors
+
+
+def _mapped_file(array: np.ndarray) -> Optional[str]:
+    while isinstance(array, np.ndarray):
+        filename = getattr(array, "filename", None)
+        if filename is not None:
+            return os.path.realpath(filename)
+        array = array.base
+    return None
+
+
+def footprint(root: Any, seen: Optional[Set[int]] = None) -> Footprint:
+    """
+    Adds up the memory of everything reachable from an object.
+
+    Args:
+        root (Any): the object to measure
+        seen (Optional[Set[int]]): the ids of objects already counted, which are skipped. Passing the same set when
+            measuring several objects counts what they share once, under the first one measured.
+    """
+    if seen is None:
+        seen = set()
+
+    result = Footprint()
+    stack = [root]
+    while stack:
+        item = stack.pop()
+        if id(item) in seen:
+            continue
+        seen.add(id(item))
+        if isinstance(item, _SKIPPED_TYPES):
+            continue
+
+        if isinstance(item, np.ndarray):
+            stack.extend(_count_array(item, result))
+            continue
+
+        module = type(item).__module__ or ""
+        if module.startswith(_TENSORFLOW_MODULES):
+            for variable in getattr(item, "variables", None) or ():
+                if id(variable) not in seen:
+                    seen.add(id(variable))
+                    result.tensors += int(np.prod(variable.shape)) * variable.dtype.size
+            continue
+        if module.startswith(_OPAQUE_MODULES):
+            continue
+
+        result.objects += sys.getsizeof(item)
+        stack.extend(_referents(item))
+    return result
+
+
+def _count_array(array: np.ndarray, result: Footprint) -> List[Any]:
+    # Views share their base's buffer, so only the array that owns it is counted
+    base = array
+    while isinstance(base.base, np.ndarray):
+        base = base.base
+    if base is not array:
+        return [base]
+
+    filename = _mapped_file(base)
+    # Arrays unpickled from buffers, like a bundle's index, are owned by a view of the map
+    owner = base.base.obj if isinstance(base.base, memoryview) else base.base
+    if filename is not None or isinstance(owner, mmap.mmap):
+        result.mapped += base.nbytes
+        if filename is not None:
+            result.files.add(filename)
+    else:
+        result.arrays += base.nbytes
+    return base.ravel().tolist() if base.dtype == object else []
+
+
+def _pickles_own_state(item: Any) -> bool:
+    get_state = getattr(type(item), "__getstate__", None)
+    return (
+        get_state is not None
+        and get_state is not getattr(object, "__getstate__", None)
+        and type(item).__module__ != "builtins"
+    )
+
+
+def _referents(item: Any) -> List[Any]:
+    referents: List[Any] = []
+    if isinstance(item, dict):
+        referents.extend(item.keys())
+        referents.extend(item.values())
+    elif isinstance(item, (list, tuple, set, frozenset, deque)):
+        referents.extend(item)
+    if getattr(item, "__dict__", None):
+        referents.append(vars(item))
+    elif _pickles_own_state(item):
+        # Extension types like scikit-learn's trees keep their arrays out of reach but hand them over to be pickled
+        referents.append(item.__getstate__())
+    for slots in (getattr(cls, "__slots__", ()) for cls in type(item).__mro__):
+        for slot in [slots] if isinstance(slots, str) else slots:
+            if hasattr(item, slot):
+                referents.append(getattr(item, slot))
+    return referents
+
+
+@dataclass
+class ComponentMemory:
+    """
+    Args:
+        name (str): the component
+        footprint (Footprint): the memory reachable from it
+        mapped_pages (Pages): the resident pages of the files its mapped buffers are from
+        loaded (Optional[Pages]): how much the process's memory grew while it was loaded, if that was tracked. This includes allocations the footprint can't see, like TensorFlow's runtime.
+    """
+
+    name: str
+    footprint: Footprint
+    mapped_pages: Pages
+    loaded: Optional[Pages] = None
+
+
+@dataclass
+class MemoryReport:
+    """
+    Args:
+        process (Pages): the memory of the whole process
+        mappings (Dict[str, Pages]): the process's memory by kind of mapping: anonymous (the heap), tensorflow, libraries and files
+        components (List[ComponentMemory]): the memory of each component
+    """
+
+    process: Pages
+    mappings: Dict[str, Pages]
+    components: List[ComponentMemory]
+
+    def to_json(self) -> Dict[str, Any]:
+        return {
+            "process": asdict(self.process),
+            "mappings": {kind: asdict(pages) for kind, pages in self.mappings.items()},
+            "components": {
+                component.name: {
+                    "objects": component.footprint.objects,
+                    "arrays": component.footprint.arrays,
+                    "mapped": component.footprint.mapped,
+                    "tensors": component.footprint.tensors,
+                    "total": component.footprint.total,
+                    "files": sorted(component.footprint.files),
+                    "mapped_pages": asdict(component.mapped_pages),
+                    "loaded": (
+                        asdict(component.loaded)
+                        if component.loaded is not None
+                        else None
+                    ),
+                }
+                for component in self.components
+            },
+        }
+
+    def format(self) -> str:
+        def mb(value: int) -> str:
+            return f"{value / 1048576:.1f}"
+
+        lines = [
+            f"{'component':<12} {'objects':>9} {'arrays':>9} {'mapped':>9} {'tensors':>9} {'total':>9}"
+            f" {'loaded rss':>10} {'mapped rss':>10} {'shared':>9} {'private':>9}  (MiB)"
+        ]
+        for component in self.components:
+            usage = component.footprint
+            loaded = mb(component.loaded.rss) if component.loaded is not None else "-"
+            lines.append(
+                f"{component.name:<12} {mb(usage.objects):>9} {mb(usage.arrays):>9} {mb(usage.mapped):>9}"
+                f" {mb(usage.tensors):>9} {mb(usage.total):>9} {loaded:>10} {mb(component.mapped_pages.rss):>10}"
+                f" {mb(component.mapped_pages.shared):>9} {mb(component.mapped_pages.private):>9}"
+            )
+
+        lines.append("")
+        lines.append(
+            f"{'mapping':<12} {'rss':>9} {'pss':>9} {'shared':>9} {'private':>9} {'swap':>9}  (MiB)"
+        )
+        for name, pages in [*self.mappings.items(), ("process", self.process)]:
+            lines.append(
+                f"{name:<12} {mb(pages.rss):>9} {mb(pages.pss):>9} {mb(pages.shared):>9} {mb(pages.private):>9}"
+                f" {mb(pages.swap):>9}"
+            )
+        return "\n".join(lines)
+
+    def publish(self) -> None:
+        """
+        Sets the process and component memory gauges to this report's numbers.
+        """
+        _publish_process(self.process)
+        for component in self.components:
+            for kind in ("objects", "arrays", "mapped", "tensors"):
+                COMPONENT_MEMORY.labels(component.name, kind).set(
+                    getattr(component.footprint, kind)
+                )
+
+
+def _publish_process(pages: Pages) -> None:
+    for kind, value in asdict(pages).items():
+        PROCESS_MEMORY.labels(kind).set(value)
+
+
+def publish_process_memory() -> Pages:
+    """
+    Sets the process memory gauges without measuring any components, which is cheap enough to do on every scrape.
+    """
+    pages = process_memory()
+    _publish_process(pages)
+    return pages
+
+
+class MemoryTracker:
+    """
+    Measures components' memory, including how much the process grew while each was loaded.
+    """
+
+    def __init__(self) -> None:
+        self._loaded: Dict[str, Pages] = {}
+
+    @contextmanager
+    def loading(self, name: str) -> Iterator[None]:
+        before = process_memory()
+        try:
+            yield
+        finally:
+            self._loaded[name] = self._loaded.get(name, Pages()) + (
+                process_memory() - before
+            )
+
+    def measure(self, components: Mapping[str, Any]) -> MemoryReport:
+        return measure(components, loaded=self._loaded)
+
+
+def measure(
+    components: Mapping[str, Any], loaded: Optional[Mapping[str, Pages]] = None
+) -> MemoryReport:
+    """
+    Measures the memory of each component, the process and the kinds of memory the process has mapped. Objects shared
+    by several components are counted under the first one.
+
+    Args:
+        components (Mapping[str, Any]): the components by name. None components are skipped.
+        loaded (Optional[Mapping[str, Pages]]): how much the process grew while each component was loaded
+    """
+    files = mapped_files()
+    seen: Set[int] = set()
+    measured = []
+    for name, component in components.items():
+        if component is None:
+            continue
+        usage = footprint(component, seen)
+        pages = Pages()
+        for filename in usage.files:
+            pages += files.get(filename, Pages())
+        measured.append(
+            ComponentMemory(
+                name=name,
+                footprint=usage,
+                mapped_pages=pages,
+                loaded=(loaded or {}).get(name),
+            )
+        )
+
+    mappings: Dict[str, Pages] = defaultdict(Pages)
+    for path, pages in files.items():
+        mappings[_mapping_kind(path)] += pages
+    return MemoryReport(
+        process=process_memory(), mappings=dict(mappings), components=measured
+    )
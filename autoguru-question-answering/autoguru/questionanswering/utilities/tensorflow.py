@@ -17,3 +17,18 @@ def surpress_verbose_logging() -> Iterator[None]:
         os.environ[TF_LOG_LEVEL] = log_level
     else:
         del os.environ[TF_LOG_LEVEL]
+
+
+def pin_threads(intra_op_threads: int, inter_op_threads: int = 1) -> None:
+    """
+    Sets how many threads TensorFlow runs ops with. It only takes effect before TensorFlow runs anything, so call it
+    before loading models.
+
+    Args:
+        intra_op_threads (int): how many threads a single op, like a matrix multiplication, is split across
+        inter_op_threads (int): how many independent ops run at once
+    """
+    import tensorflow as tf
+
+    tf.config.threading.set_intra_op_parallelism_threads(intra_op_threads)
+    tf.config.threading.set_inter_op_parallelism_threads(inter_op_threads)
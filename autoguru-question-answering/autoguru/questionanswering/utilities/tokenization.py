@@ -11,5 +11,15 @@ def tokenize_sentences(text: str) -> List[str]:
     return sent_tokenize(text)
 
 
-def tokenize_words(text: str) -> List[str]:
-    return [word for word in word_tokenize(text) if word not in string.punctuation]
+def tokenize_words(text: str, preserve_line: bool = False) -> List[str]:
+    """
+    Args:
+        text (str): the text to split into words
+        preserve_line (bool): whether to skip splitting the text into sentences first. It's faster and doesn't need the
+            punkt model, and only changes whether periods ending sentences are split off their last words.
+    """
+    return [
+        word
+        for word in word_tokenize(text, preserve_line=preserve_line)
+        if word not in string.punctuation
+    ]
@@ -0,0 +1,111 @@
+from pathlib import Path
+from uuid import UUID
+
+import numpy as np
+import pytest
+
+from autoguru.questionanswering.answers import AnswerLookup, lookup_path
+from autoguru.questionanswering.bundle import Bundle, is_bundle
+from autoguru.questionanswering.nearestneighbors import index_class
+from autoguru.questionanswering.nearestneighbors.reranking import (
+    RerankedNearestNeighbors,
+)
+
+ROWS = 500
+DIMENSIONS = 16
+RERANK_FACTOR = 4
+
+
+@pytest.fixture(scope="module")
+def index_vectors() -> np.ndarray:
+    return np.random.default_rng(0).normal(size=(ROWS, DIMENSIONS)).astype(np.float32)
+
+
+@pytest.fixture(scope="module")
+def queries() -> np.ndarray:
+    return np.random.default_rng(1).normal(size=(20, DIMENSIONS)).astype(np.float32)
+
+
+def build_index(directory: Path, index_type: str, index_vectors: np.ndarray) -> Path:
+    """
+    Saves a reranked index and its answer lookup the way build-index does, with every third question unanswered.
+    """
+    index_path = directory.joinpath(f"{index_type}.index")
+    RerankedNearestNeighbors.create(
+        index_vectors, index_class(index_type).create(index_vectors)
+    ).save(index_path)
+    AnswerLookup.create(
+        (
+            UUID(int=row),
+            UUID(int=ROWS + row % 50) if row % 3 else None,
+            f"answer {row % 50}" if row % 3 else None,
+        )
+        for row in range(ROWS)
+    ).save(lookup_path(index_path))
+    return index_path
+
+
+@pytest.fixture(scope="module")
+def bundles(tmp_path_factory: pytest.TempPathFactory, index_vectors: np.ndarray):
+    directory = tmp_path_factory.mktemp("bundles")
+    created = {}
+    for index_type in ["balltree", "descent"]:
+        index_path = build_index(directory, index_type, index_vectors)
+        bundle_path = directory.joinpath(f"{index_type}.bundle")
+        Bundle.create(
+            bundle_path,
+            index_path,
+            index_type=index_type,
+            rerank_factor=RERANK_FACTOR,
+            version="test",
+        )
+        created[index_type] = (index_path, bundle_path)
+    return created
+
+
+@pytest.mark.parametrize("index_type", ["balltree", "descent"])
+def test_round_trip(bundles, queries: np.ndarray, index_type: str) -> None:
+    index_path, bundle_path = bundles[index_type]
+
+    assert is_bundle(bundle_path)
+    assert not is_bundle(index_path)
+    bundle = Bundle.load(bundle_path, verify=True)
+    assert bundle.manifest.version == "test"
+    assert bundle.manifest.index_type == index_type
+    assert bundle.manifest.rows == ROWS
+    assert bundle.manifest.rerank_factor == RERANK_FACTOR
+
+    index = bundle.index()
+    assert isinstance(index, RerankedNearestNeighbors)
+    assert index.size == ROWS
+    expected_index = RerankedNearestNeighbors.load(index_path, factor=RERANK_FACTOR)
+    neighbors = index.nearest_neighbors(queries, k=5)
+    assert neighbors == expected_index.nearest_neighbors(queries, k=5)
+
+    expected_answers = AnswerLookup.load(lookup_path(index_path))
+    assert bundle.answers().answers(neighbors) == expected_answers.answers(neighbors)
+
+
+def test_corrupt_section_fails_verification(bundles, tmp_path: Path) -> None:
+    _, bundle_path = bundles["balltree"]
+    section = Bundle.load(bundle_path).manifest.sections["answers/text"]
+    data = bytearray(bundle_path.read_bytes())
+    data[section.offset] ^= 0xFF
+    corrupt_path = tmp_path.joinpath("corrupt.bundle")
+    corrupt_path.write_bytes(bytes(data))
+
+    # Sections are only checked when asked to
+    Bundle.load(corrupt_path)
+    with pytest.raises(ValueError, match="answers/text section"):
+        Bundle.load(corrupt_path, verify=True)
+
+
+def test_truncated_bundle_fails_to_load(bundles, tmp_path: Path) -> None:
+    _, bundle_path = bundles["balltree"]
+    data = bundle_path.read_bytes()
+    truncated_path = tmp_path.joinpath("truncated.bundle")
+    truncated_path.write_bytes(data[: len(data) // 2])
+
+    assert is_bundle(truncated_path)
+    with pytest.raises(ValueError, match="truncated"):
+        Bundle.load(truncated_path)
@@ -0,0 +1,217 @@
+from typing import Callable, Dict, List
+
+import numpy as np
+import pytest
+
+from autoguru.questionanswering.nearestneighbors import (
+    NearestNeighbors,
+    Neighbor,
+    RowFilter,
+    filtering,
+)
+from autoguru.questionanswering.nearestneighbors.balltree import BallTree
+from autoguru.questionanswering.nearestneighbors.descent import Descent
+from autoguru.questionanswering.nearestneighbors.filtering import (
+    RowAttributesBuilder,
+)
+from autoguru.questionanswering.nearestneighbors.reranking import (
+    RerankedNearestNeighbors,
+)
+
+ROWS = 2000
+DIMENSIONS = 16
+K = 5
+# Filters allowing up to this many rows are searched exactly in these tests, so both paths run on a small index
+EXACT_SEARCH_ROWS = 200
+
+
+@pytest.fixture(scope="module")
+def index_vectors() -> np.ndarray:
+    return np.random.default_rng(0).normal(size=(ROWS, DIMENSIONS)).astype(np.float32)
+
+
+@pytest.fixture(scope="module")
+def queries(index_vectors: np.ndarray) -> np.ndarray:
+    rng = np.random.default_rng(1)
+    rows = rng.choice(ROWS, size=50, replace=False)
+    noise = rng.normal(scale=0.3, size=(len(rows), DIMENSIONS))
+    return (index_vectors[rows] + noise).astype(np.float32)
+
+
+@pytest.fixture(scope="module")
+def filters() -> Dict[str, RowFilter]:
+    rng = np.random.default_rng(2)
+    builder = RowAttributesBuilder()
+    for tenant in rng.choice(
+        ["rare", "common", "other"], size=ROWS, p=[0.05, 0.5, 0.45]
+    ):
+        builder.add({"tenant": str(tenant)})
+    attributes = builder.build()
+    return {
+        "selective": attributes.filter(tenant="rare"),
+        "non-selective": attributes.filter(tenant=["common", "rare"]),
+    }
+
+
+@pytest.fixture(scope="module")
+def indexes(index_vectors: np.ndarray) -> Dict[str, NearestNeighbors]:
+    descent = Descent.create(index_vectors)
+    return {
+        "balltree": BallTree.create(index_vectors),
+        "descent": descent,
+        "reranked": RerankedNearestNeighbors.create(index_vectors, descent),
+    }
+
+
+@pytest.fixture(autouse=True)
+def small_exact_search(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(filtering, "EXACT_SEARCH_ROWS", EXACT_SEARCH_ROWS)
+    # Small chunks so the exact search merges several of them
+    monkeypatch.setattr(filtering, "EXACT_SEARCH_CHUNK_SIZE", 64)
+
+
+def brute_force(
+    index_vectors: np.ndarray, queries: np.ndarray, k: int, allowed: RowFilter
+) -> List[List[Neighbor]]:
+    units = index_vectors / np.linalg.norm(index_vectors, axis=1, keepdims=True)
+    query_units = queries / np.linalg.norm(queries, axis=1, keepdims=True)
+    cosines = query_units @ units.T
+    cosines[:, ~allowed.allowed] = -np.inf
+    best = np.argsort(-cosines, axis=1, kind="stable")[:, : min(k, allowed.count)]
+    return [
+        [
+            Neighbor(index=int(row), similarity=float(cosines[query, row]))
+            for row in rows
+        ]
+        for query, rows in enumerate(best)
+    ]
+
+
+def recall(found: List[List[Neighbor]], expected: List[List[Neighbor]]) -> float:
+    hits = sum(
+        len({n.index for n in f} & {n.index for n in e})
+        for f, e in zip(found, expected)
+    )
+    return hits / sum(len(e) for e in expected)
+
+
+def count_calls(
+    monkeypatch: pytest.MonkeyPatch, index: NearestNeighbors, name: str
+) -> List[int]:
+    # Reranked indexes filter in the index they wrap
+    target = index.index if isinstance(index, RerankedNearestNeighbors) else index
+    calls: List[int] = []
+    method: Callable = getattr(target, name)
+
+    def counted(*args, **kwargs):
+        calls.append(1)
+        return method(*args, **kwargs)
+
+    monkeypatch.setattr(target, name, counted)
+    return calls
+
+
+def assert_valid(found: List[List[Neighbor]], allowed: RowFilter, k: int) -> None:
+    for neighbors in found:
+        assert len(neighbors) == min(k, allowed.count)
+        assert all(allowed.allowed[neighbor.index] for neighbor in neighbors)
+        similarities = [neighbor.similarity for neighbor in neighbors]
+        assert similarities == sorted(similarities, reverse=True)
+
+
+@pytest.mark.parametrize("index_type", ["balltree", "descent", "reranked"])
+def test_selective_filter_is_searched_exactly(
+    monkeypatch: pytest.MonkeyPatch,
+    indexes: Dict[str, NearestNeighbors],
+    filters: Dict[str, RowFilter],
+    index_vectors: np.ndarray,
+    queries: np.ndarray,
+    index_type: str,
+) -> None:
+    index = indexes[index_type]
+    allowed = filters["selective"]
+    assert allowed.count <= EXACT_SEARCH_ROWS
+    searches = count_calls(monkeypatch, index, "_search")
+
+    found = index.nearest_neighbors(queries, k=K, allowed=allowed)
+
+    assert not searches
+    expected = brute_force(index_vectors, queries, K, allowed)
+    assert_valid(found, allowed, K)
+    for neighbors, expected_neighbors in zip(found, expected):
+        assert [n.index for n in neighbors] == [n.index for n in expected_neighbors]
+        np.testing.assert_allclose(
+            [n.similarity for n in neighbors],
+            [n.similarity for n in expected_neighbors],
+            atol=1e-5,
+        )
+
+
+@pytest.mark.parametrize(
+    "index_type,min_recall", [("balltree", 1.0), ("descent", 0.9), ("reranked", 0.9)]
+)
+def test_non_selective_filter_over_fetches(
+    monkeypatch: pytest.MonkeyPatch,
+    indexes: Dict[str, NearestNeighbors],
+    filters: Dict[str, RowFilter],
+    index_vectors: np.ndarray,
+    queries: np.ndarray,
+    index_type: str,
+    min_recall: float,
+) -> None:
+    index = indexes[index_type]
+    allowed = filters["non-selective"]
+    assert allowed.count > EXACT_SEARCH_ROWS
+    searches = count_calls(monkeypatch, index, "_search")
+
+    found = index.nearest_neighbors(queries, k=K, allowed=allowed)
+
+    assert searches
+    assert_valid(found, allowed, K)
+    assert recall(found, brute_force(index_vectors, queries, K, allowed)) >= min_recall
+    # Whatever rows came back, their similarities are the exact ones
+    units = index_vectors / np.linalg.norm(index_vectors, axis=1, keepdims=True)
+    query_units = queries / np.linalg.norm(queries, axis=1, keepdims=True)
+    for query, neighbors in zip(query_units, found):
+        np.testing.assert_allclose(
+            [n.similarity for n in neighbors],
+            units[[n.index for n in neighbors]] @ query,
+            atol=1e-5,
+        )
+
+
+@pytest.mark.parametrize("index_type", ["balltree", "descent", "reranked"])
+def test_k_is_limited_to_the_allowed_rows(
+    indexes: Dict[str, NearestNeighbors],
+    index_vectors: np.ndarray,
+    queries: np.ndarray,
+    index_type: str,
+) -> None:
+    allowed = RowFilter.from_rows([3, 30, 300], size=ROWS)
+
+    found = indexes[index_type].nearest_neighbors(queries, k=K, allowed=allowed)
+
+    assert_valid(found, allowed, K)
+    assert [[n.index for n in neighbors] for neighbors in found] == [
+        [n.index for n in neighbors]
+        for neighbors in brute_force(index_vectors, queries, K, allowed)
+    ]
+
+
+def test_empty_filter_finds_nothing(
+    indexes: Dict[str, NearestNeighbors], queries: np.ndarray
+) -> None:
+    allowed = RowFilter(np.zeros(ROWS, dtype=bool))
+
+    assert indexes["balltree"].nearest_neighbors(queries, k=K, allowed=allowed) == [
+        [] for _ in queries
+    ]
+
+
+def test_filter_must_cover_the_index(
+    indexes: Dict[str, NearestNeighbors], queries: np.ndarray
+) -> None:
+    with pytest.raises(ValueError):
+        indexes["balltree"].nearest_neighbors(
+            queries, k=K, allowed=RowFilter(np.ones(ROWS - 1, dtype=bool))
+        )
@@ -0,0 +1,198 @@
+import itertools
+import random
+import threading
+import time
+from pathlib import Path
+from typing import Iterable, Iterator, List, Optional, Union
+from uuid import UUID
+
+import numpy as np
+import pytest
+
+from autoguru.questionanswering.answers import AnswerLookup
+from autoguru.questionanswering.embeddings import Embedder
+from autoguru.questionanswering.nearestneighbors import (
+    Metric,
+    NearestNeighbors,
+    Neighbor,
+    RowFilter,
+)
+from autoguru.questionanswering.pipeline import QuestionAnsweringPipeline, StageOptions
+from autoguru.questionanswering.questionclassification import (
+    QuestionClass,
+    QuestionClassification,
+    QuestionClassifier,
+)
+
+ROWS = 100
+
+
+def number(text: str) -> int:
+    return int(text.rsplit(" ", 1)[-1])
+
+
+def jitter() -> None:
+    # Lets batches overtake each other between workers
+    time.sleep(random.uniform(0.0, 0.003))
+
+
+class StubEmbedder(Embedder):
+    """
+    Embeds "... n" as [n].
+    """
+
+    def embed(self, text: Union[str, Iterable[str]]) -> np.ndarray:
+        if isinstance(text, str):
+            return self.embed([text])[0]
+        jitter()
+        return np.array([[float(number(line))] for line in text], dtype=np.float32)
+
+    @property
+    def embedding_size(self) -> int:
+        return 1
+
+    @property
+    def suggested_metrics(self) -> List[Metric]:
+        return [Metric.COSINE]
+
+    @classmethod
+    def create(cls) -> "StubEmbedder":
+        return cls()
+
+
+class StubIndex(NearestNeighbors):
+    """
+    Finds row n % ROWS for [n], and fails on the row it's told to.
+    """
+
+    def __init__(self, fail_on: Optional[int] = None) -> None:
+        self._fail_on: Optional[int] = fail_on
+
+    @property
+    def size(self) -> int:
+        return ROWS
+
+    def nearest_neighbors(
+        self, vectors: np.ndarray, k: int = 1, allowed: Optional[RowFilter] = None
+    ) -> List[List[Neighbor]]:
+        jitter()
+        rows = [int(vector[0]) % ROWS for vector in vectors]
+        if self._fail_on in rows:
+            raise RuntimeError(f"Search failed on row {self._fail_on}")
+        return [[Neighbor(index=row, similarity=1.0)] for row in rows]
+
+    def save(self, index_file: Union[str, Path]) -> None:
+        raise NotImplementedError
+
+    @classmethod
+    def load(cls, index_file: Union[str, Path]) -> "StubIndex":
+        raise NotImplementedError
+
+    @classmethod
+    def create(cls) -> "StubIndex":
+        return cls()
+
+
+class StubClassifier(QuestionClassifier):
+    """
+    Classifies "question n" as a question, "unsure n" as a question it isn't confident in, and anything else as not a
+    question.
+    """
+
+    def classify(
+        self, questions: Union[str, Iterable[str]], k: int = 1
+    ) -> List[List[QuestionClassification]]:
+        if isinstance(questions, str):
+            questions = [questions]
+        jitter()
+        classifications = []
+        for question in questions:
+            if question.startswith("question"):
+                classification = QuestionClassification(QuestionClass.QUESTION, 0.9)
+            elif question.startswith("unsure"):
+                classification = QuestionClassification(QuestionClass.QUESTION, 0.1)
+            else:
+                classification = QuestionClassification(QuestionClass.NOT_QUESTION, 0.9)
+            classifications.append([classification])
+        return classifications
+
+    @classmethod
+    def create(cls) -> "StubClassifier":
+        return cls()
+
+
+@pytest.fixture(scope="module")
+def answers() -> AnswerLookup:
+    return AnswerLookup.create(
+        (UUID(int=row), UUID(int=ROWS + row), f"answer {row}") for row in range(ROWS)
+    )
+
+
+def pipeline(
+    answers: AnswerLookup, index: NearestNeighbors
+) -> QuestionAnsweringPipeline:
+    options = StageOptions(batch_size=4, workers=3, max_wait=0.001)
+    return QuestionAnsweringPipeline(
+        embedder=StubEmbedder(),
+        index=index,
+        answers=answers,
+        classifier=StubClassifier(),
+        classify=options,
+        embed=options,
+        nearest_neighbors=options,
+        answer=options,
+        queue_size=8,
+    )
+
+
+def pipeline_threads() -> List[threading.Thread]:
+    return [
+        thread
+        for thread in threading.enumerate()
+        if thread.name.startswith("pipeline-") and thread.name != "pipeline-input"
+    ]
+
+
+def test_answers_in_input_order(answers: AnswerLookup) -> None:
+    kinds = ["question", "statement", "unsure"]
+    questions = [f"{kinds[i % 7 % 3]} {i}" for i in range(500)]
+
+    results = list(pipeline(answers, StubIndex()).run(iter(questions)))
+
+    assert [result.question for result in results] == questions
+    for result in results:
+        if result.question.startswith("question"):
+            assert len(result.answers) == 1
+            assert result.answers[0].text == f"answer {number(result.question) % ROWS}"
+        else:
+            assert result.answers == []
+    assert not pipeline_threads()
+
+
+def test_stage_error_is_raised(answers: AnswerLookup) -> None:
+    questions = (f"question {i}" for i in itertools.count())
+
+    with pytest.raises(RuntimeError, match="row 42"):
+        for _ in pipeline(answers, StubIndex(fail_on=42)).run(questions):
+            pass
+    assert not pipeline_threads()
+
+
+def test_stopping_early_stops_the_workers(answers: AnswerLookup) -> None:
+    read = itertools.count()
+
+    def questions() -> Iterator[str]:
+        for i in read:
+            yield f"question {i}"
+
+    results = pipeline(answers, StubIndex()).run(questions())
+    first = [result.question for result in itertools.islice(results, 10)]
+    results.close()
+
+    assert first == [f"question {i}" for i in range(10)]
+    assert not pipeline_threads()
+    # Reading the input stops too, after at most what fits in the queues
+    time.sleep(0.5)
+    stopped_at = next(read)
+    time.sleep(0.2)
+    assert next(read) == stopped_at + 1
@@ -0,0 +1,175 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import List
+from uuid import UUID
+
+import numpy as np
+import pytest
+
+from autoguru.questionanswering.answers import AnswerLookup, lookup_path
+from autoguru.questionanswering.bundle import Bundle
+from autoguru.questionanswering.nearestneighbors.balltree import BallTree
+from autoguru.questionanswering.nearestneighbors.registry import (
+    IndexedAnswers,
+    IndexRegistry,
+)
+from autoguru.questionanswering.utilities.instrumentation import (
+    INDEX_REGISTRY_EVENTS,
+)
+
+THREADS = 8
+
+
+class CountingLoader:
+    """
+    Loads "<namespace>" as itself, counting the loads. Each load waits for release, and the first fails if told to.
+    """
+
+    def __init__(self, fail_first: bool = False) -> None:
+        self.loads: List[str] = []
+        self.release: threading.Event = threading.Event()
+        self._fail_first: bool = fail_first
+
+    def __call__(self, namespace: str) -> str:
+        self.loads.append(namespace)
+        self.release.wait(timeout=5)
+        if self._fail_first and len(self.loads) == 1:
+            raise RuntimeError(f"Failed to load {namespace}")
+        return namespace
+
+
+def wait_for_waiters(name: str, count: int) -> None:
+    # Each caller that finds the load already running records a shared lookup before it waits on it
+    shared = INDEX_REGISTRY_EVENTS.labels(name, "shared")
+    deadline = time.monotonic() + 5
+    while shared.value < count:
+        assert time.monotonic() < deadline, "the callers never waited on the load"
+        time.sleep(0.001)
+
+
+def sizes(**namespaces: int):
+    return lambda namespace: namespaces[namespace]
+
+
+def test_concurrent_gets_share_one_load() -> None:
+    loader = CountingLoader()
+    registry: IndexRegistry[str] = IndexRegistry(loader, name="test_shared")
+
+    with ThreadPoolExecutor(max_workers=THREADS) as executor:
+        results = [executor.submit(registry.get, "a") for _ in range(THREADS)]
+        wait_for_waiters("test_shared", THREADS - 1)
+        loader.release.set()
+
+        assert [result.result() for result in results] == ["a"] * THREADS
+    assert loader.loads == ["a"]
+    assert registry.get("a") == "a"
+    assert loader.loads == ["a"]
+
+
+def test_failed_load_reaches_every_waiter_and_is_not_cached() -> None:
+    loader = CountingLoader(fail_first=True)
+    registry: IndexRegistry[str] = IndexRegistry(loader, name="test_failure")
+
+    with ThreadPoolExecutor(max_workers=THREADS) as executor:
+        results = [executor.submit(registry.get, "a") for _ in range(THREADS)]
+        wait_for_waiters("test_failure", THREADS - 1)
+        loader.release.set()
+
+        for result in results:
+            with pytest.raises(RuntimeError, match="Failed to load a"):
+                result.result()
+    assert "a" not in registry
+    assert registry.memory == 0
+
+    # The next get tries again
+    assert registry.get("a") == "a"
+    assert loader.loads == ["a", "a"]
+
+
+def test_least_recently_used_are_evicted_over_budget() -> None:
+    registry: IndexRegistry[str] = IndexRegistry(
+        lambda namespace: namespace,
+        memory_budget=6,
+        size=sizes(a=2, b=2, c=2, d=3),
+    )
+    for namespace in ["a", "b", "c", "a"]:
+        registry.get(namespace)
+    assert registry.namespaces == ["b", "c", "a"]
+    assert registry.memory == 6
+
+    registry.get("d")
+
+    # b and then c were used least recently, and dropping b alone isn't enough
+    assert registry.namespaces == ["a", "d"]
+    assert registry.memory == 5
+
+
+def test_pinned_and_just_loaded_namespaces_survive_eviction() -> None:
+    registry: IndexRegistry[str] = IndexRegistry(
+        lambda namespace: namespace,
+        memory_budget=4,
+        size=sizes(pinned=2, a=2, b=2, large=10),
+        pinned=["pinned"],
+    )
+    registry.get("pinned")
+    registry.get("a")
+    registry.get("b")
+    assert registry.namespaces == ["pinned", "b"]
+
+    # Larger than the whole budget, but it's kept until something else is loaded
+    registry.get("large")
+    assert registry.namespaces == ["pinned", "large"]
+    assert registry.memory == 12
+
+    registry.get("a")
+    assert registry.namespaces == ["pinned", "a"]
+
+    registry.unpin("pinned")
+    registry.get("b")
+    assert registry.namespaces == ["a", "b"]
+
+
+@pytest.fixture(scope="module")
+def directory(tmp_path_factory: pytest.TempPathFactory) -> Path:
+    directory = tmp_path_factory.mktemp("registry")
+    vectors = np.random.default_rng(0).normal(size=(50, 8)).astype(np.float32)
+    for namespace in ["plain", "bundled"]:
+        index_path = directory.joinpath(f"{namespace}.index")
+        BallTree.create(vectors).save(index_path)
+        AnswerLookup.create(
+            (UUID(int=row), UUID(int=100 + row), f"{namespace} answer {row}")
+            for row in range(len(vectors))
+        ).save(lookup_path(index_path))
+    Bundle.create(
+        directory.joinpath("bundled.bundle"),
+        directory.joinpath("bundled.index"),
+        index_type="balltree",
+    )
+    directory.joinpath("bundled.index").unlink()
+    return directory
+
+
+@pytest.mark.parametrize("namespace", ["plain", "bundled"])
+def test_directory_loads_indexes_with_their_answers(
+    directory: Path, namespace: str
+) -> None:
+    registry = IndexRegistry.from_directory(directory, index_type="balltree")
+
+    loaded = registry.get(namespace)
+
+    assert isinstance(loaded, IndexedAnswers)
+    query = np.random.default_rng(1).normal(size=(1, 8)).astype(np.float32)
+    neighbors = loaded.index.nearest_neighbors(query, k=1)
+    [[match]] = loaded.answers.answers(neighbors)
+    assert match.text == f"{namespace} answer {neighbors[0][0].index}"
+
+
+@pytest.mark.parametrize("namespace", ["missing", "..", "../registry0/plain"])
+def test_directory_rejects_unknown_namespaces(directory: Path, namespace: str) -> None:
+    registry = IndexRegistry.from_directory(directory, index_type="balltree")
+
+    with pytest.raises(KeyError):
+        registry.get(namespace)
+    assert not registry.namespaces
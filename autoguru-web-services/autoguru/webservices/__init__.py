@@ -1,12 +1,20 @@
-import pkg_resources
-
-from autoguru.webservices import admin, events, models, routes
+import importlib
+from pathlib import Path
+from types import ModuleType
 
 __version__ = (
-    pkg_resources.resource_string("autoguru.webservices", "VERSION.txt")
-    .decode("UTF-8")
-    .strip()
+    Path(__file__).with_name("VERSION.txt").read_text(encoding="UTF-8").strip()
 )
 
+# The submodules import FastAPI, the admin and Tortoise, so they're only imported when they're first used. That keeps
+# the CLI fast for commands that never touch the app.
+_SUBMODULES = {"admin", "api", "events", "models", "routes"}
+
+
+def __getattr__(name: str) -> ModuleType:
+    if name in _SUBMODULES:
+        return importlib.import_module(f"{__name__}.{name}")
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 
-__all__ = ["__version__", "admin", "events", "models", "routes"]
+__all__ = ["__version__", "admin", "api", "events", "models", "routes"]
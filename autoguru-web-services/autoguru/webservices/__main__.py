@@ -1,5 +1,8 @@
+import json
+from pathlib import Path
+from typing import Optional
+
 import click
-import uvicorn
 
 from autoguru.webservices import __version__
 
@@ -11,8 +14,192 @@ def web_services() -> None:
 
 
 @web_services.command(name="run", help="Runs the web services")
-def run() -> None:
-    uvicorn.run("autoguru.webservices.main:app", debug=True, reload=True)
+@click.option(
+    "-d/-p",
+    "--development/--production",
+    default=True,
+    help="whether to run the auto-reloading development server or the multi-worker production server  [default development]",
+    show_default=False,
+)
+@click.option(
+    "--host", default="127.0.0.1", help="the host to bind to", show_default=True
+)
+@click.option("--port", default=8000, help="the port to bind to", show_default=True)
+@click.option(
+    "-w",
+    "--workers",
+    default=1,
+    help="the number of worker processes (production only)",
+    show_default=True,
+)
+@click.option(
+    "--preload/--no-preload",
+    default=False,
+    help="whether to load the index and answers once before forking workers so they share memory. The TensorFlow models are still loaded by each worker. (production only)  [default no preload]",
+    show_default=False,
+)
+@click.option(
+    "--max-requests",
+    default=0,
+    help="how many requests a worker serves before it is gracefully replaced, 0 to never recycle (production only)",
+    show_default=True,
+)
+@click.option(
+    "--max-requests-jitter",
+    default=0,
+    help="the maximum random amount added to --max-requests per worker (production only)",
+    show_default=True,
+)
+@click.option(
+    "--graceful-timeout",
+    default=30,
+    help="how many seconds a worker has to finish in-flight requests when stopping (production only)",
+    show_default=True,
+)
+def run(
+    development: bool = True,
+    host: str = "127.0.0.1",
+    port: int = 8000,
+    workers: int = 1,
+    preload: bool = False,
+    max_requests: int = 0,
+    max_requests_jitter: int = 0,
+    graceful_timeout: int = 30,
+) -> None:
+    if development:
+        import uvicorn
+
+        uvicorn.run(
+            "autoguru.webservices.main:app",
+            host=host,
+            port=port,
+            debug=True,
+            reload=True,
+        )
+        return
+
+    from autoguru.webservices.server import Server
+
+    try:
+        server = Server(
+            host=host,
+            port=port,
+            workers=workers,
+            preload=preload,
+            max_requests=max_requests,
+            max_requests_jitter=max_requests_jitter,
+            graceful_timeout=graceful_timeout,
+        )
+    except ValueError as error:
+        raise click.ClickException(str(error))
+    server.run()
+
+
+@web_services.command(
+    name="benchmark",
+    help="Load tests the web services and prints latency percentiles and throughput as JSON",
+)
+@click.option(
+    "--url",
+    default=None,
+    help="the base URL of a running server to benchmark. If not given, the app is run in process with stub models and an in-memory database.",
+)
+@click.option(
+    "--mix",
+    default="answer=6,answer_batch=1,admin_list=2,admin_search=1",
+    help="the comma separated scenarios to send and their relative weights. Scenarios are answer, answer_batch, admin_list, admin_search and dashboard.",
+    show_default=True,
+)
+@click.option(
+    "-c",
+    "--concurrency",
+    default=16,
+    help="how many requests are in flight at once",
+    show_default=True,
+)
+@click.option(
+    "-n",
+    "--requests",
+    default=1000,
+    help="how many requests to time",
+    show_default=True,
+)
+@click.option(
+    "--warmup",
+    default=50,
+    help="how many untimed requests to send first",
+    show_default=True,
+)
+@click.option(
+    "--probes",
+    default=10,
+    help="how many sequential requests per scenario to count database queries over, 0 to skip",
+    show_default=True,
+)
+@click.option("--seed", default=0, help="the random seed", show_default=True)
+@click.option(
+    "--corpus-size",
+    default=1000,
+    help="how many synthetic questions to generate",
+    show_default=True,
+)
+@click.option(
+    "--embedding-delay",
+    default=0.0,
+    help="how many milliseconds the stub embedder takes per batch (in process only)",
+    show_default=True,
+)
+@click.option("--username", default=None, help="the admin to log in as (--url only)")
+@click.option("--password", default=None, help="the admin's password (--url only)")
+@click.option(
+    "-o",
+    "--output",
+    type=click.Path(dir_okay=False, writable=True),
+    default=None,
+    help="the file to write the report to instead of standard out",
+)
+def benchmark(
+    url: Optional[str] = None,
+    mix: str = "answer=6,answer_batch=1,admin_list=2,admin_search=1",
+    concurrency: int = 16,
+    requests: int = 1000,
+    warmup: int = 50,
+    probes: int = 10,
+    seed: int = 0,
+    corpus_size: int = 1000,
+    embedding_delay: float = 0.0,
+    username: Optional[str] = None,
+    password: Optional[str] = None,
+    output: Optional[str] = None,
+) -> None:
+    import asyncio
+
+    from autoguru.webservices import benchmark as benchmarks
+
+    try:
+        report = asyncio.run(
+            benchmarks.benchmark(
+                url=url,
+                mix=benchmarks.parse_mix(mix),
+                concurrency=concurrency,
+                requests=requests,
+                warmup=warmup,
+                probes=probes,
+                seed=seed,
+                corpus_size=corpus_size,
+                embedding_delay=embedding_delay / 1000.0,
+                username=username,
+                password=password,
+            )
+        )
+    except ValueError as error:
+        raise click.UsageError(str(error))
+
+    text = json.dumps(report, indent=2)
+    if output is None:
+        click.echo(text)
+    else:
+        Path(output).write_text(text + "\n", encoding="UTF-8")
 
 
 if __name__ == "__main__":
@@ -2,8 +2,7 @@ from fastapi_admin.app import app
 from fastapi_admin.resources import Field, Link, Model
 from fastapi_admin.widgets import displays, filters, inputs
 
-from autoguru.persistence import Answer, Question
-from autoguru.webservices.models import Admin
+from autoguru.webservices.models import Admin, Answer, Question
 
 
 @app.register
@@ -0,0 +1,191 @@
+import asyncio
+from typing import Any, Dict, List, Optional, Union
+from uuid import UUID
+
+from fastapi import HTTPException, Query
+from pydantic import BaseModel, Field, validator
+from starlette.requests import Request
+from starlette.responses import PlainTextResponse
+from starlette.status import HTTP_429_TOO_MANY_REQUESTS, HTTP_503_SERVICE_UNAVAILABLE
+
+from autoguru.questionanswering.utilities.memory import (
+    MemoryReport,
+    measure,
+    publish_process_memory,
+)
+from autoguru.webservices import settings, streaming
+from autoguru.webservices.instrumentation import render_metrics
+from autoguru.webservices.main import app
+from autoguru.webservices.questionanswering import (
+    QuestionAnswer,
+    QuestionAnsweringModels,
+)
+from autoguru.webservices.service import OverloadedError, QuestionAnsweringService
+from autoguru.webservices.streaming import StreamedQuestion
+
+
+class AnswerRequest(BaseModel):
+    questions: Union[str, List[str]]
+    k: int = Field(default=1, ge=1, le=100)
+    answer_all: bool = False
+
+    @validator("questions")
+    def batch_size(cls, questions: Union[str, List[str]]) -> List[str]:
+        if isinstance(questions, str):
+            questions = [questions]
+        if not questions:
+            raise ValueError("at least one question is required")
+        if len(questions) > settings.QA_MAX_BATCH_SIZE:
+            raise ValueError(
+                f"at most {settings.QA_MAX_BATCH_SIZE} questions can be answered at once"
+            )
+        return questions
+
+
+class Classification(BaseModel):
+    classification: str
+    confidence: float
+
+
+class Match(BaseModel):
+    question_id: UUID
+    answer_id: Optional[UUID]
+    text: Optional[str]
+    similarity: float
+
+
+class Result(BaseModel):
+    question: str
+    classification: Optional[Classification]
+    answers: List[Match]
+
+
+class AnswerResponse(BaseModel):
+    results: List[Result]
+    timings: Dict[str, float]
+
+
+class StreamedResult(Result):
+    id: Any
+    line: int
+
+
+def to_result(result: QuestionAnswer) -> Result:
+    return Result(
+        question=result.question,
+        classification=(
+            Classification(
+                classification=result.classification.classification.name,
+                confidence=result.classification.confidence,
+            )
+            if result.classification is not None
+            else None
+        ),
+        answers=[
+            Match(
+                question_id=match.question_id,
+                answer_id=match.answer_id,
+                text=match.text,
+                similarity=match.similarity,
+            )
+            for match in result.answers
+        ],
+    )
+
+
+def render_streamed_result(question: StreamedQuestion, result: QuestionAnswer) -> str:
+    return StreamedResult(
+        id=question.id, line=question.line, **to_result(result).dict()
+    ).json()
+
+
+def get_service(request: Request) -> QuestionAnsweringService:
+    service = getattr(request.app.state, "question_answering", None)
+    if service is None:
+        raise HTTPException(
+            status_code=HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Question answering models are not configured",
+        )
+    return service
+
+
+@app.post("/api/answer", response_model=AnswerResponse)
+async def answer(request: Request, body: AnswerRequest) -> AnswerResponse:
+    service = get_service(request)
+    try:
+        results, timings = await service.answer(
+            body.questions, k=body.k, answer_all=body.answer_all
+        )
+    except OverloadedError as error:
+        raise HTTPException(
+            status_code=HTTP_429_TOO_MANY_REQUESTS,
+            detail=str(error),
+            headers={"Retry-After": "1"},
+        )
+
+    return AnswerResponse(
+        results=[to_result(result) for result in results], timings=timings
+    )
+
+
+@app.post("/api/answer/stream")
+async def answer_stream(
+    request: Request,
+    k: int = Query(default=1, ge=1, le=100),
+    answer_all: bool = False,
+    batch_size: int = Query(default=settings.QA_STREAM_BATCH_SIZE, ge=1),
+) -> streaming.DuplexStreamingResponse:
+    service = get_service(request)
+    if service.overloaded:
+        raise HTTPException(
+            status_code=HTTP_429_TOO_MANY_REQUESTS,
+            detail=f"{service.queue_depth} question answering batches are already waiting",
+            headers={"Retry-After": "1"},
+        )
+
+    return streaming.DuplexStreamingResponse(
+        streaming.answer_stream(
+            service,
+            request.stream(),
+            render=render_streamed_result,
+            k=k,
+            answer_all=answer_all,
+            batch_size=min(batch_size, settings.QA_MAX_BATCH_SIZE),
+            max_line_bytes=settings.QA_STREAM_MAX_LINE_BYTES,
+        ),
+        media_type="application/x-ndjson",
+    )
+
+
+def measure_models(models: QuestionAnsweringModels) -> MemoryReport:
+    # The embedder comes first, so the model it shares with the classifier is counted under it
+    return measure(
+        {
+            "embedder": models.embedder,
+            "classifier": models.classifier,
+            "index": models.index,
+            "answers": models.answers,
+            "cache": models.cache,
+        }
+    )
+
+
+@app.get("/api/memory")
+async def memory(request: Request) -> Dict[str, Any]:
+    service = get_service(request)
+    # Walking every model takes a while, so it's kept off the event loop
+    with service.artifacts.acquire() as models:
+        report = await asyncio.get_running_loop().run_in_executor(
+            None, measure_models, models
+        )
+    report.publish()
+    return {"version": models.version, **report.to_json()}
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics() -> PlainTextResponse:
+    # Measuring each component is too slow for every scrape, so that's left to /api/memory
+    publish_process_memory()
+    return PlainTextResponse(
+        render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
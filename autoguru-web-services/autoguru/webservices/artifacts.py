@@ -0,0 +1,187 @@
+import asyncio
+import gc
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import partial
+from pathlib import Path
+from typing import Iterator, List, Optional, Union
+
+from autoguru.webservices.questionanswering import (
+    Manifest,
+    QuestionAnsweringModels,
+    answer_questions,
+)
+
+LOGGER: logging.Logger = logging.getLogger(__name__)
+
+DEFAULT_WARMUP: List[str] = [
+    "How do I get started?",
+    "What does this do?",
+    "Why isn't it working?",
+]
+
+
+class _Version:
+    __slots__ = ["models", "references", "retired"]
+
+    def __init__(self, models: QuestionAnsweringModels) -> None:
+        self.models: Optional[QuestionAnsweringModels] = models
+        self.references: int = 0
+        self.retired: bool = False
+
+
+class ArtifactManager:
+    """
+    Holds the current version of the question answering models and swaps in new versions without dropping requests.
+
+    When given a manifest, it polls the manifest for a new version. New versions are loaded and warmed up with sample
+    queries on a background thread and then atomically replace the current version. Requests that already acquired the old
+    version keep using it, and it's released once the last of them finishes.
+
+    acquire, start, stop and reload must all be called from the event loop.
+
+    Args:
+        models (QuestionAnsweringModels): the initial version of the models
+        manifest_path (Optional[Union[str, Path]]): the manifest file, or a directory containing manifest.json, to watch for new versions. If None, the models never change.
+        poll_interval (float): how many seconds to wait between checks of the manifest
+    """
+
+    def __init__(
+        self,
+        models: QuestionAnsweringModels,
+        manifest_path: Optional[Union[str, Path]] = None,
+        poll_interval: float = 30.0,
+    ) -> None:
+        self._current: _Version = _Version(models)
+        self._manifest_path: Optional[Path] = (
+            Manifest.path(manifest_path) if manifest_path is not None else None
+        )
+        self._poll_interval: float = poll_interval
+        self._modified: Optional[float] = self._manifest_modified()
+        self._loader: ThreadPoolExecutor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="artifact-loader"
+        )
+        self._watcher: Optional[asyncio.Task] = None
+        self._reloading: asyncio.Lock = asyncio.Lock()
+
+    @property
+    def models(self) -> QuestionAnsweringModels:
+        return self._current.models
+
+    @property
+    def version(self) -> str:
+        return self._current.models.version
+
+    @contextmanager
+    def acquire(self) -> Iterator[QuestionAnsweringModels]:
+        version = self._current
+        version.references += 1
+        try:
+            yield version.models
+        finally:
+            version.references -= 1
+            if version.retired and version.references == 0:
+                self._release(version)
+
+    async def start(self) -> None:
+        if self._manifest_path is not None and self._watcher is None:
+            self._watcher = asyncio.get_running_loop().create_task(self._watch())
+
+    async def stop(self) -> None:
+        if self._watcher is not None:
+            self._watcher.cancel()
+            try:
+                await self._watcher
+            except asyncio.CancelledError:
+                pass
+            self._watcher = None
+        # Waits for a load or a release that's still running without blocking the loop
+        await asyncio.get_running_loop().run_in_executor(
+            None, partial(self._loader.shutdown, wait=True)
+        )
+
+    async def reload(self) -> bool:
+        """
+        Loads, warms up and swaps in the version described by the manifest if it isn't already the current version.
+
+        Returns:
+            Whether a new version was swapped in
+        """
+        if self._manifest_path is None:
+            return False
+
+        async with self._reloading:
+            manifest = Manifest.read(self._manifest_path)
+            if manifest.version == self.version:
+                return False
+
+            LOGGER.info("Loading question answering artifacts %s", manifest.version)
+            models = await asyncio.get_running_loop().run_in_executor(
+                self._loader, self._load, manifest
+            )
+            self._swap(models)
+            LOGGER.info("Swapped in question answering artifacts %s", manifest.version)
+            return True
+
+    def _manifest_modified(self) -> Optional[float]:
+        if self._manifest_path is None:
+            return None
+        try:
+            return self._manifest_path.stat().st_mtime
+        except FileNotFoundError:
+            return None
+
+    async def _watch(self) -> None:
+        while True:
+            await asyncio.sleep(self._poll_interval)
+            modified = self._manifest_modified()
+            if modified is None or modified == self._modified:
+                continue
+
+            try:
+                await self.reload()
+                self._modified = modified
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                # Keep serving the current version; a fixed manifest will be picked up on a later poll
+                LOGGER.exception("Failed to load new question answering artifacts")
+
+    @staticmethod
+    def _load(manifest: Manifest) -> QuestionAnsweringModels:
+        models = QuestionAnsweringModels.from_manifest(manifest)
+        answer_questions(
+            models,
+            manifest.warmup if manifest.warmup else DEFAULT_WARMUP,
+            answer_all=True,
+        )
+        return models
+
+    def _swap(self, models: QuestionAnsweringModels) -> None:
+        previous = self._current
+        self._current = _Version(models)
+        previous.retired = True
+        if previous.references == 0:
+            self._release(previous)
+
+    def _release(self, version: _Version) -> None:
+        if version.models is None:
+            return
+
+        # The submitted call holds on to its arguments until it returns, so the models are passed in a list it empties
+        models = [version.models]
+        version.models = None
+        try:
+            self._loader.submit(self._collect, models)
+        except RuntimeError:
+            # The manager has stopped, so the models go with the process
+            LOGGER.info("Released question answering artifacts %s", models[0].version)
+
+    @staticmethod
+    def _collect(models: List[QuestionAnsweringModels]) -> None:
+        # A full collection over a heap holding the models takes a while, so it runs on the loader rather than the loop
+        version = models[0].version
+        models.clear()
+        gc.collect()
+        LOGGER.info("Released question answering artifacts %s", version)
@@ -0,0 +1,606 @@
+import asyncio
+import hashlib
+import itertools
+import pickle
+import random
+import re
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import (
+    Any,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Tuple,
+    Union,
+)
+from uuid import UUID, uuid4
+
+import httpx
+import numpy as np
+from tortoise import Tortoise
+
+from autoguru.questionanswering.answers import AnswerLookup
+from autoguru.questionanswering.embeddings import Embedder
+from autoguru.questionanswering.embeddings.instrumented import InstrumentedEmbedder
+from autoguru.questionanswering.nearestneighbors import (
+    Metric,
+    NearestNeighbors,
+    Neighbor,
+    RowFilter,
+)
+from autoguru.questionanswering.nearestneighbors.instrumented import (
+    InstrumentedNearestNeighbors,
+)
+from autoguru.webservices.cache import InMemoryRedis
+from autoguru.webservices.events import (
+    configure_admin,
+    start_question_answering,
+    stop_question_answering,
+)
+from autoguru.webservices.instrumentation import instrument_database
+from autoguru.webservices.main import app
+from autoguru.webservices.models import Admin, Answer, Question
+from autoguru.webservices.questionanswering import QuestionAnsweringModels
+
+BENCHMARK_USERNAME: str = "benchmark"
+BENCHMARK_PASSWORD: str = "benchmark"
+BENCHMARK_VERSION: str = "benchmark"
+
+DEFAULT_MIX: Dict[str, float] = {
+    "answer": 6.0,
+    "answer_batch": 1.0,
+    "admin_list": 2.0,
+    "admin_search": 1.0,
+}
+
+_ACTIONS: List[str] = ["reset", "update", "delete", "export", "install", "rename"]
+_SUBJECTS: List[str] = [
+    "password",
+    "account",
+    "server",
+    "bot",
+    "profile",
+    "channel",
+    "role",
+    "plugin",
+    "database",
+    "backup",
+]
+_CONTEXTS: List[str] = [
+    "",
+    " on mobile",
+    " after an update",
+    " without admin access",
+    " for a whole team",
+]
+_SEARCH_TERMS: List[str] = _ACTIONS + _SUBJECTS
+_QUERY_COUNT = re.compile(
+    r"^autoguru_database_latency_seconds_count\{[^}]*\} (\S+)$", re.MULTILINE
+)
+
+
+class StubEmbedder(Embedder):
+    """
+    Embeds text as a pseudo-random unit vector seeded by a hash of the text, so the same text always gets the same vector
+    without downloading a model. A delay can stand in for the cost of a real model.
+
+    Args:
+        embedding_size (int): the size of the vectors
+        delay (float): how many seconds each call to embed sleeps for
+    """
+
+    DEFAULT_EMBEDDING_SIZE: int = 512
+
+    def __init__(
+        self, embedding_size: int = DEFAULT_EMBEDDING_SIZE, delay: float = 0.0
+    ) -> None:
+        self._embedding_size: int = embedding_size
+        self._delay: float = delay
+
+    def embed(self, text: Union[str, Iterable[str]]) -> np.ndarray:
+        if isinstance(text, str):
+            text = [text]
+
+        vectors = np.stack([self._vector(item) for item in text])
+        if self._delay > 0.0:
+            time.sleep(self._delay)
+        return vectors
+
+    def _vector(self, text: str) -> np.ndarray:
+        seed = int.from_bytes(
+            hashlib.blake2b(text.encode("UTF-8"), digest_size=8).digest(), "little"
+        )
+        vector = (
+            np.random.default_rng(seed)
+            .standard_normal(self._embedding_size)
+            .astype(np.float32)
+        )
+        return vector / np.linalg.norm(vector)
+
+    @property
+    def embedding_size(self) -> int:
+        return self._embedding_size
+
+    @property
+    def suggested_metrics(self) -> List[Metric]:
+        return [Metric.COSINE]
+
+    @classmethod
+    def create(
+        cls, embedding_size: int = DEFAULT_EMBEDDING_SIZE, delay: float = 0.0
+    ) -> "StubEmbedder":
+        return StubEmbedder(embedding_size=embedding_size, delay=delay)
+
+
+class StubNearestNeighbors(NearestNeighbors):
+    """
+    Exact cosine similarity search by brute force over unit vectors. Fine for the few thousand vectors a benchmark uses.
+    """
+
+    def __init__(self, vectors: np.ndarray) -> None:
+        self._vectors: np.ndarray = vectors
+
+    @property
+    def size(self) -> int:
+        return self._vectors.shape[0]
+
+    def nearest_neighbors(
+        self, vectors: np.ndarray, k: int = 1, allowed: Optional[RowFilter] = None
+    ) -> List[List[Neighbor]]:
+        if vectors.ndim != 2:
+            vectors = vectors.reshape((-1, self._vectors.shape[1]))
+
+        k = min(k, allowed.count if allowed is not None else self._vectors.shape[0])
+        if k == 0:
+            return [[] for _ in vectors]
+        similarities = vectors @ self._vectors.T
+        if allowed is not None:
+            similarities[:, ~allowed.allowed] = -np.inf
+        candidates = np.argpartition(-similarities, k - 1, axis=1)[:, :k]
+        results = []
+        for row, indexes in zip(similarities, candidates):
+            indexes = indexes[np.argsort(-row[indexes])]
+            results.append(
+                [
+                    Neighbor(index=index.item(), similarity=row[index].item())
+                    for index in indexes
+                ]
+            )
+        return results
+
+    def save(self, index_file: Union[str, Path]) -> None:
+        if isinstance(index_file, str):
+            index_file = Path(index_file)
+
+        with index_file.open("wb") as out_file:
+            pickle.dump(self, out_file)
+
+    @classmethod
+    def load(cls, index_file: Union[str, Path]) -> "StubNearestNeighbors":
+        if isinstance(index_file, str):
+            index_file = Path(index_file)
+
+        with index_file.open("rb") as in_file:
+            return pickle.load(in_file)
+
+    @classmethod
+    def create(cls, index_vectors: np.ndarray) -> "StubNearestNeighbors":
+        return StubNearestNeighbors(vectors=index_vectors.astype(np.float32))
+
+
+def synthetic_questions(size: int, seed: int = 0) -> List[Tuple[str, str]]:
+    """
+    Generates reproducible (question, answer) pairs that read like support questions.
+    """
+    rng = random.Random(seed)
+    templates = list(itertools.product(_ACTIONS, _SUBJECTS, _CONTEXTS))
+    pairs = []
+    for i in range(size):
+        action, subject, context = templates[i % len(templates)]
+        pairs.append(
+            (
+                f"How do I {action} my {subject}{context}? ({i})",
+                f"To {action} your {subject}{context}, open settings and choose "
+                f"{action.capitalize()} {rng.randint(1, 9)}.",
+            )
+        )
+    return pairs
+
+
+async def seed_database(
+    pairs: List[Tuple[str, str]],
+) -> List[Tuple[UUID, Optional[UUID], Optional[str]]]:
+    """
+    Stores the question and answer pairs and returns the rows for an AnswerLookup in the same order.
+    """
+    rows = [(uuid4(), uuid4(), answer) for _, answer in pairs]
+    await Answer.bulk_create(
+        [
+            Answer(id=answer_id, text=answer, formatted_text=answer)
+            for _, answer_id, answer in rows
+        ]
+    )
+    await Question.bulk_create(
+        [
+            Question(
+                id=question_id,
+                text=question,
+                formatted_text=question,
+                answer_id=answer_id,
+            )
+            for (question, _), (question_id, answer_id, _) in zip(pairs, rows)
+        ]
+    )
+    return rows
+
+
+def stub_models(
+    questions: List[str],
+    rows: List[Tuple[UUID, Optional[UUID], Optional[str]]],
+    embedding_delay: float = 0.0,
+) -> QuestionAnsweringModels:
+    embedder = StubEmbedder.create(delay=embedding_delay)
+    return QuestionAnsweringModels(
+        embedder=InstrumentedEmbedder(embedder),
+        classifier=None,
+        index=InstrumentedNearestNeighbors(
+            StubNearestNeighbors.create(embedder.embed(questions))
+        ),
+        answers=AnswerLookup.create(rows),
+        version=BENCHMARK_VERSION,
+    )
+
+
+@asynccontextmanager
+async def in_process_client(
+    pairs: List[Tuple[str, str]], embedding_delay: float = 0.0
+) -> AsyncIterator[httpx.AsyncClient]:
+    """
+    Starts the app in this process against an in-memory database seeded with the pairs, stub question answering models
+    and an in-memory session store, and yields a client that calls it directly over ASGI.
+    """
+    await Tortoise.init(
+        config={
+            "connections": {"default": "sqlite://:memory:"},
+            "apps": {
+                "models": {
+                    "models": ["autoguru.persistence", "autoguru.webservices.models"],
+                    "default_connection": "default",
+                }
+            },
+        }
+    )
+    try:
+        await Tortoise.generate_schemas()
+        instrument_database()
+        await configure_admin(InMemoryRedis())
+        await Admin.create(username=BENCHMARK_USERNAME, password=BENCHMARK_PASSWORD)
+
+        rows = await seed_database(pairs)
+        await start_question_answering(
+            stub_models(
+                [question for question, _ in pairs],
+                rows,
+                embedding_delay=embedding_delay,
+            )
+        )
+        try:
+            async with httpx.AsyncClient(
+                transport=httpx.ASGITransport(app=app, raise_app_exceptions=False),
+                base_url="http://benchmark",
+            ) as client:
+                yield client
+        finally:
+            await stop_question_answering()
+    finally:
+        await Tortoise.close_connections()
+
+
+async def login(client: httpx.AsyncClient, username: str, password: str) -> None:
+    response = await client.post(
+        "/admin/login", data={"username": username, "password": password}
+    )
+    if response.status_code != 303:
+        raise ValueError(f"Couldn't log in to the admin as {username}")
+
+
+async def query_count(client: httpx.AsyncClient) -> Optional[int]:
+    """
+    Reads how many database queries the server has run from its metrics, or None if they aren't available.
+    """
+    response = await client.get("/metrics")
+    if response.status_code != 200:
+        return None
+    return int(sum(float(count) for count in _QUERY_COUNT.findall(response.text)))
+
+
+Scenario = Callable[
+    [httpx.AsyncClient, random.Random, List[str]], Awaitable[httpx.Response]
+]
+
+
+async def _answer(
+    client: httpx.AsyncClient, rng: random.Random, questions: List[str]
+) -> httpx.Response:
+    return await client.post(
+        "/api/answer", json={"questions": rng.choice(questions), "k": 3}
+    )
+
+
+async def _answer_batch(
+    client: httpx.AsyncClient, rng: random.Random, questions: List[str]
+) -> httpx.Response:
+    return await client.post(
+        "/api/answer", json={"questions": rng.sample(questions, 16), "k": 3}
+    )
+
+
+async def _admin_list(
+    client: httpx.AsyncClient, rng: random.Random, questions: List[str]
+) -> httpx.Response:
+    return await client.get(
+        "/admin/question/list", params={"page_num": rng.randint(1, 10)}
+    )
+
+
+async def _admin_search(
+    client: httpx.AsyncClient, rng: random.Random, questions: List[str]
+) -> httpx.Response:
+    return await client.get(
+        "/admin/question/list", params={"formatted_text": rng.choice(_SEARCH_TERMS)}
+    )
+
+
+async def _dashboard(
+    client: httpx.AsyncClient, rng: random.Random, questions: List[str]
+) -> httpx.Response:
+    return await client.get("/admin/")
+
+
+SCENARIOS: Dict[str, Scenario] = {
+    "answer": _answer,
+    "answer_batch": _answer_batch,
+    "admin_list": _admin_list,
+    "admin_search": _admin_search,
+    "dashboard": _dashboard,
+}
+ADMIN_SCENARIOS: List[str] = ["admin_list", "admin_search", "dashboard"]
+
+
+@dataclass
+class _Samples:
+    latencies: List[float] = field(default_factory=list)
+    status_codes: Dict[int, int] = field(default_factory=dict)
+    errors: int = 0
+    queries_per_request: Optional[float] = None
+
+    def report(self, duration: float) -> Dict[str, Any]:
+        latencies = np.asarray(self.latencies) * 1000.0
+        p50, p95, p99 = (
+            np.percentile(latencies, [50, 95, 99]).tolist()
+            if len(latencies)
+            else (None, None, None)
+        )
+        return {
+            "requests": len(self.latencies),
+            "errors": self.errors,
+            "status_codes": {
+                str(status): count
+                for status, count in sorted(self.status_codes.items())
+            },
+            "throughput_rps": len(self.latencies) / duration if duration else None,
+            "latency_ms": {
+                "p50": p50,
+                "p95": p95,
+                "p99": p99,
+                "mean": latencies.mean().item() if len(latencies) else None,
+                "max": latencies.max().item() if len(latencies) else None,
+            },
+            "queries_per_request": self.queries_per_request,
+        }
+
+
+async def _timed(
+    client: httpx.AsyncClient,
+    scenario: Scenario,
+    rng: random.Random,
+    questions: List[str],
+    samples: _Samples,
+) -> None:
+    start = time.perf_counter()
+    try:
+        response = await scenario(client, rng, questions)
+    except httpx.HTTPError:
+        samples.latencies.append(time.perf_counter() - start)
+        samples.errors += 1
+        return
+
+    samples.latencies.append(time.perf_counter() - start)
+    samples.status_codes[response.status_code] = (
+        samples.status_codes.get(response.status_code, 0) + 1
+    )
+    if response.status_code >= 400:
+        samples.errors += 1
+
+
+async def run_benchmark(
+    client: httpx.AsyncClient,
+    questions: List[str],
+    mix: Dict[str, float] = DEFAULT_MIX,
+    concurrency: int = 16,
+    requests: int = 1000,
+    warmup: int = 50,
+    probes: int = 10,
+    seed: int = 0,
+) -> Dict[str, Any]:
+    """
+    Drives a weighted mix of scenarios against the app with a fixed number of concurrent clients.
+
+    Before the timed run, each scenario is sent probes times one at a time to measure how many database queries it takes.
+    Against a server with several workers the query counts only cover whichever worker served /metrics, so they're only
+    meaningful in process or against a single worker.
+
+    Args:
+        client (httpx.AsyncClient): the client to send requests with, already logged in to the admin if the mix uses it
+        questions (List[str]): the questions to ask the answer API
+        mix (Dict[str, float]): the relative weight of each scenario in SCENARIOS
+        concurrency (int): how many requests are in flight at once
+        requests (int): how many requests to time
+        warmup (int): how many untimed requests to send first
+        probes (int): how many sequential requests per scenario to count queries over, 0 to skip counting
+        seed (int): seeds which scenarios and questions are picked
+
+    Returns:
+        The JSON serializable report with overall and per scenario latency percentiles and throughput
+    """
+    unknown = set(mix) - set(SCENARIOS)
+    if unknown:
+        raise ValueError(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+
+    names = [name for name, weight in mix.items() if weight > 0]
+    weights = [mix[name] for name in names]
+    rng = random.Random(seed)
+
+    discarded = _Samples()
+    for _ in range(warmup):
+        scenario = SCENARIOS[rng.choices(names, weights)[0]]
+        await _timed(client, scenario, rng, questions, discarded)
+
+    samples = {name: _Samples() for name in names}
+    if probes > 0 and await query_count(client) is not None:
+        for name in names:
+            before = await query_count(client)
+            for _ in range(probes):
+                await _timed(client, SCENARIOS[name], rng, questions, _Samples())
+            after = await query_count(client)
+            samples[name].queries_per_request = (after - before) / probes
+
+    # The scenarios are picked up front so the mix of a run is the same however the workers interleave
+    schedule = [rng.choices(names, weights)[0] for _ in range(requests)]
+    worker_rngs = [random.Random(rng.random()) for _ in range(concurrency)]
+    remaining = iter(schedule)
+    overall = _Samples()
+
+    async def worker(worker_rng: random.Random) -> None:
+        for name in remaining:
+            await _timed(client, SCENARIOS[name], worker_rng, questions, samples[name])
+
+    before = await query_count(client)
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(worker_rng) for worker_rng in worker_rngs))
+    duration = time.perf_counter() - start
+    if before is not None and requests > 0:
+        overall.queries_per_request = (await query_count(client) - before) / requests
+
+    for scenario_samples in samples.values():
+        overall.latencies.extend(scenario_samples.latencies)
+        overall.errors += scenario_samples.errors
+        for status, count in scenario_samples.status_codes.items():
+            overall.status_codes[status] = overall.status_codes.get(status, 0) + count
+
+    return {
+        "concurrency": concurrency,
+        "duration_s": duration,
+        **overall.report(duration),
+        "scenarios": {
+            name: scenario_samples.report(duration)
+            for name, scenario_samples in samples.items()
+        },
+    }
+
+
+def parse_mix(mix: str) -> Dict[str, float]:
+    """
+    Parses a mix like "answer=6,admin_list=2". A scenario without a weight gets a weight of 1.
+    """
+    weights = {}
+    for part in mix.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        name, _, weight = part.partition("=")
+        weights[name.strip()] = float(weight) if weight else 1.0
+    return weights
+
+
+async def benchmark(
+    url: Optional[str] = None,
+    mix: Dict[str, float] = DEFAULT_MIX,
+    concurrency: int = 16,
+    requests: int = 1000,
+    warmup: int = 50,
+    probes: int = 10,
+    seed: int = 0,
+    corpus_size: int = 1000,
+    embedding_delay: float = 0.0,
+    username: Optional[str] = None,
+    password: Optional[str] = None,
+) -> Dict[str, Any]:
+    """
+    Benchmarks the app in process, or a running server if a URL is given.
+
+    Args:
+        url (Optional[str]): the base URL of a running server. If None, the app is run in process with stub models.
+        mix (Dict[str, float]): the relative weight of each scenario in SCENARIOS
+        concurrency (int): how many requests are in flight at once
+        requests (int): how many requests to time
+        warmup (int): how many untimed requests to send first
+        probes (int): how many sequential requests per scenario to count queries over, 0 to skip counting
+        seed (int): seeds the questions and which scenarios and questions are picked
+        corpus_size (int): how many questions to generate
+        embedding_delay (float): how many seconds the stub embedder takes per batch (in process only)
+        username (Optional[str]): the admin to log in as against a running server
+        password (Optional[str]): the admin's password
+
+    Returns:
+        The JSON serializable report
+    """
+    pairs = synthetic_questions(corpus_size, seed=seed)
+    questions = [question for question, _ in pairs]
+    uses_admin = any(mix.get(name, 0) > 0 for name in ADMIN_SCENARIOS)
+
+    if url is None:
+        async with in_process_client(pairs, embedding_delay=embedding_delay) as client:
+            if uses_admin:
+                await login(client, BENCHMARK_USERNAME, BENCHMARK_PASSWORD)
+            report = await run_benchmark(
+                client,
+                questions,
+                mix=mix,
+                concurrency=concurrency,
+                requests=requests,
+                warmup=warmup,
+                probes=probes,
+                seed=seed,
+            )
+        return {"target": "in-process", **report}
+
+    async with httpx.AsyncClient(
+        base_url=url,
+        timeout=60.0,
+        limits=httpx.Limits(max_connections=concurrency),
+    ) as client:
+        if uses_admin:
+            if username is None or password is None:
+                raise ValueError(
+                    "A username and password are needed to benchmark the admin"
+                )
+            await login(client, username, password)
+        report = await run_benchmark(
+            client,
+            questions,
+            mix=mix,
+            concurrency=concurrency,
+            requests=requests,
+            warmup=warmup,
+            probes=probes,
+            seed=seed,
+        )
+    return {"target": url, **report}
@@ -0,0 +1,273 @@
+import logging
+import math
+import time
+from typing import Any, Dict, List, Optional, Tuple, Type, Union
+
+import aioredis
+from fastapi_admin.resources import Model as ModelResource
+from fastapi_admin.resources import Resource
+from starlette.middleware.base import RequestResponseEndpoint
+from starlette.requests import Request
+from starlette.responses import Response
+from tortoise import Model
+from tortoise.signals import post_delete, post_save
+
+from autoguru.questionanswering.utilities.caching import TTLCache
+from autoguru.webservices import settings
+from autoguru.webservices.models import Admin, Answer, Question
+
+LOGGER: logging.Logger = logging.getLogger(__name__)
+
+MEMORY_URL: str = "memory://"
+
+
+class InMemoryRedis:
+    """
+    An in-process stand in for the parts of the aioredis client that fastapi-admin uses to store sessions.
+
+    Like a client created with decode_responses=True, values are stored and returned as strings. This only works for a
+    single process: sessions created by one worker are invisible to the others.
+
+    Args:
+        max_size (int): the most keys to keep. The least recently used key is evicted to make room for a new one.
+    """
+
+    def __init__(self, max_size: int = settings.ADMIN_CACHE_MAX_SIZE) -> None:
+        self._cache: TTLCache[str, str] = TTLCache(max_size=max_size, name="sessions")
+
+    async def get(self, key: str) -> Optional[str]:
+        return self._cache.get(key)
+
+    async def set(
+        self,
+        key: str,
+        value: Any,
+        ex: Optional[int] = None,
+        px: Optional[int] = None,
+        nx: bool = False,
+        xx: bool = False,
+    ) -> Optional[bool]:
+        exists = key in self._cache
+        if (nx and exists) or (xx and not exists):
+            return None
+
+        ttl = ex if ex is not None else px / 1000.0 if px is not None else None
+        self._cache.set(key, value if isinstance(value, str) else str(value), ttl=ttl)
+        return True
+
+    async def delete(self, *keys: str) -> int:
+        return sum(self._cache.delete(key) for key in keys)
+
+    async def exists(self, *keys: str) -> int:
+        return sum(key in self._cache for key in keys)
+
+    async def incr(self, key: str) -> int:
+        expires = self._cache.expires(key)
+        value = int(self._cache.get(key, "0")) + 1
+        self._cache.set(
+            key,
+            str(value),
+            ttl=expires - time.monotonic() if expires is not None else None,
+        )
+        return value
+
+    async def expire(self, key: str, seconds: int) -> bool:
+        value = self._cache.get(key)
+        if value is None:
+            return False
+        self._cache.set(key, value, ttl=seconds)
+        return True
+
+    async def ttl(self, key: str) -> int:
+        if key not in self._cache:
+            return -2
+        expires = self._cache.expires(key)
+        return math.ceil(expires - time.monotonic()) if expires is not None else -1
+
+    async def close(self) -> None:
+        self._cache.clear()
+
+
+def create_session_store(
+    url: str = settings.ADMIN_CACHE_URL,
+) -> Union[aioredis.Redis, InMemoryRedis]:
+    if url == MEMORY_URL:
+        return InMemoryRedis()
+    return aioredis.from_url(url, decode_responses=True, encoding="utf8")
+
+
+def check_workers(workers: int) -> None:
+    """
+    Checks the admin caches work with this many worker processes. The in-process session store and the page cache only
+    cover the worker they're in, so with the in-process store a login would only be seen by the worker that handled it,
+    and a change only invalidates the cached pages of the worker that made it.
+
+    Args:
+        workers (int): how many worker processes will serve the admin
+
+    Raises:
+        ValueError: if the in-process session store would be used by more than one worker
+    """
+    if workers <= 1:
+        return
+
+    if settings.ADMIN_CACHE_URL == MEMORY_URL:
+        raise ValueError(
+            f"The in-process admin session store ({MEMORY_URL}) can't be shared between {workers} workers, so set "
+            "AUTOGURU_ADMIN_CACHE_URL to a Redis URL or run one worker"
+        )
+    if settings.ADMIN_PAGE_CACHE_MAX_SIZE > 0 and settings.ADMIN_PAGE_CACHE_TTL > 0:
+        LOGGER.warning(
+            "Each of the %d workers caches admin pages by itself and changes only invalidate the worker that made "
+            "them, so the others can show pages up to %s seconds old. Set AUTOGURU_ADMIN_PAGE_CACHE_TTL=0 to turn the "
+            "page cache off.",
+            workers,
+            settings.ADMIN_PAGE_CACHE_TTL,
+        )
+
+
+# The resources whose pages show each resource's models. Question pages show their answers, and deleting an answer
+# deletes its questions without any signals.
+RELATED_RESOURCES: Dict[str, Tuple[str, ...]] = {"answer": ("question",)}
+
+
+class PageCache:
+    """
+    Caches rendered admin pages per admin. Each resource has a generation that's bumped whenever one of its models
+    changes, and since the generation is part of the key, bumping it invalidates every cached page for that resource.
+    The generations of the resources whose pages show it are bumped too.
+
+    Args:
+        max_size (int): the most pages to keep
+        ttl (float): how many seconds a page is kept for at most
+        related (Dict[str, Tuple[str, ...]]): the other resources to invalidate when each resource changes
+    """
+
+    def __init__(
+        self,
+        max_size: int = settings.ADMIN_PAGE_CACHE_MAX_SIZE,
+        ttl: float = settings.ADMIN_PAGE_CACHE_TTL,
+        related: Dict[str, Tuple[str, ...]] = RELATED_RESOURCES,
+    ) -> None:
+        self._pages: TTLCache[
+            Tuple[Any, ...], Tuple[int, List[Tuple[bytes, bytes]], bytes]
+        ] = TTLCache(max_size=max_size, ttl=ttl, name="admin_pages")
+        self._counts: TTLCache[Tuple[str, int], int] = TTLCache(
+            max_size=max_size, ttl=ttl, name="admin_counts"
+        )
+        self._generations: Dict[str, int] = {}
+        self._related: Dict[str, Tuple[str, ...]] = related
+
+    def generation(self, resource: str) -> int:
+        return self._generations.get(resource, 0)
+
+    def invalidate(self, resource: str) -> None:
+        for invalidated in (resource, *self._related.get(resource, ())):
+            self._generations[invalidated] = self.generation(invalidated) + 1
+
+    def get(self, admin: Any, resource: str, request: Request) -> Optional[Response]:
+        page = self._pages.get(self._key(admin, resource, request))
+        if page is None:
+            return None
+
+        status_code, headers, body = page
+        response = Response(content=body, status_code=status_code)
+        response.raw_headers = list(headers)
+        return response
+
+    async def set(
+        self, admin: Any, resource: str, request: Request, response: Response
+    ) -> Response:
+        body = b"".join([chunk async for chunk in response.body_iterator])
+        headers = [
+            (name, value)
+            for name, value in response.raw_headers
+            if name.lower() != b"set-cookie"
+        ]
+        self._pages.set(
+            self._key(admin, resource, request),
+            (response.status_code, headers, body),
+        )
+
+        cached = Response(content=body, status_code=response.status_code)
+        cached.raw_headers = list(response.raw_headers)
+        return cached
+
+    async def count(self, model: Type[Model]) -> int:
+        resource = model.__name__.lower()
+        key = (resource, self.generation(resource))
+        count = self._counts.get(key)
+        if count is None:
+            count = await model.all().count()
+            self._counts.set(key, count)
+        return count
+
+    def _key(self, admin: Any, resource: str, request: Request) -> Tuple[Any, ...]:
+        return (
+            admin.pk,
+            resource,
+            self.generation(resource),
+            request.url.path,
+            request.url.query,
+        )
+
+
+PAGE_CACHE: PageCache = PageCache()
+
+
+def _path_parts(request: Request) -> List[str]:
+    # Depending on the Starlette version, mounted apps see their path either relative to the mount or in full
+    path = request.scope["path"]
+    root_path = request.scope.get("root_path", "")
+    if root_path and path.startswith(root_path):
+        path = path[len(root_path) :]
+    return [part for part in path.split("/") if part]
+
+
+async def cache_pages(request: Request, call_next: RequestResponseEndpoint) -> Response:
+    """
+    Admin middleware that serves list pages from the PageCache. It has to be added before fastapi-admin is configured so
+    the login provider's middleware runs first and request.state.admin is already set.
+    """
+    parts = _path_parts(request)
+    if request.method != "GET":
+        # The admin's delete routes bypass model signals, so any write through the admin invalidates its resource
+        response = await call_next(request)
+        if parts:
+            PAGE_CACHE.invalidate(parts[0])
+        return response
+
+    admin = getattr(request.state, "admin", None)
+    if admin is None or len(parts) != 2 or parts[1] != "list":
+        return await call_next(request)
+
+    resource = parts[0]
+
+    cached = PAGE_CACHE.get(admin, resource, request)
+    if cached is not None:
+        return cached
+
+    response = await call_next(request)
+    if response.status_code != 200:
+        return response
+    return await PAGE_CACHE.set(admin, resource, request, response)
+
+
+async def resource_counts(resources: List[Type[Resource]]) -> Dict[str, int]:
+    return {
+        resource.label: await PAGE_CACHE.count(resource.model)
+        for resource in resources
+        if issubclass(resource, ModelResource)
+    }
+
+
+@post_save(Admin, Answer, Question)
+async def invalidate_saved(
+    sender: Type[Model], instance: Model, created: bool, using_db, update_fields
+) -> None:
+    PAGE_CACHE.invalidate(sender.__name__.lower())
+
+
+@post_delete(Admin, Answer, Question)
+async def invalidate_deleted(sender: Type[Model], instance: Model, using_db) -> None:
+    PAGE_CACHE.invalidate(sender.__name__.lower())
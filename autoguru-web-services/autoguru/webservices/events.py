@@ -1,21 +1,29 @@
 import os
+from typing import Optional, Union
 
 import aioredis
 from fastapi_admin.app import app as admin_app
 from fastapi_admin.providers.login import UsernamePasswordProvider
 
+from autoguru.webservices import settings
+from autoguru.webservices.artifacts import ArtifactManager
+from autoguru.webservices.cache import InMemoryRedis, create_session_store
+from autoguru.webservices.instrumentation import MetricsWriter, instrument_database
 from autoguru.webservices.main import app
 from autoguru.webservices.models import Admin
-from autoguru.webservices.settings import BASE_DIR
+from autoguru.webservices.questionanswering import (
+    QuestionAnsweringModels,
+    preloaded_artifacts,
+)
+from autoguru.webservices.service import QuestionAnsweringService
+from autoguru.webservices.settings import (
+    ARTIFACTS_MANIFEST,
+    ARTIFACTS_POLL_INTERVAL,
+    BASE_DIR,
+)
 
 
-@app.on_event("startup")
-async def startup():
-    redis = aioredis.from_url(
-        "redis://localhost:6379/7",
-        decode_responses=True,
-        encoding="utf8",
-    )
+async def configure_admin(redis: Union[aioredis.Redis, InMemoryRedis]) -> None:
     await admin_app.configure(
         logo_url="/static/logo.png",
         template_folders=[os.path.join(BASE_DIR, "templates")],
@@ -27,3 +35,55 @@ async def startup():
         ],
         redis=redis,
     )
+
+
+async def start_question_answering(models: Optional[QuestionAnsweringModels]) -> None:
+    if models is None:
+        app.state.question_answering = None
+        return
+
+    artifacts = ArtifactManager(
+        models=models,
+        manifest_path=ARTIFACTS_MANIFEST,
+        poll_interval=ARTIFACTS_POLL_INTERVAL,
+    )
+    await artifacts.start()
+    app.state.question_answering = QuestionAnsweringService(artifacts=artifacts)
+
+
+async def stop_question_answering() -> None:
+    service = getattr(app.state, "question_answering", None)
+    if service is not None:
+        await service.artifacts.stop()
+        service.close()
+        app.state.question_answering = None
+
+
+@app.on_event("startup")
+async def startup():
+    await configure_admin(create_session_store())
+
+    instrument_database()
+
+    # Workers sharing a metrics directory each write theirs there for /metrics to merge
+    app.state.metrics_writer = None
+    if settings.METRICS_DIR is not None:
+        app.state.metrics_writer = MetricsWriter(settings.METRICS_DIR)
+        await app.state.metrics_writer.start()
+
+    # Only the index and answers can be preloaded, so the TensorFlow models are loaded here after the worker forks
+    artifacts = preloaded_artifacts()
+    models = (
+        artifacts.models()
+        if artifacts is not None
+        else QuestionAnsweringModels.from_settings()
+    )
+    await start_question_answering(models)
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    await stop_question_answering()
+    metrics_writer = getattr(app.state, "metrics_writer", None)
+    if metrics_writer is not None:
+        await metrics_writer.stop()
@@ -0,0 +1,130 @@
+import asyncio
+import logging
+import os
+import tempfile
+from functools import wraps
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Optional
+
+from tortoise import connections
+from tortoise.backends.base.client import BaseDBAsyncClient
+
+from autoguru.questionanswering.utilities.instrumentation import (
+    DATABASE_LATENCY,
+    REGISTRY,
+)
+from autoguru.webservices import settings
+
+LOGGER: logging.Logger = logging.getLogger(__name__)
+
+_OPERATIONS = [
+    "execute_query",
+    "execute_query_dict",
+    "execute_insert",
+    "execute_many",
+    "execute_script",
+]
+
+
+def _timed(
+    operation: str, method: Callable[..., Awaitable[Any]]
+) -> Callable[..., Awaitable[Any]]:
+    latency = DATABASE_LATENCY.labels(operation)
+
+    @wraps(method)
+    async def timed(*args: Any, **kwargs: Any) -> Any:
+        with latency.time():
+            return await method(*args, **kwargs)
+
+    timed.__instrumented__ = True  # type: ignore
+    return timed
+
+
+def instrument_connection(connection: BaseDBAsyncClient) -> None:
+    for operation in _OPERATIONS:
+        method = getattr(connection, operation)
+        if not getattr(method, "__instrumented__", False):
+            setattr(connection, operation, _timed(operation, method))
+
+
+def instrument_database() -> None:
+    """
+    Records the latency of every query run through the initialized Tortoise connections. This has to run after Tortoise is initialized.
+    """
+    for connection in connections.all():
+        instrument_connection(connection)
+
+
+def prepare_metrics_directory() -> str:
+    """
+    Sets up the directory the workers of one server write their metrics to, picking a temporary one if
+    AUTOGURU_METRICS_DIR isn't set, and clears out what an earlier server left there. This has to run in the master
+    before it forks its workers.
+
+    Returns:
+        The metrics directory
+    """
+    if settings.METRICS_DIR is None:
+        settings.METRICS_DIR = tempfile.mkdtemp(prefix="autoguru-metrics-")
+        # Workers started later by gunicorn see it too
+        os.environ["AUTOGURU_METRICS_DIR"] = settings.METRICS_DIR
+    directory = Path(settings.METRICS_DIR)
+    directory.mkdir(parents=True, exist_ok=True)
+    for process_file in directory.glob("*.json"):
+        process_file.unlink(missing_ok=True)
+    return settings.METRICS_DIR
+
+
+def render_metrics() -> str:
+    """
+    Renders the metrics of every worker if they share a metrics directory, or just this process's otherwise.
+    """
+    if settings.METRICS_DIR is None:
+        return REGISTRY.render()
+    return REGISTRY.render_processes(settings.METRICS_DIR)
+
+
+class MetricsWriter:
+    """
+    Writes this worker's metrics to the shared metrics directory every interval, so whichever worker serves a scrape
+    can merge in the others'. A scrape sees the other workers' metrics as of their last write.
+
+    Args:
+        directory (str): the shared metrics directory
+        interval (float): how many seconds to wait between writes
+    """
+
+    def __init__(
+        self, directory: str, interval: float = settings.METRICS_WRITE_INTERVAL
+    ) -> None:
+        self._directory: str = directory
+        self._interval: float = interval
+        self._writer: Optional[asyncio.Task] = None
+
+    def write(self) -> None:
+        try:
+            REGISTRY.write(self._directory)
+        except OSError:
+            LOGGER.exception("Couldn't write metrics to %s", self._directory)
+
+    async def _write_periodically(self) -> None:
+        while True:
+            self.write()
+            await asyncio.sleep(self._interval)
+
+    async def start(self) -> None:
+        if self._writer is None:
+            self._writer = asyncio.get_running_loop().create_task(
+                self._write_periodically()
+            )
+
+    async def stop(self) -> None:
+        if self._writer is not None:
+            self._writer.cancel()
+            try:
+                await self._writer
+            except asyncio.CancelledError:
+                pass
+            self._writer = None
+        # The last of what this worker counted is kept once it's gone
+        self.write()
@@ -8,6 +8,7 @@ from fastapi_admin.exceptions import (
     server_error_exception,
     unauthorized_error_exception,
 )
+from starlette.middleware.base import BaseHTTPMiddleware
 from starlette.middleware.cors import CORSMiddleware
 from starlette.staticfiles import StaticFiles
 from starlette.status import (
@@ -18,6 +19,7 @@ from starlette.status import (
 )
 from tortoise.contrib.fastapi import register_tortoise
 
+from .cache import cache_pages
 from .settings import BASE_DIR
 
 app = FastAPI()
@@ -33,6 +35,8 @@ admin_app.add_exception_handler(HTTP_500_INTERNAL_SERVER_ERROR, server_error_exc
 admin_app.add_exception_handler(HTTP_404_NOT_FOUND, not_found_error_exception)
 admin_app.add_exception_handler(HTTP_403_FORBIDDEN, forbidden_error_exception)
 admin_app.add_exception_handler(HTTP_401_UNAUTHORIZED, unauthorized_error_exception)
+# Added before the admin is configured so its login middleware wraps this one and has already found the admin
+admin_app.add_middleware(BaseHTTPMiddleware, dispatch=cache_pages)
 
 
 app.mount("/admin", admin_app)
@@ -58,3 +62,7 @@ register_tortoise(
     },
     generate_schemas=True,
 )
+
+# These register the admin resources, routes and startup events on the apps. They import the app from this module, so
+# they have to come after it's created.
+from autoguru.webservices import admin, api, events, routes  # noqa: E402,F401
@@ -0,0 +1,356 @@
+import json
+import time
+from dataclasses import dataclass, field, replace
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple, Union, cast
+
+import numpy as np
+
+from autoguru.questionanswering.answering import BatchAnswerer, load_classifier
+from autoguru.questionanswering.answers import AnswerCache, AnswerLookup, lookup_path
+from autoguru.questionanswering.bundle import Bundle, is_bundle
+from autoguru.questionanswering.embeddings import Embedder
+from autoguru.questionanswering.embeddings.instrumented import InstrumentedEmbedder
+from autoguru.questionanswering.embeddings.projection import for_index
+from autoguru.questionanswering.nearestneighbors import NearestNeighbors, index_class
+from autoguru.questionanswering.nearestneighbors.instrumented import (
+    InstrumentedNearestNeighbors,
+)
+from autoguru.questionanswering.pipeline import AnsweredQuestion
+from autoguru.questionanswering.questionclassification import (
+    DEFAULT_MIN_CONFIDENCE,
+    QuestionClassifier,
+)
+from autoguru.webservices import settings
+
+# Answered questions are the batch answerer's, so every frontend returns the same thing
+QuestionAnswer = AnsweredQuestion
+
+MANIFEST_FILE: str = "manifest.json"
+DEFAULT_VERSION: str = "unversioned"
+
+
+@dataclass
+class Manifest:
+    """
+    Describes one version of the question answering artifacts. Relative paths in the manifest file are resolved against
+    the directory the manifest is in.
+
+    {
+        "version": "2022-03-01",
+        "embedder": "https://tfhub.dev/google/universal-sentence-encoder/4",
+        "index": "questions.index",
+        "index_type": "descent",
+        "classifier": "classifier",
+        "answers": "questions.index.answers",
+        "warmup": ["How do I reset my password?"]
+    }
+
+    Only "version" and "index" are required. The index can also be a bundle, which brings its own embedder, classifier
+    and answers.
+    """
+
+    version: str
+    index_path: Path
+    index_type: str = settings.INDEX_TYPE
+    embedder_url: str = settings.EMBEDDER_URL
+    classifier_path: Optional[Path] = None
+    answers_path: Optional[Path] = None
+    warmup: List[str] = field(default_factory=list)
+
+    @classmethod
+    def path(cls, manifest_path: Union[str, Path]) -> Path:
+        if isinstance(manifest_path, str):
+            manifest_path = Path(manifest_path)
+
+        if manifest_path.is_dir():
+            manifest_path = manifest_path.joinpath(MANIFEST_FILE)
+        return manifest_path
+
+    @classmethod
+    def read(cls, manifest_path: Union[str, Path]) -> "Manifest":
+        manifest_path = cls.path(manifest_path)
+        with manifest_path.open("r", encoding="UTF-8") as in_file:
+            manifest = json.load(in_file)
+
+        directory = manifest_path.parent
+        return cls(
+            version=str(manifest["version"]),
+            index_path=directory.joinpath(manifest["index"]),
+            index_type=manifest.get("index_type", settings.INDEX_TYPE),
+            embedder_url=manifest.get("embedder", settings.EMBEDDER_URL),
+            classifier_path=(
+                directory.joinpath(manifest["classifier"])
+                if manifest.get("classifier") is not None
+                else None
+            ),
+            answers_path=(
+                directory.joinpath(manifest["answers"])
+                if manifest.get("answers") is not None
+                else None
+            ),
+            warmup=list(manifest.get("warmup", [])),
+        )
+
+
+@lru_cache(maxsize=None)
+def load_embedder(url: str) -> Embedder:
+    from autoguru.questionanswering.embeddings.tfhub import TfHubEmbedder
+
+    # Embedders aren't versioned with the other artifacts, so every version using the same model shares one copy
+    return TfHubEmbedder.create(url)
+
+
+def create_answer_cache() -> Optional[AnswerCache["QuestionAnswer"]]:
+    if settings.ANSWER_CACHE_SIZE <= 0:
+        return None
+    return AnswerCache(
+        max_size=settings.ANSWER_CACHE_SIZE,
+        ttl=settings.ANSWER_CACHE_TTL,
+        similarity=settings.ANSWER_CACHE_SIMILARITY,
+        recent_size=settings.ANSWER_CACHE_RECENT_SIZE,
+    )
+
+
+@dataclass
+class QuestionAnsweringModels:
+    embedder: Embedder
+    classifier: Optional[QuestionClassifier]
+    index: NearestNeighbors
+    answers: AnswerLookup
+    version: str = DEFAULT_VERSION
+    # Each version gets its own cache so a reload never serves answers from the previous version
+    cache: Optional[AnswerCache["QuestionAnswer"]] = None
+    min_confidence: float = DEFAULT_MIN_CONFIDENCE
+    answerer: BatchAnswerer = field(init=False, repr=False)
+
+    def __post_init__(self) -> None:
+        self.answerer = BatchAnswerer(
+            embedder=self.embedder,
+            index=self.index,
+            answers=self.answers,
+            classifier=self.classifier,
+            min_confidence=self.min_confidence,
+        )
+
+    @classmethod
+    def load(
+        cls,
+        embedder_url: str,
+        index_path: Union[str, Path],
+        index_type: str,
+        classifier_path: Optional[Union[str, Path]] = None,
+        answers_path: Optional[Union[str, Path]] = None,
+        version: str = DEFAULT_VERSION,
+    ) -> "QuestionAnsweringModels":
+        return IndexArtifacts.load(
+            embedder_url=embedder_url,
+            index_path=index_path,
+            index_type=index_type,
+            classifier_path=classifier_path,
+            answers_path=answers_path,
+            version=version,
+        ).models()
+
+    @classmethod
+    def from_bundle(
+        cls, bundle_path: Union[str, Path], version: Optional[str] = None
+    ) -> "QuestionAnsweringModels":
+        return IndexArtifacts.from_bundle(bundle_path, version=version).models()
+
+    @classmethod
+    def from_manifest(cls, manifest: Manifest) -> "QuestionAnsweringModels":
+        return IndexArtifacts.from_manifest(manifest).models()
+
+    @classmethod
+    def from_settings(cls) -> Optional["QuestionAnsweringModels"]:
+        artifacts = IndexArtifacts.from_settings()
+        return artifacts.models() if artifacts is not None else None
+
+
+@dataclass
+class IndexArtifacts:
+    """
+    The parts of the question answering models that are safe to load before gunicorn forks its workers: the memory
+    mapped index and answer lookup, and the bundle they came from. TensorFlow isn't fork safe, so the embedder and
+    classifier are only loaded by models(), which each worker calls after it forks.
+    """
+
+    index: NearestNeighbors
+    answers: AnswerLookup
+    embedder_url: str
+    index_path: Path
+    classifier_path: Optional[Path] = None
+    bundle: Optional[Bundle] = None
+    version: str = DEFAULT_VERSION
+
+    def models(self) -> QuestionAnsweringModels:
+        """
+        Loads the embedder and classifier to answer questions with the index.
+        """
+        embedder = load_embedder(self.embedder_url)
+        if self.bundle is not None:
+            projected = self.bundle.project(embedder)
+            classifier_path = (
+                self.bundle.classifier_path() if self.bundle.has_classifier else None
+            )
+        else:
+            projected = for_index(embedder, self.index_path)
+            classifier_path = self.classifier_path
+        return QuestionAnsweringModels(
+            embedder=InstrumentedEmbedder(projected),
+            classifier=(
+                load_classifier(embedder, classifier_path)
+                if classifier_path is not None
+                else None
+            ),
+            index=InstrumentedNearestNeighbors(self.index),
+            answers=self.answers,
+            version=self.version,
+            cache=create_answer_cache(),
+            min_confidence=settings.MIN_CONFIDENCE,
+        )
+
+    @classmethod
+    def load(
+        cls,
+        embedder_url: str,
+        index_path: Union[str, Path],
+        index_type: str,
+        classifier_path: Optional[Union[str, Path]] = None,
+        answers_path: Optional[Union[str, Path]] = None,
+        version: str = DEFAULT_VERSION,
+    ) -> "IndexArtifacts":
+        if isinstance(index_path, str):
+            index_path = Path(index_path)
+
+        if is_bundle(index_path):
+            return cls.from_bundle(
+                index_path, version=version if version != DEFAULT_VERSION else None
+            )
+
+        return cls(
+            index=index_class(index_type).load(index_path),
+            answers=AnswerLookup.load(
+                answers_path if answers_path is not None else lookup_path(index_path)
+            ),
+            embedder_url=embedder_url,
+            index_path=index_path,
+            classifier_path=(
+                Path(classifier_path) if classifier_path is not None else None
+            ),
+            version=version,
+        )
+
+    @classmethod
+    def from_bundle(
+        cls, bundle_path: Union[str, Path], version: Optional[str] = None
+    ) -> "IndexArtifacts":
+        bundle = Bundle.load(bundle_path)
+        return cls(
+            index=bundle.index(),
+            answers=bundle.answers(),
+            embedder_url=bundle.manifest.embedder_url,
+            index_path=Path(bundle_path),
+            bundle=bundle,
+            version=version if version is not None else bundle.manifest.version,
+        )
+
+    @classmethod
+    def from_manifest(cls, manifest: Manifest) -> "IndexArtifacts":
+        return cls.load(
+            embedder_url=manifest.embedder_url,
+            index_path=manifest.index_path,
+            index_type=manifest.index_type,
+            classifier_path=manifest.classifier_path,
+            answers_path=manifest.answers_path,
+            version=manifest.version,
+        )
+
+    @classmethod
+    def from_settings(cls) -> Optional["IndexArtifacts"]:
+        if settings.ARTIFACTS_MANIFEST is not None:
+            return cls.from_manifest(Manifest.read(settings.ARTIFACTS_MANIFEST))
+
+        if settings.INDEX_PATH is None:
+            return None
+
+        return cls.load(
+            embedder_url=settings.EMBEDDER_URL,
+            index_path=settings.INDEX_PATH,
+            index_type=settings.INDEX_TYPE,
+            classifier_path=settings.CLASSIFIER_PATH,
+            answers_path=settings.ANSWERS_PATH,
+        )
+
+
+_preloaded: Optional[IndexArtifacts] = None
+
+
+def preload() -> None:
+    global _preloaded
+    _preloaded = IndexArtifacts.from_settings()
+
+
+def preloaded_artifacts() -> Optional[IndexArtifacts]:
+    return _preloaded
+
+
+def answer_questions(
+    models: QuestionAnsweringModels,
+    questions: List[str],
+    k: int = 1,
+    answer_all: bool = False,
+) -> Tuple[List[QuestionAnswer], Dict[str, float]]:
+    """
+    Runs a batch of questions through answer cache -> classify -> embed -> nearest neighbors -> answer lookup. Each stage runs once for the whole batch, and only for the questions the previous stages didn't settle.
+
+    Args:
+        models (QuestionAnsweringModels): the models to answer with
+        questions (List[str]): the questions to answer
+        k (int): how many answers to find for each question
+        answer_all (bool): whether to answer text the classifier doesn't think is a question
+
+    Returns:
+        The answers for each question and the time spent in each stage in milliseconds
+    """
+    timings: Dict[str, float] = {}
+    scope = (k, answer_all)
+
+    results: List[Optional[QuestionAnswer]] = [None] * len(questions)
+    pending = list(range(len(questions)))
+    # Embeddings of the pending questions, if the cache already had to embed them
+    vectors: Optional[np.ndarray] = None
+    if models.cache is not None:
+        start = time.perf_counter()
+        lookup = models.cache.lookup(
+            questions, embed=models.embedder.embed, scope=scope
+        )
+        for i, cached in enumerate(lookup.values):
+            if cached is not None:
+                results[i] = replace(cached, question=questions[i])
+        pending = lookup.misses
+        vectors = lookup.vectors
+        timings["cache"] = (time.perf_counter() - start) * 1000.0
+
+    if pending:
+        answered = models.answerer.answer_questions(
+            [questions[i] for i in pending],
+            k=k,
+            answer_all=answer_all,
+            vectors=vectors,
+            timings=timings,
+        )
+        for row, (i, result) in enumerate(zip(pending, answered)):
+            results[i] = result
+            if models.cache is not None:
+                # The cache only keeps vectors for its similarity tier, which is when the lookup embedded the questions
+                models.cache.set(
+                    result.question,
+                    result,
+                    scope=scope,
+                    vector=vectors[row] if vectors is not None else None,
+                )
+
+    return cast(List[QuestionAnswer], results), timings
@@ -5,6 +5,7 @@ from fastapi_admin.template import templates
 from starlette.requests import Request
 from starlette.responses import RedirectResponse
 
+from autoguru.webservices.cache import resource_counts
 from autoguru.webservices.models import Admin
 
 
@@ -21,6 +22,7 @@ async def home(
         context={
             "request": request,
             "resources": resources,
+            "counts": await resource_counts(request.app.resources),
             "resource_label": "Dashboard",
             "page_pre_title": "overview",
             "page_title": "Dashboard",
@@ -0,0 +1,93 @@
+import gc
+from typing import Any, Dict
+
+from gunicorn.app.base import BaseApplication
+from gunicorn.arbiter import Arbiter
+from gunicorn.util import import_app
+
+from autoguru.questionanswering.utilities.instrumentation import REGISTRY
+from autoguru.webservices import settings
+from autoguru.webservices.cache import check_workers
+from autoguru.webservices.instrumentation import prepare_metrics_directory
+from autoguru.webservices.questionanswering import preload, preloaded_artifacts
+
+APP: str = "autoguru.webservices.main:app"
+WORKER_CLASS: str = "uvicorn.workers.UvicornWorker"
+
+
+def _freeze(server: Arbiter) -> None:
+    # Move everything allocated so far into the permanent generation so the garbage collector in each worker
+    # never touches (and so never copies) the pages holding the preloaded index
+    gc.collect()
+    gc.freeze()
+
+
+def _worker_exited(server: Arbiter, worker: Any) -> None:
+    if settings.METRICS_DIR is not None:
+        REGISTRY.mark_process_dead(settings.METRICS_DIR, worker.pid)
+
+
+class Server(BaseApplication):
+    """
+    A gunicorn server running the web services on uvicorn workers.
+
+    When preloading, the question answering index and answer lookup are loaded once in the master process before it
+    forks its workers, so every worker shares the same read-only copy-on-write pages rather than loading its own copy.
+    TensorFlow isn't fork safe, so each worker still loads its own embedder and classifier after it forks, and the
+    master never imports TensorFlow at all.
+
+    Each worker keeps its own metrics, so with more than one worker they all write theirs to a shared directory
+    (AUTOGURU_METRICS_DIR, or a temporary one) and /metrics merges them: counters and histograms are summed across
+    workers, including ones that have since been replaced, and gauges get a series per live worker with a pid label.
+
+    Args:
+        host (str): the host to bind to
+        port (int): the port to bind to
+        workers (int): the number of worker processes
+        preload (bool): whether to load the app and the question answering index in the master before forking
+        max_requests (int): how many requests a worker serves before it is gracefully replaced. 0 disables recycling.
+        max_requests_jitter (int): the maximum random amount added to max_requests so workers don't all recycle at once
+        graceful_timeout (int): how many seconds a worker has to finish in-flight requests when it is recycled or stopped
+        timeout (int): how many seconds a silent worker is allowed before it is killed and replaced
+
+    Raises:
+        ValueError: if the admin caches can't be shared between the workers
+    """
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 8000,
+        workers: int = 1,
+        preload: bool = False,
+        max_requests: int = 0,
+        max_requests_jitter: int = 0,
+        graceful_timeout: int = 30,
+        timeout: int = 60,
+    ) -> None:
+        check_workers(workers)
+        self._options: Dict[str, Any] = {
+            "bind": f"{host}:{port}",
+            "workers": workers,
+            "worker_class": WORKER_CLASS,
+            "preload_app": preload,
+            "max_requests": max_requests,
+            "max_requests_jitter": max_requests_jitter,
+            "graceful_timeout": graceful_timeout,
+            "timeout": timeout,
+        }
+        if preload:
+            self._options["when_ready"] = _freeze
+        if workers > 1 or settings.METRICS_DIR is not None:
+            prepare_metrics_directory()
+            self._options["child_exit"] = _worker_exited
+        super(Server, self).__init__()
+
+    def load_config(self) -> None:
+        for key, value in self._options.items():
+            self.cfg.set(key, value)
+
+    def load(self) -> Any:
+        if self.cfg.preload_app and preloaded_artifacts() is None:
+            preload()
+        return import_app(APP)
@@ -0,0 +1,125 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Dict, List, Optional, Tuple
+
+from autoguru.questionanswering.utilities.instrumentation import QUEUE_DEPTH
+from autoguru.webservices import settings
+from autoguru.webservices.artifacts import ArtifactManager
+from autoguru.webservices.questionanswering import QuestionAnswer, answer_questions
+
+_QUEUE_DEPTH = QUEUE_DEPTH.labels("question_answering")
+
+
+class OverloadedError(Exception):
+    pass
+
+
+class QuestionAnsweringService:
+    """
+    Runs question answering batches on a bounded thread pool so the CPU bound stages stay off the event loop.
+
+    At most max_concurrency batches run at once and at most max_queue more may wait for a slot. Past that, requests are
+    rejected with an OverloadedError rather than queued without bound.
+
+    Args:
+        artifacts (ArtifactManager): provides the current version of the models to answer with
+        workers (int): the number of executor threads
+        max_concurrency (int): how many batches can run at once
+        max_queue (int): how many batches can wait for a free slot
+    """
+
+    def __init__(
+        self,
+        artifacts: ArtifactManager,
+        workers: int = settings.QA_WORKERS,
+        max_concurrency: int = settings.QA_MAX_CONCURRENCY,
+        max_queue: int = settings.QA_MAX_QUEUE,
+    ) -> None:
+        self._artifacts: ArtifactManager = artifacts
+        self._executor: ThreadPoolExecutor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="question-answering"
+        )
+        self._semaphore: asyncio.Semaphore = asyncio.Semaphore(max_concurrency)
+        self._max_queue: int = max_queue
+        self._waiting: int = 0
+
+    @property
+    def artifacts(self) -> ArtifactManager:
+        return self._artifacts
+
+    @property
+    def queue_depth(self) -> int:
+        return self._waiting
+
+    @property
+    def overloaded(self) -> bool:
+        return self._semaphore.locked() and self._waiting >= self._max_queue
+
+    async def answer(
+        self,
+        questions: List[str],
+        k: int = 1,
+        answer_all: bool = False,
+        wait: bool = False,
+    ) -> Tuple[List[QuestionAnswer], Dict[str, float]]:
+        """
+        Answers a batch of questions.
+
+        Args:
+            questions (List[str]): the questions to answer
+            k (int): how many answers to find for each question
+            answer_all (bool): whether to answer text the classifier doesn't think is a question
+            wait (bool): whether to wait for a slot even when the queue is full instead of raising an OverloadedError. Callers that already hold their own bound on outstanding batches (like a stream with one batch in flight) can wait.
+
+        Returns:
+            The answers for each question and the time spent in each stage in milliseconds
+        """
+        if not wait and self.overloaded:
+            raise OverloadedError(
+                f"{self._waiting} question answering batches are already waiting"
+            )
+
+        self._waiting += 1
+        _QUEUE_DEPTH.set(self._waiting)
+        start = time.perf_counter()
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self._waiting -= 1
+            _QUEUE_DEPTH.set(self._waiting)
+        queued = (time.perf_counter() - start) * 1000.0
+
+        acquired = self._artifacts.acquire()
+        models = acquired.__enter__()
+
+        def release(_: Optional["asyncio.Future[Any]"]) -> None:
+            acquired.__exit__(None, None, None)
+            self._semaphore.release()
+
+        try:
+            batch = asyncio.get_running_loop().run_in_executor(
+                self._executor,
+                partial(
+                    answer_questions,
+                    models,
+                    questions,
+                    k=k,
+                    answer_all=answer_all,
+                ),
+            )
+        except BaseException:
+            release(None)
+            raise
+        # A thread can't be stopped, so when the caller is cancelled (like when the client disconnects) the batch keeps
+        # running. Its slot and its version of the models are only released once it actually finishes, so
+        # max_concurrency really bounds the work in progress.
+        batch.add_done_callback(release)
+        results, timings = await asyncio.shield(batch)
+
+        timings["queue"] = queued
+        return results, timings
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=True)
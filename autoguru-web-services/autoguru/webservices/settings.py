@@ -1,4 +1,62 @@
 import os
+from typing import Optional
 
 DEBUG = True
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+EMBEDDER_URL: str = os.environ.get(
+    "AUTOGURU_EMBEDDER_URL", "https://tfhub.dev/google/universal-sentence-encoder/4"
+)
+CLASSIFIER_PATH: Optional[str] = os.environ.get("AUTOGURU_CLASSIFIER_PATH")
+INDEX_PATH: Optional[str] = os.environ.get("AUTOGURU_INDEX_PATH")
+INDEX_TYPE: str = os.environ.get("AUTOGURU_INDEX_TYPE", "descent")
+ANSWERS_PATH: Optional[str] = os.environ.get("AUTOGURU_ANSWERS_PATH")
+# How confident the classifier has to be that text is a question to answer it
+MIN_CONFIDENCE: float = float(os.environ.get("AUTOGURU_MIN_CONFIDENCE", "0.5"))
+ARTIFACTS_MANIFEST: Optional[str] = os.environ.get("AUTOGURU_ARTIFACTS_MANIFEST")
+ARTIFACTS_POLL_INTERVAL: float = float(
+    os.environ.get("AUTOGURU_ARTIFACTS_POLL_INTERVAL", "30")
+)
+
+# memory:// keeps admin sessions in the process, which only works with one worker
+ADMIN_CACHE_URL: str = os.environ.get(
+    "AUTOGURU_ADMIN_CACHE_URL", "redis://localhost:6379/7"
+)
+ADMIN_CACHE_MAX_SIZE: int = int(
+    os.environ.get("AUTOGURU_ADMIN_CACHE_MAX_SIZE", "10000")
+)
+ADMIN_PAGE_CACHE_MAX_SIZE: int = int(
+    os.environ.get("AUTOGURU_ADMIN_PAGE_CACHE_MAX_SIZE", "1024")
+)
+ADMIN_PAGE_CACHE_TTL: float = float(
+    os.environ.get("AUTOGURU_ADMIN_PAGE_CACHE_TTL", "60")
+)
+
+# Where each gunicorn worker writes its metrics for /metrics to merge. The server picks a temporary directory when
+# running more than one worker and this isn't set.
+METRICS_DIR: Optional[str] = os.environ.get("AUTOGURU_METRICS_DIR")
+METRICS_WRITE_INTERVAL: float = float(
+    os.environ.get("AUTOGURU_METRICS_WRITE_INTERVAL", "5")
+)
+
+QA_WORKERS: int = int(os.environ.get("AUTOGURU_QA_WORKERS", "4"))
+QA_MAX_CONCURRENCY: int = int(os.environ.get("AUTOGURU_QA_MAX_CONCURRENCY", "8"))
+QA_MAX_QUEUE: int = int(os.environ.get("AUTOGURU_QA_MAX_QUEUE", "64"))
+QA_MAX_BATCH_SIZE: int = int(os.environ.get("AUTOGURU_QA_MAX_BATCH_SIZE", "256"))
+QA_STREAM_BATCH_SIZE: int = int(os.environ.get("AUTOGURU_QA_STREAM_BATCH_SIZE", "64"))
+QA_STREAM_MAX_LINE_BYTES: int = int(
+    os.environ.get("AUTOGURU_QA_STREAM_MAX_LINE_BYTES", "65536")
+)
+
+ANSWER_CACHE_SIZE: int = int(os.environ.get("AUTOGURU_ANSWER_CACHE_SIZE", "4096"))
+ANSWER_CACHE_TTL: float = float(os.environ.get("AUTOGURU_ANSWER_CACHE_TTL", "300"))
+# Set to an empty string to turn off near duplicate matching
+_ANSWER_CACHE_SIMILARITY: str = os.environ.get(
+    "AUTOGURU_ANSWER_CACHE_SIMILARITY", "0.95"
+)
+ANSWER_CACHE_SIMILARITY: Optional[float] = (
+    float(_ANSWER_CACHE_SIMILARITY) if _ANSWER_CACHE_SIMILARITY else None
+)
+ANSWER_CACHE_RECENT_SIZE: int = int(
+    os.environ.get("AUTOGURU_ANSWER_CACHE_RECENT_SIZE", "1024")
+)
@@ -0,0 +1,201 @@
+import asyncio
+import json
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Callable, List, Optional, Tuple, Union
+
+from starlette.responses import StreamingResponse
+from starlette.types import Receive, Scope, Send
+
+from autoguru.webservices.questionanswering import QuestionAnswer
+from autoguru.webservices.service import QuestionAnsweringService
+
+
+class DuplexStreamingResponse(StreamingResponse):
+    """
+    A StreamingResponse whose content is still reading the request body.
+
+    StreamingResponse watches for disconnects by reading from receive, which would steal the body chunks the content is
+    consuming. Instead, this only streams and leaves noticing a disconnect to the body reader.
+    """
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await self.stream_response(send)
+        if self.background is not None:
+            await self.background()
+
+
+@dataclass
+class StreamedQuestion:
+    line: int
+    id: Any
+    question: str
+
+
+@dataclass
+class StreamError:
+    line: int
+    error: str
+
+
+async def read_lines(
+    chunks: AsyncIterator[bytes], max_line_bytes: int
+) -> AsyncIterator[Union[Tuple[int, bytes], StreamError]]:
+    """
+    Splits a chunked body into numbered lines without ever holding more than one line (at most max_line_bytes) in
+    memory. Lines that are too long are skipped and reported as a StreamError in their place.
+    """
+    buffer = bytearray()
+    line = 0
+    skipping = False
+    async for chunk in chunks:
+        start = 0
+        while True:
+            end = chunk.find(b"\n", start)
+            if end == -1:
+                if not skipping:
+                    # Checked before the buffer grows, so it never holds more than one line's worth
+                    if len(buffer) + len(chunk) - start > max_line_bytes:
+                        buffer.clear()
+                        skipping = True
+                    else:
+                        buffer.extend(chunk[start:])
+                break
+
+            line += 1
+            if skipping or len(buffer) + (end - start) > max_line_bytes:
+                skipping = False
+                yield StreamError(
+                    line=line, error=f"line is longer than {max_line_bytes} bytes"
+                )
+            else:
+                buffer.extend(chunk[start:end])
+                yield line, bytes(buffer)
+            buffer.clear()
+            start = end + 1
+
+    if skipping:
+        yield StreamError(
+            line=line + 1, error=f"line is longer than {max_line_bytes} bytes"
+        )
+    elif buffer.strip():
+        yield line + 1, bytes(buffer)
+
+
+def parse_question(line: int, raw: bytes) -> Union[StreamedQuestion, StreamError]:
+    # Each line is either a JSON string or an object with a "question" and an optional "id" that's echoed back
+    try:
+        record = json.loads(raw)
+    except ValueError as error:
+        return StreamError(line=line, error=f"invalid JSON: {error}")
+
+    if isinstance(record, str):
+        return StreamedQuestion(line=line, id=None, question=record)
+    if isinstance(record, dict) and isinstance(record.get("question"), str):
+        return StreamedQuestion(
+            line=line, id=record.get("id"), question=record["question"]
+        )
+    return StreamError(
+        line=line, error='expected a string or an object with a "question" string'
+    )
+
+
+async def read_batches(
+    lines: AsyncIterator[Union[Tuple[int, bytes], StreamError]], batch_size: int
+) -> AsyncIterator[List[Union[StreamedQuestion, StreamError]]]:
+    """
+    Groups the lines into batches of up to batch_size records. A bad line ends its batch, so its error goes back as soon
+    as the questions before it are answered rather than waiting for more questions to follow.
+    """
+    batch: List[Union[StreamedQuestion, StreamError]] = []
+    async for numbered in lines:
+        if isinstance(numbered, StreamError):
+            record: Union[StreamedQuestion, StreamError] = numbered
+        else:
+            line, raw = numbered
+            if not raw.strip():
+                continue
+            record = parse_question(line, raw)
+
+        batch.append(record)
+        if isinstance(record, StreamError) or len(batch) >= batch_size:
+            yield batch
+            batch = []
+
+    if batch:
+        yield batch
+
+
+async def answer_stream(
+    service: QuestionAnsweringService,
+    chunks: AsyncIterator[bytes],
+    render: Callable[[StreamedQuestion, QuestionAnswer], str],
+    k: int = 1,
+    answer_all: bool = False,
+    batch_size: int = 64,
+    max_line_bytes: int = 65536,
+) -> AsyncIterator[bytes]:
+    """
+    Answers a stream of NDJSON questions in micro-batches, yielding one NDJSON line per input line as each batch finishes.
+
+    The next batch is read while the current one is being answered, but only one batch is answered at a time, so memory
+    stays bounded by two batches however large the stream is.
+
+    Args:
+        service (QuestionAnsweringService): the service to answer with
+        chunks (AsyncIterator[bytes]): the raw request body
+        render (Callable[[StreamedQuestion, QuestionAnswer], str]): serializes one answered question to a JSON line
+        k (int): how many answers to find for each question
+        answer_all (bool): whether to answer text the classifier doesn't think is a question
+        batch_size (int): how many questions to answer at once
+        max_line_bytes (int): the longest input line that will be accepted
+
+    Returns:
+        The NDJSON encoded answers
+    """
+    pending: Optional[
+        Tuple[List[Union[StreamedQuestion, StreamError]], asyncio.Future]
+    ] = None
+    try:
+        async for batch in read_batches(
+            read_lines(chunks, max_line_bytes=max_line_bytes), batch_size=batch_size
+        ):
+            questions = [
+                record.question
+                for record in batch
+                if isinstance(record, StreamedQuestion)
+            ]
+            if pending is not None:
+                yield await _render_batch(*pending, render=render)
+                pending = None
+
+            if questions:
+                task = asyncio.ensure_future(
+                    service.answer(questions, k=k, answer_all=answer_all, wait=True)
+                )
+            else:
+                task = asyncio.get_running_loop().create_future()
+                task.set_result(([], {}))
+            pending = (batch, task)
+
+        if pending is not None:
+            yield await _render_batch(*pending, render=render)
+            pending = None
+    finally:
+        if pending is not None:
+            pending[1].cancel()
+
+
+async def _render_batch(
+    batch: List[Union[StreamedQuestion, StreamError]],
+    task: asyncio.Future,
+    render: Callable[[StreamedQuestion, QuestionAnswer], str],
+) -> bytes:
+    results, _ = await task
+    answers = iter(results)
+    lines = []
+    for record in batch:
+        if isinstance(record, StreamError):
+            lines.append(json.dumps({"line": record.line, "error": record.error}))
+        else:
+            lines.append(render(record, next(answers)))
+    return ("\n".join(lines) + "\n").encode("UTF-8")
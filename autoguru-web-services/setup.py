@@ -9,10 +9,15 @@ install_requires = [
     "click",
     "fastapi==0.74.1",
     "uvicorn[standard]",
+    "gunicorn",
     "fastapi-admin",
     "tortoise-orm",
 ]
 
+extras_require = {
+    "benchmark": ["httpx"],
+}
+
 version_file = Path(__file__).parent.joinpath("autoguru", "webservices", "VERSION.txt")
 version = version_file.read_text(encoding="UTF-8").strip()
 
@@ -34,5 +39,6 @@ setup(
     },
     zip_safe=True,
     install_requires=install_requires,
+    extras_require=extras_require,
     include_package_data=True,
 )